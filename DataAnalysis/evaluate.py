@@ -0,0 +1,153 @@
+# evaluate.py
+# Evaluates every predictor in a predictions file against its labels in one pass: confusion matrices,
+# precision/recall/F1/accuracy, and the same metrics at every threshold of a grid, with all figures
+# written to an output directory.
+#
+#   python evaluate.py preds_data.json --out figures
+#   python evaluate.py predictions/ --out figures --chunk-size 1000000
+#
+# The input is either a JSON object of equal-length lists (like preds_data.json: "Labels" and one list
+# per predictor, such as "G-Pred" and "P-Pred"), or a directory holding one <name>.npy file per list,
+# which is memory-mapped and read in chunks so files with millions of rows fit in memory. Predictions
+# may be 0/1 labels or scores in [0, 1]; 1 means toxic.
+import argparse
+import csv
+import json
+import os
+import matplotlib
+matplotlib.use("Agg") # Write figures to files without a display
+import matplotlib.pyplot as plt
+import numpy as np
+from generate_matrices import plot_confusion_matrix
+
+LABELS = "Labels"
+
+
+def load_columns(path):
+    '''
+    Map from column name to array: memory-mapped .npy files for a directory, otherwise a JSON file.
+    '''
+    if os.path.isdir(path):
+        return {name[:-len(".npy")]: np.load(os.path.join(path, name), mmap_mode='r')
+                for name in sorted(os.listdir(path)) if name.endswith(".npy")}
+    with open(path) as f:
+        return {name: np.asarray(values) for name, values in json.load(f).items()}
+
+
+def save_columns(columns, directory):
+    '''
+    Write columns as one .npy file each, the input format for large prediction sets.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    for name, values in columns.items():
+        np.save(os.path.join(directory, name + ".npy"), np.asarray(values))
+
+
+class Evaluation:
+    '''
+    Counts, for every predictor, how many positive and negative examples have a score in each interval
+    between consecutive thresholds. That histogram is all the metrics at every threshold need, so rows
+    are only looked at once, a chunk at a time, with array operations.
+    '''
+    def __init__(self, predictors, thresholds):
+        self.predictors = list(predictors)
+        self.thresholds = np.asarray(thresholds, dtype=np.float64)
+        self.counts = np.zeros((len(self.predictors), len(self.thresholds) + 1, 2), dtype=np.int64)
+
+    def update(self, labels, scores):
+        '''
+        Add a chunk: `labels` has shape (n,), `scores` shape (predictors, n).
+        '''
+        bins = np.searchsorted(self.thresholds, scores, side='right') # Number of thresholds each score reaches
+        index = (np.arange(len(self.predictors))[:, None] * (len(self.thresholds) + 1) + bins) * 2 + labels.astype(np.int64)
+        self.counts += np.bincount(index.ravel(), minlength=self.counts.size).reshape(self.counts.shape)
+
+    def confusion(self):
+        '''
+        TP, FP, FN and TN for each (predictor, threshold), predicting toxic when score >= threshold.
+        '''
+        reached = self.counts[:, ::-1].cumsum(axis=1)[:, ::-1] # reached[:, k]: examples reaching threshold k - 1 or more
+        tp, fp = reached[:, 1:, 1], reached[:, 1:, 0]
+        positives, negatives = self.counts[:, :, 1].sum(axis=1), self.counts[:, :, 0].sum(axis=1)
+        return tp, fp, positives[:, None] - tp, negatives[:, None] - fp
+
+    def metrics(self):
+        tp, fp, fn, tn = self.confusion()
+        precision = np.divide(tp, tp + fp, out=np.zeros(tp.shape), where=tp + fp > 0)
+        recall = np.divide(tp, tp + fn, out=np.zeros(tp.shape), where=tp + fn > 0)
+        f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(tp.shape), where=precision + recall > 0)
+        accuracy = (tp + tn) / np.maximum(tp + fp + fn + tn, 1)
+        return {"tp": tp, "fp": fp, "fn": fn, "tn": tn, "precision": precision, "recall": recall, "f1": f1, "accuracy": accuracy}
+
+
+def evaluate(columns, predictors, thresholds, chunk_size=1 << 20):
+    labels = columns[LABELS]
+    evaluation = Evaluation(predictors, thresholds)
+    for start in range(0, len(labels), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        scores = np.stack([np.asarray(columns[name][chunk], dtype=np.float64) for name in predictors])
+        evaluation.update(np.asarray(labels[chunk]), scores)
+    return evaluation
+
+
+def write_results(evaluation, decision_threshold, out):
+    '''
+    Print the metrics at the decision threshold and write the per-threshold table and all figures.
+    '''
+    os.makedirs(out, exist_ok=True)
+    metrics = evaluation.metrics()
+    thresholds = evaluation.thresholds
+    at = int(np.argmin(np.abs(thresholds - decision_threshold)))
+    best = metrics["f1"].argmax(axis=1)
+
+    print(f"{'predictor':>10} {'TN':>8} {'FP':>8} {'FN':>8} {'TP':>8} {'precision':>10} {'recall':>7} {'f1':>6} {'accuracy':>9} "
+          f"{'best f1':>8} {'at':>5}")
+    for p, name in enumerate(evaluation.predictors):
+        print(f"{name:>10} {metrics['tn'][p, at]:>8} {metrics['fp'][p, at]:>8} {metrics['fn'][p, at]:>8} {metrics['tp'][p, at]:>8} "
+              f"{metrics['precision'][p, at]:>10.3f} {metrics['recall'][p, at]:>7.3f} {metrics['f1'][p, at]:>6.3f} "
+              f"{metrics['accuracy'][p, at]:>9.3f} {metrics['f1'][p, best[p]]:>8.3f} {thresholds[best[p]]:>5.2f}")
+        plot_confusion_matrix(np.array([[metrics['tn'][p, at], metrics['fp'][p, at]], [metrics['fn'][p, at], metrics['tp'][p, at]]]),
+                              os.path.join(out, f"confusion_{name}.png"))
+
+    with open(os.path.join(out, "thresholds.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        names = ["tp", "fp", "fn", "tn", "precision", "recall", "f1", "accuracy"]
+        writer.writerow(["predictor", "threshold"] + names)
+        for p, name in enumerate(evaluation.predictors):
+            writer.writerows([name, f"{threshold:g}"] + [metrics[metric][p, t] for metric in names]
+                             for t, threshold in enumerate(thresholds))
+
+    figure, axes = plt.subplots(1, 3, figsize=(15, 4), sharey=True)
+    for metric, axis in zip(["precision", "recall", "f1"], axes):
+        for p, name in enumerate(evaluation.predictors):
+            axis.plot(thresholds, metrics[metric][p], label=name)
+        axis.set_title(metric)
+        axis.set_xlabel("threshold")
+    axes[0].legend()
+    figure.savefig(os.path.join(out, "thresholds.png"), bbox_inches="tight")
+    plt.close(figure)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data", nargs="?", default="preds_data.json", help="JSON file or directory of .npy files")
+    parser.add_argument("--out", default="figures")
+    parser.add_argument("--predictors", nargs="+", help="columns to evaluate (default: every column but Labels)")
+    parser.add_argument("--threshold", type=float, default=0.5, help="decision threshold for the confusion matrices")
+    parser.add_argument("--steps", type=int, default=100, help="number of intervals in the threshold grid over [0, 1]")
+    parser.add_argument("--chunk-size", type=int, default=1 << 20)
+    parser.add_argument("--save-npy", metavar="DIR", help="also write the input as a directory of .npy files")
+    args = parser.parse_args()
+
+    columns = load_columns(args.data)
+    if args.save_npy:
+        save_columns(columns, args.save_npy)
+    predictors = args.predictors or [name for name in columns if name != LABELS]
+    thresholds = np.union1d(np.linspace(0, 1, args.steps + 1), [args.threshold])
+    evaluation = evaluate(columns, predictors, thresholds, args.chunk_size)
+    write_results(evaluation, args.threshold, args.out)
+    print(f"{len(columns[LABELS])} rows, figures and thresholds.csv written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
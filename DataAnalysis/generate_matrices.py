@@ -1,25 +1,40 @@
-import matplotlib.pyplot as plt
-import numpy as np
-from sklearn import metrics
-
-def generate_confusion_matrix(actual, predicted, save_name):
-    '''
-    This function will generate a confusion matrix for the specified dataset
-    and save it in the same directory.
-    Arguments:
-        actual - List of actual labels (0s and 1s)
-        predicted - List of predicted 
-    '''
-    confusion_matrix = metrics.confusion_matrix(actual, predicted)
-    cm_display = metrics.ConfusionMatrixDisplay(confusion_matrix = confusion_matrix, display_labels = ["Toxic", "Non-toxic"])
-
-    cm_display.plot()
-    plt.show()
-    plt.savefig(save_name)
-
-if __name__ == '__main__':
-    datasets = []
-
-    # For each dataset, generate a confusion matrix and save the image
-    for dataset in datasets:
-        generate_confusion_matrix(actual, predicted, save_name)
\ No newline at end of file
+import matplotlib
+matplotlib.use("Agg") # Write figures to files without a display
+import matplotlib.pyplot as plt
+from sklearn import metrics
+
+DISPLAY_LABELS = ["Non-toxic", "Toxic"] # Label 0, label 1
+
+def plot_confusion_matrix(confusion_matrix, save_name):
+    '''
+    This function will plot a confusion matrix that has already been computed
+    and save it as an image.
+    Arguments:
+        confusion_matrix - 2x2 array of counts, rows actual and columns predicted (0, 1)
+        save_name - Path of the image to write
+    '''
+    cm_display = metrics.ConfusionMatrixDisplay(confusion_matrix = confusion_matrix, display_labels = DISPLAY_LABELS)
+
+    cm_display.plot()
+    plt.savefig(save_name)
+    plt.close(cm_display.figure_)
+
+def generate_confusion_matrix(actual, predicted, save_name):
+    '''
+    This function will generate a confusion matrix for the specified dataset
+    and save it in the same directory.
+    Arguments:
+        actual - List of actual labels (0s and 1s)
+        predicted - List of predicted labels (0s and 1s)
+        save_name - Path of the image to write
+    '''
+    plot_confusion_matrix(metrics.confusion_matrix(actual, predicted, labels = [0, 1]), save_name)
+
+if __name__ == '__main__':
+    import json
+    with open("preds_data.json") as f:
+        data = json.load(f)
+
+    # For each predictor, generate a confusion matrix and save the image
+    for predictor in ["G-Pred", "P-Pred"]:
+        generate_confusion_matrix(data["Labels"], data[predictor], f"confusion_{predictor}.png")
@@ -0,0 +1,270 @@
+# sweep.py
+# Tunes the bot's Perspective thresholds from recorded scores: the ROC and precision-recall curve of
+# every attribute, their areas, and the threshold per attribute that best meets the objective. The bot
+# flags a message if any attribute is over its threshold, so the thresholds are then tuned jointly for
+# that combined rule, and the combined rule's precision and recall are reported for the per-attribute
+# thresholds, the joint ones and those in --config. The joint thresholds are the ones written to
+# --config.
+#
+#   python sweep.py scores.json --out figures --config ../DiscordBot/thresholds.json
+#   python sweep.py scores.json --min-precision 0.9
+#
+# The input is the output of DiscordBot/record_scores.py: "Labels" plus one list of scores per attribute
+# (TOXICITY, IDENTITY_ATTACK, ...), or a directory of .npy files holding the same columns. A column named
+# "Labels-<ATTRIBUTE>" labels that attribute on its own; otherwise every attribute is scored against
+# "Labels". Rows without a score for an attribute are left out of its curves.
+import argparse
+import json
+import os
+import matplotlib
+matplotlib.use("Agg") # Write figures to files without a display
+import matplotlib.pyplot as plt
+import numpy as np
+from evaluate import LABELS, load_columns
+
+
+class Sweep:
+    '''
+    Every operating point of every attribute at once. Each attribute's scores are sorted once, highest
+    first; running sums of the sorted labels then give the true and false positives for a threshold
+    just below each score, and the last position of every distinct score is one point on the curves.
+    '''
+    def __init__(self, attributes, labels, scores):
+        '''
+        `labels` and `scores` have shape (attributes, n); NaN scores are missing.
+        '''
+        self.attributes = list(attributes)
+        present = ~np.isnan(scores)
+        scores = np.where(present, scores, -np.inf) # Missing scores sort last, where they count for nothing
+        order = np.argsort(-scores, axis=1, kind='stable')
+        self.scores = np.take_along_axis(scores, order, axis=1)
+        positive = np.take_along_axis(labels.astype(bool) & present, order, axis=1)
+        negative = np.take_along_axis(~labels.astype(bool) & present, order, axis=1)
+        self.tp = positive.cumsum(axis=1)
+        self.fp = negative.cumsum(axis=1)
+        self.positives = self.tp[:, -1]
+        self.negatives = self.fp[:, -1]
+
+        # A point ends each run of equal scores, since a threshold can't split tied rows
+        last = np.ones(self.scores.shape, dtype=bool)
+        last[:, :-1] = self.scores[:, :-1] != self.scores[:, 1:]
+        self.points = last & np.isfinite(self.scores)
+
+        # The bot flags scores strictly above its threshold, so each point's threshold lies halfway
+        # to the next lower distinct score
+        below = np.full(self.scores.shape, -np.inf)
+        below[:, :-1] = self.scores[:, 1:]
+        below = np.where(np.isfinite(below), below, np.nextafter(self.scores, -np.inf))
+        self.thresholds = (self.scores + below) / 2
+
+        self.precision = self.tp / np.maximum(self.tp + self.fp, 1)
+        self.recall = self.tp / np.maximum(self.positives, 1)[:, None]
+        self.fpr = self.fp / np.maximum(self.negatives, 1)[:, None]
+        self.f1 = np.divide(2 * self.precision * self.recall, self.precision + self.recall,
+                            out=np.zeros(self.tp.shape), where=self.precision + self.recall > 0)
+
+    def _previous(self, values):
+        '''
+        For every position, `values` at the previous point of its attribute (0 before the first point).
+        '''
+        index = np.where(self.points, np.arange(self.points.shape[1]), -1)
+        previous = np.full(index.shape, -1)
+        previous[:, 1:] = np.maximum.accumulate(index, axis=1)[:, :-1]
+        return np.where(previous >= 0, np.take_along_axis(values, np.maximum(previous, 0), axis=1), 0.0)
+
+    def roc_auc(self):
+        area = (self.fpr - self._previous(self.fpr)) * (self.recall + self._previous(self.recall)) / 2
+        return np.where(self.points, area, 0.0).sum(axis=1)
+
+    def average_precision(self):
+        area = (self.recall - self._previous(self.recall)) * self.precision
+        return np.where(self.points, area, 0.0).sum(axis=1)
+
+    def best(self, min_precision=None):
+        '''
+        Index of the chosen point of each attribute: the highest F1, or with `min_precision`, the
+        highest recall among points at least that precise (the most precise point if none is).
+        '''
+        if min_precision is None:
+            objective = self.f1
+        else:
+            precise = self.precision >= min_precision
+            objective = np.where(precise, self.recall + 1, self.precision) # Any precise point beats every other one
+        return np.where(self.points, objective, -np.inf).argmax(axis=1)
+
+    def curve(self, a):
+        '''
+        (thresholds, precision, recall, fpr) at the points of attribute `a`, highest threshold first.
+        '''
+        points = self.points[a]
+        return self.thresholds[a, points], self.precision[a, points], self.recall[a, points], self.fpr[a, points]
+
+
+class CombinedRule:
+    '''
+    The rule the bot applies: a row is flagged if any attribute scores strictly above its threshold,
+    and a missing score flags nothing. Scored against the shared labels.
+    '''
+    def __init__(self, attributes, labels, scores):
+        self.attributes = list(attributes)
+        self.labels = labels.astype(bool)
+        self.scores = np.where(np.isnan(scores), -np.inf, scores)
+
+    def evaluate(self, thresholds):
+        '''
+        Precision, recall, false positive rate and F1 of the rule with `thresholds` (one per attribute).
+        '''
+        flagged = (self.scores > np.asarray(thresholds, dtype=np.float64)[:, None]).any(axis=0)
+        tp = np.count_nonzero(flagged & self.labels)
+        fp = np.count_nonzero(flagged & ~self.labels)
+        positives = np.count_nonzero(self.labels)
+        precision = tp / max(tp + fp, 1)
+        recall = tp / max(positives, 1)
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {"precision": precision, "recall": recall, "fpr": fp / max(len(self.labels) - positives, 1), "f1": f1}
+
+    def tune(self, thresholds, min_precision=None, rounds=20):
+        '''
+        Tune the thresholds together by coordinate ascent from `thresholds`, for the same objective as
+        Sweep.best: each attribute in turn gets the threshold that is best for the combined rule with
+        the others fixed, until no threshold changes. Only reaches a local optimum.
+        '''
+        thresholds = np.array(thresholds, dtype=np.float64)
+        positives = np.count_nonzero(self.labels)
+        for _ in range(rounds):
+            changed = False
+            for a in range(len(self.attributes)):
+                others = np.delete(np.arange(len(self.attributes)), a)
+                by_others = (self.scores[others] > thresholds[others, None]).any(axis=0)
+                base_tp = np.count_nonzero(by_others & self.labels)
+                base_fp = np.count_nonzero(by_others & ~self.labels)
+                # Rows only this attribute can flag, highest score first; as in Sweep, each run of
+                # equal scores ends at a threshold halfway to the next lower score
+                rest = ~by_others & np.isfinite(self.scores[a])
+                order = np.argsort(-self.scores[a, rest], kind='stable')
+                scores, labels = self.scores[a, rest][order], self.labels[rest][order]
+                last = np.r_[scores[:-1] != scores[1:], True][:len(scores)]
+                below = np.r_[scores[1:], np.nextafter(scores[-1:], -np.inf)]
+                # A threshold of 1 flags nothing more than the other attributes do
+                candidates = np.r_[1.0, ((scores + below) / 2)[last]]
+                tp = np.r_[base_tp, base_tp + labels.cumsum()[last]]
+                fp = np.r_[base_fp, base_fp + (~labels).cumsum()[last]]
+                precision = tp / np.maximum(tp + fp, 1)
+                recall = tp / max(positives, 1)
+                if min_precision is None:
+                    objective = np.divide(2 * precision * recall, precision + recall,
+                                          out=np.zeros(len(tp)), where=precision + recall > 0)
+                else:
+                    objective = np.where(precision >= min_precision, recall + 1, precision)
+                best = candidates[objective.argmax()]
+                if best != thresholds[a]:
+                    thresholds[a] = best
+                    changed = True
+            if not changed:
+                break
+        return thresholds
+
+
+def load_sweep(columns, attributes):
+    scores = np.stack([np.asarray(columns[name], dtype=np.float64) for name in attributes])
+    labels = np.stack([np.asarray(columns.get(f"{LABELS}-{name}", columns[LABELS]), dtype=np.int64) for name in attributes])
+    return Sweep(attributes, labels, scores), CombinedRule(attributes, np.asarray(columns[LABELS], dtype=np.int64), scores)
+
+
+def write_results(sweep, chosen, out):
+    '''
+    Print each attribute's areas and chosen threshold, and write roc.png and pr.png.
+    '''
+    os.makedirs(out, exist_ok=True)
+    auc, ap = sweep.roc_auc(), sweep.average_precision()
+    print(f"{'attribute':>18} {'rows':>8} {'roc auc':>8} {'ap':>6} {'threshold':>10} {'precision':>10} {'recall':>7} {'f1':>6}")
+    for a, name in enumerate(sweep.attributes):
+        i = chosen[a]
+        rows = sweep.positives[a] + sweep.negatives[a]
+        print(f"{name:>18} {rows:>8} {auc[a]:>8.3f} {ap[a]:>6.3f} {sweep.thresholds[a, i]:>10.4f} "
+              f"{sweep.precision[a, i]:>10.3f} {sweep.recall[a, i]:>7.3f} {sweep.f1[a, i]:>6.3f}")
+
+    roc, roc_axis = plt.subplots(figsize=(6, 6))
+    pr, pr_axis = plt.subplots(figsize=(6, 6))
+    for a, name in enumerate(sweep.attributes):
+        _, precision, recall, fpr = sweep.curve(a)
+        roc_axis.plot(np.r_[0, fpr], np.r_[0, recall], label=f"{name} ({auc[a]:.3f})")
+        pr_axis.plot(recall, precision, label=f"{name} ({ap[a]:.3f})")
+    roc_axis.plot([0, 1], [0, 1], color="grey", linestyle=":")
+    roc_axis.set(title="ROC", xlabel="false positive rate", ylabel="true positive rate")
+    pr_axis.set(title="Precision-recall", xlabel="recall", ylabel="precision")
+    for figure, axis, name in [(roc, roc_axis, "roc.png"), (pr, pr_axis, "pr.png")]:
+        axis.legend(fontsize="small")
+        figure.savefig(os.path.join(out, name), bbox_inches="tight")
+        plt.close(figure)
+
+
+def configured_thresholds(path, attributes):
+    '''
+    The per-attribute Perspective thresholds in the bot's thresholds file, or None if there is none.
+    '''
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        perspective = json.load(f).get("perspective", {})
+    default = perspective.get("default", 0.6)
+    return [perspective.get(name, default) for name in attributes]
+
+
+def write_combined(rule, candidates):
+    '''
+    Print the combined rule's precision and recall for each named set of thresholds.
+    '''
+    print("\ncombined rule (flag if any attribute is over its threshold):")
+    print(f"{'thresholds':>18} {'precision':>10} {'recall':>7} {'fpr':>7} {'f1':>6}  " + " ".join(rule.attributes))
+    for name, thresholds in candidates:
+        result = rule.evaluate(thresholds)
+        print(f"{name:>18} {result['precision']:>10.3f} {result['recall']:>7.3f} {result['fpr']:>7.4f} {result['f1']:>6.3f}  "
+              + " ".join(f"{threshold:.4f}" for threshold in thresholds))
+
+
+def update_config(path, thresholds):
+    '''
+    Set the per-attribute Perspective thresholds in the bot's thresholds file, keeping everything else.
+    '''
+    config = {}
+    if os.path.isfile(path):
+        with open(path) as f:
+            config = json.load(f)
+    config.setdefault("perspective", {}).update(thresholds)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=4)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data", nargs="?", default="scores.json", help="JSON file or directory of .npy files")
+    parser.add_argument("--out", default="figures")
+    parser.add_argument("--attributes", nargs="+", help="columns to sweep (default: every upper-case column)")
+    parser.add_argument("--min-precision", type=float, help="maximize recall at this precision instead of maximizing F1")
+    parser.add_argument("--config", help="thresholds file to write the chosen thresholds into")
+    args = parser.parse_args()
+
+    columns = load_columns(args.data)
+    attributes = args.attributes or [name for name in columns if name.isupper()]
+    sweep, rule = load_sweep(columns, attributes)
+    chosen = sweep.best(args.min_precision)
+    write_results(sweep, chosen, args.out)
+
+    separate = sweep.thresholds[np.arange(len(attributes)), chosen]
+    joint = rule.tune(separate, args.min_precision)
+    candidates = [("per attribute", separate), ("joint", joint)]
+    current = configured_thresholds(args.config, attributes)
+    if current is not None:
+        candidates.insert(0, ("current", current))
+    write_combined(rule, candidates)
+    if args.config:
+        update_config(args.config, {name: float(joint[a]) for a, name in enumerate(attributes)})
+        print(f"joint thresholds written to {args.config}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# author_rates.py
+import time
+from collections import OrderedDict
+
+
+class AuthorRateTracker:
+    '''
+    How fast each author is posting in each channel, as a token bucket per (channel ID, author ID): it
+    holds up to `burst` messages and refills at `rate` messages per second, so an author can post a
+    burst of `burst` messages and then `rate` per second on average. A message that finds the bucket
+    empty is over the limit.
+
+    Each bucket is two floats and a flag, so memory is bounded per author. Buckets are kept in order of
+    last use; authors who haven't posted for `idle_after` seconds (by then their bucket is full again,
+    so forgetting them changes nothing) are evicted oldest first, two for every new author, so a crowd
+    leaving doesn't stall one message. At most `max_authors` buckets are kept. Every operation is O(1)
+    however many authors are tracked.
+    '''
+    def __init__(self, rate=0.5, burst=8, idle_after=300.0, max_authors=2000000):
+        self.rate = rate
+        self.burst = burst
+        self.idle_after = max(idle_after, burst / rate)
+        self.max_authors = max_authors
+        self.buckets = OrderedDict() # Map from (channel ID, author ID) to [tokens, last message time, throttled], oldest use first
+
+        self.messages = 0
+        self.throttles = 0 # Times an author went over the limit
+        self.evictions = 0
+
+    def record(self, channel_id, author_id, now=None):
+        '''
+        Count a message and return whether it is over the author's limit in this channel.
+        '''
+        now = time.monotonic() if now is None else now
+        self.messages += 1
+        key = (channel_id, author_id)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            self._evict(now)
+            bucket = self.buckets[key] = [float(self.burst), now, False]
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            # An author is let off once they have slowed down to half a burst
+            if bucket[2] and bucket[0] >= self.burst / 2:
+                bucket[2] = False
+            return False
+        return True
+
+    def throttle(self, channel_id, author_id):
+        '''
+        Mark an author who went over the limit as throttled. Returns True the first time in a burst, when
+        the bot should act on it, and False while they are still throttled.
+        '''
+        bucket = self.buckets.get((channel_id, author_id))
+        if bucket is None or bucket[2]:
+            return False
+        bucket[2] = True
+        self.throttles += 1
+        return True
+
+    def pressure(self, channel_id, author_id, now=None):
+        '''
+        How much of their burst an author has used up in a channel, from 0 (posting slowly or not at
+        all) to 1 (over the limit).
+        '''
+        bucket = self.buckets.get((channel_id, author_id))
+        if bucket is None:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        return 1 - tokens / self.burst
+
+    def _evict(self, now):
+        buckets = self.buckets
+        while len(buckets) >= self.max_authors:
+            buckets.popitem(last=False)
+            self.evictions += 1
+        for _ in range(2):
+            if not buckets or next(iter(buckets.values()))[1] > now - self.idle_after:
+                return
+            buckets.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        return {"authors": len(self.buckets),
+                "messages": self.messages,
+                "throttles": self.throttles,
+                "evictions": self.evictions}
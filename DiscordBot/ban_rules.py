@@ -0,0 +1,576 @@
+# ban_rules.py
+import asyncio
+import itertools
+import json
+import logging
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from re import _parser as sre_parse
+except ImportError: # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger('discord')
+
+# ASCII letters whose case-insensitive match includes a non-ASCII character (İ, ı, K, ſ), which
+# would break the lower-cased prefilter below
+_UNSAFE_FOLDS = set("iIkKsS")
+
+# Quantifiers and groups that never backtrack into their contents (Python 3.11+)
+_ATOMIC = {op for op in (getattr(sre_parse, "POSSESSIVE_REPEAT", None), getattr(sre_parse, "ATOMIC_GROUP", None)) if op is not None}
+
+
+class UnsafeRegexError(Exception):
+    '''
+    Raised when a pattern is likely to backtrack catastrophically on some inputs.
+    '''
+
+
+def _first_chars(items):
+    '''
+    Characters a sequence can start with, or None if that can't be pinned down to a set of literals.
+    An empty set means the sequence can match the empty string.
+    '''
+    for op, av in items:
+        if op is sre_parse.LITERAL:
+            return {av}
+        if op is sre_parse.SUBPATTERN:
+            return _first_chars(av[3])
+        if op is sre_parse.AT:
+            continue
+        return None
+    return set()
+
+
+def _overlapping_alternatives(items):
+    '''
+    Whether any alternation in a sequence, however deeply nested, has two alternatives that can start
+    with the same character, or an alternative that can be empty. sre_parse moves a prefix shared by
+    every alternative out of the alternation, so (a|aa) arrives as "a" followed by (|a).
+    '''
+    for op, av in items:
+        if op in _ATOMIC:
+            continue
+        if op is sre_parse.BRANCH:
+            seen = set()
+            for branch in av[1]:
+                first = _first_chars(branch)
+                if not first or seen & first:
+                    return True
+                seen |= first
+            if any(_overlapping_alternatives(branch) for branch in av[1]):
+                return True
+        elif op is sre_parse.SUBPATTERN:
+            if _overlapping_alternatives(av[3]):
+                return True
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if _overlapping_alternatives(av[2]):
+                return True
+    return False
+
+
+def redos_risk(compiled):
+    '''
+    Statically look for the shapes that make a backtracking engine take exponential time: a repeated
+    quantifier inside an unbounded quantifier, e.g. (a+)+, and an unbounded quantifier over
+    alternatives that can start with the same character or be empty, e.g. (a|ab)*. Returns a description of the
+    problem, or None. Possessive quantifiers and atomic groups are treated as safe.
+    '''
+    def walk(items, in_unbounded):
+        for op, av in items:
+            if op in _ATOMIC:
+                continue
+            if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+                low, high, body = av
+                if high > 1 and in_unbounded:
+                    return "nested quantifiers"
+                # Large fixed counts such as (.*a){20} blow up just like unbounded ones
+                unbounded = high == sre_parse.MAXREPEAT or high >= 10
+                if unbounded and _overlapping_alternatives(body):
+                    return "overlapping alternatives inside a quantifier"
+                problem = walk(body, in_unbounded or unbounded)
+            elif op is sre_parse.SUBPATTERN:
+                problem = walk(av[3], in_unbounded)
+            elif op is sre_parse.BRANCH:
+                problem = next((p for p in (walk(branch, in_unbounded) for branch in av[1]) if p), None)
+            elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+                problem = walk(av[1], in_unbounded)
+            else:
+                problem = None
+            if problem:
+                return problem
+        return None
+
+    return walk(sre_parse.parse(compiled.pattern, compiled.flags), False)
+
+
+def validate_pattern(pattern):
+    '''
+    Compile a moderator-supplied pattern, raising re.error if it is invalid or UnsafeRegexError if it
+    is prone to catastrophic backtracking.
+    '''
+    compiled = re.compile(pattern)
+    problem = redos_risk(compiled)
+    if problem:
+        raise UnsafeRegexError(f"{problem}; rewrite it with possessive quantifiers (a++) or atomic groups (?>...)")
+    return compiled
+
+
+def required_literal(compiled):
+    '''
+    Find the longest run of literal characters that every match of the pattern must contain, or None.
+    Only the top level of the pattern (and plain groups in it) is inspected, which is enough for the
+    word-like patterns moderators tend to ban. Case-insensitive literals are returned lower-cased.
+    '''
+    ignorecase = bool(compiled.flags & re.IGNORECASE)
+    runs, current = [], []
+
+    def walk(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL and not (ignorecase and (av > 127 or chr(av) in _UNSAFE_FOLDS)):
+                current.append(chr(av))
+            elif op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+                walk(av[3])
+            else:
+                runs.append("".join(current))
+                current.clear()
+
+    walk(sre_parse.parse(compiled.pattern, compiled.flags))
+    runs.append("".join(current))
+    literal = max(runs, key=len)
+    if len(literal) < 2:
+        return None
+    return literal.lower() if ignorecase else literal
+
+
+def trie_regex(literals):
+    '''
+    Build a regex matching any of the literals, factored as a trie so the engine follows one branch
+    per character instead of trying every literal at every position. Wrapped in a lookahead so that
+    finditer reports the longest literal starting at every position, including overlapping ones.
+    '''
+    trie = {}
+    for literal in literals:
+        node = trie
+        for ch in literal:
+            node = node.setdefault(ch, {})
+        node[""] = None
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch != ""]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        # A literal ending here makes the rest optional; greedy matching still prefers the longest
+        return "(?:" + body + ")?" if "" in node else body
+
+    return re.compile("(?=(" + build(trie) + "))")
+
+
+class BanRule:
+    '''
+    A regex a moderator has banned from a channel, compiled and checked once when it is added.
+    '''
+    def __init__(self, id, channel, pattern):
+        self.id = id
+        self.channel = channel
+        self.pattern = pattern
+        self.compiled = validate_pattern(pattern)
+        self.literal = required_literal(self.compiled)
+        self.ignorecase = bool(self.compiled.flags & re.IGNORECASE)
+
+        # Runtime statistics, kept up to date by the RegexSandbox
+        self.match_seconds = 0.0 # Total time spent running this rule
+        self.runs = 0
+        self.hits = 0
+        self.timeouts = 0
+        self.disabled = False
+
+
+class LiteralFilter:
+    '''
+    Finds which of a set of literals occur in a text, in one pass of a trie-shaped regex.
+    '''
+    def __init__(self, literals):
+        self.regex = trie_regex(literals)
+        # The scan only reports the longest literal at each position, so also remember which
+        # shorter literals are prefixes of each literal
+        known = set(literals)
+        self.prefixes = {literal: [literal[:end] for end in range(2, len(literal) + 1) if literal[:end] in known]
+                         for literal in literals}
+
+    def found(self, text):
+        found = set()
+        for m in self.regex.finditer(text):
+            found.update(self.prefixes[m.group(1)])
+        return found
+
+
+class ChannelRules:
+    '''
+    All the ban rules for one channel. Rules with a required literal are only run on messages that
+    contain that literal; rules without one are always run.
+    '''
+    def __init__(self):
+        self.rules = {} # Map from rule ID to rule, in the order they were added
+        self.dirty = True
+
+    def rebuild(self):
+        self.by_literal = {} # Map from (ignorecase, literal) to the rules requiring it
+        self.unfiltered = []
+        for rule in self.rules.values():
+            if rule.disabled:
+                continue
+            if rule.literal is None:
+                self.unfiltered.append(rule)
+            else:
+                self.by_literal.setdefault((rule.ignorecase, rule.literal), []).append(rule)
+
+        sensitive = [literal for ignorecase, literal in self.by_literal if not ignorecase]
+        insensitive = [literal for ignorecase, literal in self.by_literal if ignorecase]
+        self.sensitive = LiteralFilter(sensitive) if sensitive else None
+        self.insensitive = LiteralFilter(insensitive) if insensitive else None
+        self.dirty = False
+
+    def candidates(self, text):
+        candidates = list(self.unfiltered)
+        if self.sensitive is not None:
+            for literal in self.sensitive.found(text):
+                candidates.extend(self.by_literal[(False, literal)])
+        if self.insensitive is not None:
+            for literal in self.insensitive.found(text.lower()):
+                candidates.extend(self.by_literal[(True, literal)])
+        return candidates
+
+    def match(self, text):
+        for rule in self.sorted_candidates(text):
+            if rule.compiled.search(text):
+                return rule
+        return None
+
+    def sorted_candidates(self, text):
+        if self.dirty:
+            self.rebuild()
+        return sorted(self.candidates(text), key=lambda rule: rule.id)
+
+
+class BanRuleIndex:
+    '''
+    Index of ban rules by channel name. A channel can have any number of rules; each is compiled when
+    it is added, and a message is checked against all of its channel's rules with a single literal
+    prefilter pass followed by the full regex of only the rules it could match. If a store is given,
+    every change is saved to it and `load` restores the rules after a restart; rules other processes
+    save to the same store are picked up by `refresh`, at most every `refresh_interval` seconds.
+    '''
+    def __init__(self, store=None, refresh_interval=1.0):
+        self.channels = {} # Map from channel name to its ChannelRules
+        self.store = store
+        self.refresh_interval = refresh_interval
+        self._ids = itertools.count(1)
+        self.version = None # The store's ban rules version when the rules were last loaded
+        self.last_refresh = time.monotonic()
+
+    def load(self):
+        # Rules that are already loaded keep their runtime statistics
+        loaded = {rule.id: rule for rule in self.rules()}
+        self.version = self.store.ban_rules_version()
+        self.channels = {}
+        for rule_id, channel, pattern, disabled in self.store.ban_rules():
+            rule = loaded.get(rule_id)
+            if rule is None or rule.pattern != pattern or rule.channel != channel:
+                rule = BanRule(rule_id, channel, pattern)
+            rule.disabled = bool(disabled)
+            self._insert(rule)
+
+    def refresh(self):
+        '''
+        Reload the rules if another process changed them since they were loaded. Returns whether it did.
+        '''
+        now = time.monotonic()
+        if self.store is None or now - self.last_refresh < self.refresh_interval:
+            return False
+        self.last_refresh = now
+        if self.store.ban_rules_version() == self.version:
+            return False
+        self.load()
+        return True
+
+    def _insert(self, rule):
+        rules = self.channels.setdefault(rule.channel, ChannelRules())
+        rules.rules[rule.id] = rule
+        rules.dirty = True # The prefilter is rebuilt on the next match, once per burst of new rules
+        return rule
+
+    def add(self, channel, pattern):
+        '''
+        Ban a pattern from a channel and return the new rule. Raises re.error if the pattern is invalid
+        and UnsafeRegexError if it could backtrack catastrophically.
+        '''
+        rule = BanRule(None, channel, pattern)
+        rule.id = self.store.next_ban_rule_id() if self.store is not None else next(self._ids)
+        self._insert(rule)
+        if self.store is not None:
+            self._saved(self.store.save_ban_rule(rule))
+        return rule
+
+    def remove(self, rule_id):
+        for channel, rules in self.channels.items():
+            if rule_id in rules.rules:
+                del rules.rules[rule_id]
+                rules.dirty = True
+                if not rules.rules:
+                    del self.channels[channel]
+                if self.store is not None:
+                    self._saved(self.store.delete_ban_rule(rule_id))
+                return True
+        return False
+
+    def disable(self, rule):
+        rule.disabled = True
+        if rule.channel in self.channels:
+            self.channels[rule.channel].dirty = True
+        if self.store is not None:
+            self._saved(self.store.save_ban_rule(rule))
+
+    def enable(self, rule_id):
+        '''
+        Turn a disabled rule back on, with its strikes cleared. Returns the rule, or None if there is none
+        with that ID.
+        '''
+        for rules in self.channels.values():
+            rule = rules.rules.get(rule_id)
+            if rule is not None:
+                rule.disabled = False
+                rule.timeouts = 0
+                rules.dirty = True
+                if self.store is not None:
+                    self._saved(self.store.save_ban_rule(rule))
+                return rule
+        return None
+
+    def _saved(self, version):
+        # Unless another process changed the rules in between, this process is up to date with the store
+        if self.version is not None and version == self.version + 1:
+            self.version = version
+
+    def candidates(self, channel, text):
+        '''
+        The enabled rules for this channel that the text could violate, in the order they were added.
+        '''
+        rules = self.channels.get(channel)
+        if rules is None:
+            return []
+        return rules.sorted_candidates(text)
+
+    def rules(self, channel=None):
+        if channel is not None:
+            return list(self.channels[channel].rules.values()) if channel in self.channels else []
+        return [rule for rules in self.channels.values() for rule in rules.rules.values()]
+
+    def match(self, channel, text):
+        '''
+        Return the earliest-added rule for this channel that the text violates, or None.
+        '''
+        rules = self.channels.get(channel)
+        if rules is None:
+            return None
+        return rules.match(text)
+
+
+class RegexSandbox:
+    '''
+    Runs ban rules in a separate worker process, so a pattern that backtracks badly can't freeze the bot.
+    The worker times each rule's match on its own CPU clock, so neither the round trip nor a busy
+    machine counts against a rule: a rule whose match takes longer than `budget` gets a strike, and a
+    rule that gets `max_strikes` strikes in a row, with no match within budget in between, is disabled
+    until a moderator enables it again. If the worker hasn't answered after `hang_timeout` seconds it is
+    killed and restarted, and the candidate rules are rerun one at a time to find the culprit. If the
+    worker can't be started, rules are matched in the bot's own process until it can. The time every
+    rule spends matching is recorded on the rule.
+    '''
+    # How long to wait for the worker to start or compile rules, and to wait before trying again if it fails
+    SETUP_TIMEOUT = 30
+    RETRY_INTERVAL = 60
+
+    def __init__(self, index, budget=0.05, max_strikes=3, hang_timeout=1.0):
+        self.index = index
+        self.budget = budget
+        self.max_strikes = max_strikes
+        self.hang_timeout = hang_timeout
+        self.process = None
+        self.loaded = set() # IDs of the rules compiled in the current worker
+        self.worker_starts = 0
+        self.retry_at = 0.0 # When to try the worker again after it failed to start
+        self.loop = None # The event loop that owns the index; rules are disabled there
+        # Matching is serialised through one thread, which owns the worker process
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="regex-sandbox")
+
+    async def match(self, channel, text):
+        '''
+        Return the earliest-added enabled rule for this channel that the text violates, or None.
+        '''
+        candidates = self.index.candidates(channel, text)
+        if not candidates:
+            return None
+        self.loop = asyncio.get_running_loop()
+        return await self.loop.run_in_executor(self.pool, self.match_blocking, candidates, text)
+
+    def match_blocking(self, candidates, text):
+        if time.monotonic() < self.retry_at:
+            return self.match_in_process(candidates, text)
+        try:
+            return self._match_worker(candidates, text)
+        except (OSError, ValueError, queue.Empty) as e:
+            # The worker couldn't be started or didn't load the rules; the rules were checked for
+            # catastrophic backtracking when they were added, so run them here for now
+            logger.warning("Regex worker unavailable, matching ban rules in-process for %ss: %r", self.RETRY_INTERVAL, e)
+            self._stop()
+            self.retry_at = time.monotonic() + self.RETRY_INTERVAL
+            return self.match_in_process(candidates, text)
+
+    def _match_worker(self, candidates, text):
+        result = self._run(candidates, text)
+        if result is not None:
+            return self.index_rule(candidates, result)
+
+        # The worker hung: find which rules are to blame, one at a time
+        for rule in candidates:
+            result = self._run([rule], text)
+            if result is None:
+                rule.match_seconds += self.hang_timeout
+                self.strike(rule)
+            elif self.index_rule([rule], result) is not None:
+                return rule
+        return None
+
+    def match_in_process(self, candidates, text):
+        for rule in candidates:
+            start = time.perf_counter()
+            matched = rule.compiled.search(text) is not None
+            rule.runs += 1
+            rule.match_seconds += time.perf_counter() - start
+            if matched:
+                rule.hits += 1
+                return rule
+        return None
+
+    def strike(self, rule):
+        rule.timeouts += 1
+        if rule.timeouts >= self.max_strikes and not rule.disabled:
+            logger.warning("Disabling ban rule %s (%s in #%s): too slow %s times in a row",
+                           rule.id, rule.pattern, rule.channel, rule.timeouts)
+            # The index belongs to the event loop's thread
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.index.disable, rule)
+            else:
+                self.index.disable(rule)
+
+    def index_rule(self, candidates, result):
+        hit, times = result
+        by_id = {rule.id: rule for rule in candidates}
+        for rule_id, seconds in times.items():
+            rule = by_id[int(rule_id)]
+            rule.runs += 1
+            rule.match_seconds += seconds
+            if seconds > self.budget:
+                self.strike(rule)
+            else:
+                rule.timeouts = 0
+        if hit is None:
+            return None
+        by_id[hit].hits += 1
+        return by_id[hit]
+
+    def _run(self, rules, text):
+        '''
+        Ask the worker to run these rules on the text. Returns (ID of the first rule that matched or None,
+        map from rule ID to CPU seconds its match took), or None if the worker hung. Raises OSError,
+        ValueError or queue.Empty if the worker can't be started or doesn't load the rules.
+        '''
+        if self.process is None or self.process.poll() is not None:
+            self._start()
+        missing = [[rule.id, rule.pattern] for rule in rules if rule.id not in self.loaded]
+        if missing:
+            self._send({"op": "load", "rules": missing})
+            self.replies.get(timeout=self.SETUP_TIMEOUT)
+            self.loaded.update(rule_id for rule_id, _ in missing)
+        self._send({"op": "match", "ids": [rule.id for rule in rules], "text": text})
+        try:
+            reply = self.replies.get(timeout=self.hang_timeout)
+        except queue.Empty:
+            self._stop()
+            return None
+        return reply["hit"], reply["times"]
+
+    def _send(self, request):
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+
+    def _start(self):
+        self._stop()
+        self.process = subprocess.Popen([sys.executable, __file__, "--serve"], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, text=True, encoding="utf-8", bufsize=1)
+        self.loaded = set()
+        self.worker_starts += 1
+        self.replies = queue.Queue()
+        reader = threading.Thread(target=self._read, args=(self.process.stdout, self.replies), daemon=True)
+        reader.start()
+        self.replies.get(timeout=self.SETUP_TIMEOUT) # Wait for the worker's ready message
+
+    @staticmethod
+    def _read(stdout, replies):
+        for line in stdout:
+            replies.put(json.loads(line))
+
+    def _stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def close(self):
+        self._stop()
+        self.pool.shutdown()
+
+
+def serve():
+    '''
+    Worker loop for RegexSandbox: compiles rules on request and runs them on texts, reporting the CPU
+    time each rule took. Requests and replies are JSON, one per line, over stdin/stdout.
+    '''
+    compiled = {}
+    reply({"ready": True})
+    for line in sys.stdin:
+        request = json.loads(line)
+        if request["op"] == "load":
+            for rule_id, pattern in request["rules"]:
+                compiled[rule_id] = re.compile(pattern)
+            reply({"loaded": len(request["rules"])})
+            continue
+
+        # Matches are timed on the worker's CPU clock, which a busy machine doesn't stretch
+        hit, times = None, {}
+        for rule_id in request["ids"]:
+            start = time.thread_time()
+            matched = compiled[rule_id].search(request["text"]) is not None
+            times[rule_id] = time.thread_time() - start
+            if matched:
+                hit = rule_id
+                break
+        reply({"hit": hit, "times": times})
+
+
+def reply(message):
+    sys.stdout.write(json.dumps(message) + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    if "--serve" in sys.argv:
+        serve()
@@ -0,0 +1,95 @@
+# batcher.py
+import asyncio
+from collections import Counter
+
+
+class ScoreBatcher:
+    '''
+    Collects texts from concurrent message handlers and scores them in batches. A batch is flushed as
+    soon as it holds `max_batch` texts, or `max_delay` seconds after its first text arrived, whichever
+    comes first; each handler then gets back the scores for its own text.
+
+    `score_batch` is a coroutine function taking a list of texts and returning a list of results in
+    the same order (a result may be an exception, which is raised to that text's handler only).
+    '''
+    def __init__(self, score_batch, max_batch=32, max_delay=0.05):
+        self.score_batch = score_batch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = [] # (text, future) pairs waiting for the next flush
+        self.in_flight = 0 # Texts in batches that have been sent but not answered yet
+        self._timer = None
+        self._tasks = set()
+
+        # Metrics
+        self.batch_sizes = Counter() # Map from batch size to the number of batches of that size
+        self.flushes = Counter() # Map from flush trigger ("size" or "deadline") to count
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self):
+        return len(self.pending)
+
+    async def score(self, text):
+        '''
+        Queue a text for the next batch and wait for its result.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+        self.max_queue_depth = max(self.max_queue_depth, len(self.pending))
+
+        if len(self.pending) >= self.max_batch:
+            self._flush("size")
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush, "deadline")
+        return await future
+
+    def _flush(self, trigger):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        self.batch_sizes[len(batch)] += 1
+        self.flushes[trigger] += 1
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        # Anything left over starts the clock for the next batch
+        if self.pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush, "deadline")
+
+    async def _run(self, batch):
+        # Copies of the same text in one batch (common during raids) are only scored once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.in_flight += len(batch)
+        try:
+            results = dict(zip(texts, await self.score_batch(texts)))
+        except Exception as e:
+            results = dict.fromkeys(texts, e)
+        finally:
+            self.in_flight -= len(batch)
+
+        for text, future in batch:
+            result = results[text]
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        texts = sum(size * count for size, count in self.batch_sizes.items())
+        return {"queue_depth": self.queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self.in_flight,
+                "batches": batches,
+                "mean_batch_size": texts / batches if batches else 0.0,
+                "batch_sizes": dict(self.batch_sizes),
+                "flushes": dict(self.flushes)}
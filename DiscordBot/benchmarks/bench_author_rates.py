@@ -0,0 +1,71 @@
+# bench_author_rates.py
+# Streams messages from a growing population of distinct authors through the AuthorRateTracker and
+# reports the cost per message and the memory per tracked author, which should stay flat from a
+# thousand authors to a million. Then moves the clock past the idle timeout to check idle authors are
+# evicted as new ones arrive.
+#
+#   python benchmarks/bench_author_rates.py --authors 1000000 --messages 1000000
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from author_rates import AuthorRateTracker
+
+
+def stream(tracker, authors, count, rate, start, rng, first=0):
+    '''
+    Feed `count` messages from random authors among `authors` (from ID `first`), `rate` per second from
+    time `start`; each author posts in one of four channels. Returns the seconds spent in the tracker,
+    the slowest message and the number of messages over the limit.
+    '''
+    events = [(start + i / rate, first + rng.randrange(authors)) for i in range(count)]
+    over = slowest = 0
+    begin = time.perf_counter()
+    for now, author_id in events:
+        tick = time.perf_counter()
+        over += tracker.record(author_id % 4, author_id, now)
+        slowest = max(slowest, time.perf_counter() - tick)
+    return time.perf_counter() - begin, slowest, over
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--authors", type=int, default=1000000, help="largest author population")
+    parser.add_argument("--messages", type=int, default=1000000, help="messages per population size")
+    parser.add_argument("--rate", type=float, default=10000, help="simulated messages per second")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print(f"{'authors':>10} {'tracked':>10} {'ns/message':>11} {'max us':>7} {'bytes/author':>13} {'over limit':>11}")
+    populations = [n for n in (1000, 10000, 100000, 1000000) if n < args.authors] + [args.authors]
+    for authors in populations:
+        # Every author posts once first, so the timed run sees the full population
+        tracemalloc.start()
+        tracker = AuthorRateTracker()
+        for author_id in range(authors):
+            tracker.record(author_id % 4, author_id, 0.0)
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        elapsed, slowest, over = stream(tracker, authors, args.messages, args.rate, 0.0, rng)
+        print(f"{authors:>10} {tracker.stats()['authors']:>10} {elapsed / args.messages * 1e9:>11.0f} "
+              f"{slowest * 1e6:>7.0f} {held / authors:>13.0f} {over:>11}")
+
+    # Ten minutes later, a new crowd arrives: the idle authors make way for them
+    count = args.messages
+    elapsed, slowest, _ = stream(tracker, 100000, count, args.rate, tracker.idle_after * 2, random.Random(1), first=args.authors)
+    print(f"new crowd after {tracker.idle_after * 2:.0f}s: {tracker.stats()}, "
+          f"{elapsed / count * 1e9:.0f} ns/message, slowest {slowest * 1e6:.0f} us while evicting")
+
+    # One author flooding a channel among the crowd
+    tracker = AuthorRateTracker()
+    flagged = [tracker.record(0, "flooder", i * 0.1) for i in range(40)]
+    print(f"an author posting 10 messages/s: over the limit from message {flagged.index(True) + 1}, "
+          f"{sum(flagged)} of 40 removed, pressure {tracker.pressure(0, 'flooder', 4.0):.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# bench_ban_rules.py
+# Scores messages against a channel with many banned patterns, comparing the BanRuleIndex's literal
+# prefilter pass against the old loop that compiled and searched every regex for every message, and
+# against a loop over precompiled regexes. The old loop recompiles on every call once there are more
+# patterns than re's internal cache holds, so by default it is timed on a sample of the messages. First
+# checks that validate_pattern rejects textbook ReDoS patterns and accepts the benchmark's own.
+#
+#   python benchmarks/bench_ban_rules.py --messages 10000 --patterns 1000
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ban_rules import BanRuleIndex, RegexSandbox, UnsafeRegexError, validate_pattern
+
+CHANNEL = "group-1"
+# Patterns validate_pattern must refuse, and near misses it must accept
+UNSAFE_PATTERNS = [r"(a+)+$", r"(.*a){20}", r"(a|a)*b", r"(a|aa)+$", r"(a|ab)+$", r"(ab|a)*c", r"(foo|foobar)+$", r"(?:a|)+b"]
+SAFE_PATTERNS = [r"bad(word)+", r"(cat|dog)+", r"(?:abc|abd)+", r"(ab|cd)*e", r"(?>a|aa)+$", r"free\s+nitro"]
+WORDS = ["the", "stream", "was", "great", "today", "thanks", "everyone", "for", "coming", "gg", "lol", "nice", "play", "chat"]
+
+
+def make_patterns(n, rng):
+    shapes = [lambda i: f"badword{i}",
+              lambda i: rf"fr[e3]{{2}}\s*c[o0]ins{i}",
+              lambda i: rf"spam{i}\d+",
+              lambda i: rf"(?:buy|sell)\s+acc{i}"]
+    return [rng.choice(shapes)(i) for i in range(n)]
+
+
+def make_messages(n, patterns, rng):
+    messages = []
+    for i in range(n):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 20))]
+        if i % 50 == 0:
+            words.append(f"badword{rng.randrange(len(patterns))}")
+        messages.append(" ".join(words))
+    return messages
+
+
+def check_validation(patterns):
+    for pattern in UNSAFE_PATTERNS:
+        try:
+            validate_pattern(pattern)
+        except UnsafeRegexError:
+            continue
+        raise AssertionError(f"{pattern} was accepted")
+    for pattern in SAFE_PATTERNS + patterns:
+        validate_pattern(pattern)
+
+
+def old_loop(regexes, messages):
+    hits = 0
+    for text in messages:
+        for channel, regex in regexes:
+            if channel == CHANNEL:
+                pattern = re.compile(regex)
+                if re.search(pattern, text) != None:
+                    hits += 1
+    return hits
+
+
+def sandbox_match(index, messages):
+    # Same as the bot's path, minus the hop onto the sandbox's thread
+    sandbox = RegexSandbox(index)
+    try:
+        hits = 0
+        for text in messages:
+            candidates = index.candidates(CHANNEL, text)
+            hits += bool(candidates) and sandbox.match_blocking(candidates, text) is not None
+        return hits
+    finally:
+        sandbox.close()
+
+
+def precompiled_loop(compiled, messages):
+    return sum(any(pattern.search(text) for pattern in compiled) for text in messages)
+
+
+def index_match(index, messages):
+    return sum(index.match(CHANNEL, text) is not None for text in messages)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--patterns", type=int, default=1000)
+    parser.add_argument("--old-sample", type=int, default=100, help="messages to time the old loop on (0 = all)")
+    args = parser.parse_args()
+    rng = random.Random(152)
+    patterns = make_patterns(args.patterns, rng)
+    messages = make_messages(args.messages, patterns, rng)
+    check_validation(patterns)
+
+    start = time.perf_counter()
+    index = BanRuleIndex()
+    for pattern in patterns:
+        index.add(CHANNEL, pattern)
+    index.match(CHANNEL, "")
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_hits = index_match(index, messages)
+    new = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sandbox_hits = sandbox_match(index, messages)
+    sandboxed = time.perf_counter() - start
+
+    compiled = [re.compile(pattern) for pattern in patterns]
+    start = time.perf_counter()
+    loop_hits = precompiled_loop(compiled, messages)
+    loop = time.perf_counter() - start
+
+    sample = messages[:args.old_sample] if args.old_sample else messages
+    start = time.perf_counter()
+    old_loop([(CHANNEL, pattern) for pattern in patterns], sample)
+    old = time.perf_counter() - start
+
+    assert new_hits == loop_hits == sandbox_hits
+    print(f"{args.messages} messages x {args.patterns} patterns, {new_hits} messages matched; "
+          f"{len(UNSAFE_PATTERNS)} ReDoS-prone patterns rejected")
+    print(f"  old compile-per-message loop: {old / len(sample) * 1e6:8.0f} us/message (timed on {len(sample)} messages)")
+    print(f"  precompiled loop:             {loop / args.messages * 1e6:8.0f} us/message")
+    print(f"  rule index:                   {new / args.messages * 1e6:8.0f} us/message ({new:.2f}s total)")
+    print(f"  rule index + sandbox worker:  {sandboxed / args.messages * 1e6:8.0f} us/message")
+    print(f"  adding the rules + first match: {build:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# bench_channel_latency.py
+# Feeds N synthetic channel messages through ModBot.on_message against a delayed Perspective stub and
+# reports p50/p99 handling latency (from dispatch to handler completion), plus how long the event loop was stalled while they were handled.
+#
+#   python benchmarks/bench_channel_latency.py --messages 200 --delay 0.05
+#   python benchmarks/bench_channel_latency.py --blocking   # classifier called inline, the old behaviour
+import argparse
+import asyncio
+import contextlib
+import io
+import statistics
+import time
+
+from fakes import FakeMessage, FakeUser, import_bot, make_bot
+from perspective import PerspectiveClient
+from stubs import PerspectiveStub
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+async def heartbeat(stop, interval, lags):
+    # Measures how late the loop wakes us up: a blocked loop shows up as a large lag
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def run(args, stub):
+    bot_module = import_bot()
+    client, guild, channel, mod_channel = make_bot(bot_module, max_classifier_requests=args.concurrency,
+                                                   batch_size=args.batch_size, batch_delay=args.batch_delay)
+    client.perspective = PerspectiveClient("stub", api_endpoint=stub.url)
+    if args.blocking:
+        async def inline(classifier, *args):
+            return classifier(*args)
+        client.run_classifier = inline
+
+    latencies = []
+    async def handle(message, dispatched):
+        await client.on_message(message)
+        latencies.append(time.perf_counter() - dispatched)
+
+    authors = [FakeUser(f"user{i}") for i in range(20)]
+    distinct = args.distinct or args.messages
+    messages = [FakeMessage(f"synthetic message {i % distinct}" + (" you idiot" if i % 10 == 0 else ""), authors[i % len(authors)], channel)
+                for i in range(args.messages)]
+
+    stop, lags = asyncio.Event(), []
+    beat = asyncio.create_task(heartbeat(stop, 0.01, lags))
+    start = time.perf_counter()
+    # discord.py dispatches every event as its own task, so do the same here
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(handle(message, start) for message in messages))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    await client.report_digest.flush()
+
+    print(f"{len(messages)} messages in {elapsed:.2f}s ({len(messages) / elapsed:.1f} msg/s), "
+          f"{stub.analyze_calls} texts scored in {stub.http_requests} API round trips, {len(mod_channel.sent)} mod-channel posts")
+    print(f"handling latency: p50 {percentile(latencies, 50) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.1f} ms, mean {statistics.mean(latencies) * 1000:.1f} ms")
+    print(f"event loop lag: max {max(lags, default=0) * 1000:.1f} ms over {len(lags)} heartbeats")
+    print(f"batcher: {client.perspective_batcher.stats()}")
+    print(f"verdict cache: {client.verdict_cache.stats()}")
+    print(f"cascade: {client.cascade.stats()}")
+    client.classifier_pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--delay", type=float, default=0.05, help="stub API latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight classifier requests")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-delay", type=float, default=0.05, help="seconds before a partial batch is flushed")
+    parser.add_argument("--distinct", type=int, default=0, help="number of distinct texts (default: all distinct)")
+    parser.add_argument("--blocking", action="store_true", help="call the classifier on the event loop")
+    args = parser.parse_args()
+    with PerspectiveStub(delay=args.delay) as stub:
+        asyncio.run(run(args, stub))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# bench_channel_routing.py
+# Compares the two ways of deciding what to do with a guild message, over many guilds with many
+# channels each: rebuilding the group's channel names and comparing them with the message's channel
+# name (as on_message used to), and one lookup in the ChannelRouter's index by channel ID. Also times
+# indexing every channel at startup and the incremental update for a renamed channel.
+#
+#   python benchmarks/bench_channel_routing.py --guilds 1000 --channels 50
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import FakeChannel, FakeGuild
+from channel_routes import ChannelRouter, MONITORED, MOD
+
+
+def by_name(group_num, channel):
+    # The old dispatch
+    if channel.name == f'group-{group_num}-mod':
+        return MOD
+    if channel.name == f'group-{group_num}':
+        return MONITORED
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=50, help="channels per guild")
+    parser.add_argument("--messages", type=int, default=1000000)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    guilds = []
+    for g in range(args.guilds):
+        guild = FakeGuild(g, f"guild {g}")
+        FakeChannel("group-1", guild)
+        FakeChannel("group-1-mod", guild)
+        for c in range(args.channels - 2):
+            FakeChannel(f"channel-{c}", guild)
+        guilds.append(guild)
+    channels = [channel for guild in guilds for channel in guild.text_channels]
+    stream = [rng.choice(channels) for _ in range(args.messages)]
+
+    start = time.perf_counter()
+    router = ChannelRouter()
+    router.set_group("1")
+    for guild in guilds:
+        router.add_guild(guild)
+    indexing = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for channel in stream:
+        by_name("1", channel)
+    names = time.perf_counter() - start
+    routes = router.routes
+    start = time.perf_counter()
+    for channel in stream:
+        routes[channel.id].role
+    lookups = time.perf_counter() - start
+
+    print(f"{len(channels)} channels in {args.guilds} guilds, indexed in {indexing * 1000:.0f} ms: {router.stats()}")
+    print(f"  name comparison: {names / args.messages * 1e9:6.0f} ns/message")
+    print(f"  route lookup:    {lookups / args.messages * 1e9:6.0f} ns/message")
+
+    # A channel renamed into the group's channel after startup is monitored from the next message
+    channel = guilds[0].text_channels[-1]
+    channel.name = "group-1"
+    start = time.perf_counter()
+    router.update(channel)
+    print(f"  rename picked up in {(time.perf_counter() - start) * 1e6:.1f} us: {router.route(channel).role}")
+
+
+if __name__ == '__main__':
+    main()
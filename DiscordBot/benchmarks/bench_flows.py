@@ -0,0 +1,164 @@
+# bench_flows.py
+# Drives the user reporting flow and the moderator review flow with random answers for a fixed number
+# of steps (messages) and reports the step throughput and how many reports and reviews were finished.
+# First checks, through the bot's DM handler, that only submitted reports reach the moderators: a report
+# cancelled with `cancel` or by answering no to the confirmation isn't queued.
+#
+#   python benchmarks/bench_flows.py --steps 1000000
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import FakeChannel, FakeGuild, FakeMessage, FakeUser, import_bot, make_bot
+from moderation_actions import ModerationActions
+from report import ModReview, Report, State, REPORT_FLOW, REVIEW_FLOW
+
+
+class FakeClient:
+    def __init__(self, guild):
+        self.guild = guild
+        self.actions = ModerationActions(self.send)
+
+    async def send(self, channel, content):
+        await channel.send(content)
+
+    async def guild_channel(self, guild_id, channel_id):
+        if guild_id != self.guild.id:
+            return False, None
+        return True, self.guild.get_channel(channel_id)
+
+
+class FakeOffenderStore:
+    def __init__(self):
+        self.counts = Counter()
+
+    def increment(self, user, amount=1):
+        self.counts[user] += amount
+        return self.counts[user]
+
+
+class FakeRule:
+    id = 1
+
+
+class FakeRegexes:
+    def add(self, channel, pattern):
+        return FakeRule()
+
+
+class Answer:
+    # Just enough of a discord.Message for the flows to read
+    __slots__ = ["content", "author", "channel"]
+
+    def __init__(self, content, author, channel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+
+
+def answers(flow, state, reported):
+    '''
+    The inputs a user might send in `state`: the specific ones the table knows, some free text, and
+    now and then a keyword.
+    '''
+    if state == State.AWAITING_MESSAGE:
+        return [reported, "not a link", "https://discord.com/channels/1/2/3"]
+    if state == State.ASK_REGEX:
+        return ["bad(word)+", "(a+)+$", "["]
+    spec = flow.states[state]
+    keys = [key for key in spec.transitions if isinstance(key, str)]
+    if spec.read is not None:
+        keys = ["yes", "no", "y", "n", "Y"]
+    return keys + ["something else"]
+
+
+async def check_cancelled_reports():
+    bot = import_bot()
+    client, guild, channel, mod_channel = make_bot(bot, metrics_port=None, digest_window=0)
+    target = FakeMessage("you are a worthless idiot", FakeUser("offender"), channel)
+    link = f"https://discord.com/channels/{guild.id}/{channel.id}/{target.id}"
+    for answers, queued in [(["report", link, "cancel"], 0), (["report", link, "no"], 0),
+                            (["report", link, "yes", "3", "no"], 1)]:
+        user = FakeUser("reporter")
+        dm = FakeChannel(f"dm-{user.id}")
+        for content in answers:
+            await client.handle_dm(FakeMessage(content, user, dm))
+        assert user.id not in client.reports, answers
+        assert len(client.report_queue) == queued, (answers, len(client.report_queue))
+    client.classifier_pool.shutdown()
+    await client.close()
+
+
+async def run(steps, seed):
+    rng = random.Random(seed)
+    guild = FakeGuild()
+    channel = FakeChannel("group-1", guild)
+    mod_channel = FakeChannel("group-1-mod", guild)
+    mod_channels = {guild.id: mod_channel}
+    client = FakeClient(guild)
+    user, moderator = FakeUser("reporter"), FakeUser("moderator")
+    offenders = FakeOffenderStore()
+    regexes = FakeRegexes()
+    target = FakeMessage("you are a worthless idiot", FakeUser("offender"), channel)
+    link = f"https://discord.com/channels/{guild.id}/{channel.id}/{target.id}"
+
+    choices = {} # Map from (flow, state) to the inputs to pick from
+    finished = Counter()
+    step_time = 0.0
+    machine = flow = None
+    for _ in range(steps):
+        if machine is None:
+            if rng.random() < 0.5:
+                flow, machine = REPORT_FLOW, Report(client, regexes)
+                if rng.random() < 0.1:
+                    machine.state = State.ASK_REGEX
+            else:
+                report = Report(client)
+                report.message = target
+                report.messageContent = report.decodedMessage = target.content
+                report.reason = rng.choice(["1", "2", "3", "4"])
+                report.category = rng.choice([None, "1", "2", "3", "4", "5"])
+                flow, machine = REVIEW_FLOW, ModReview(client, report, offenders)
+
+        options = choices.get((flow, machine.state))
+        if options is None:
+            options = choices[(flow, machine.state)] = answers(flow, machine.state, link)
+        content = rng.choice(options) if rng.random() > 0.01 else rng.choice(list(flow.keywords))
+        message = Answer(content, moderator if flow is REVIEW_FLOW else user, channel)
+
+        start = time.perf_counter()
+        await flow.step(machine, message, mod_channels)
+        step_time += time.perf_counter() - start
+
+        if machine.state in flow.terminal:
+            finished[flow.name] += 1
+            machine = None
+        # Keep the fake channel from filling up with removal notices
+        channel.sent.clear()
+        channel.messages[target.id] = target
+
+    return step_time, finished
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(check_cancelled_reports())
+    start = time.perf_counter()
+    step_time, finished = asyncio.run(run(args.steps, args.seed))
+    total = time.perf_counter() - start
+    print(f"{args.steps} steps in {total:.1f}s ({step_time:.1f}s inside the flows)")
+    print(f"throughput: {args.steps / step_time:,.0f} steps/s, {step_time / args.steps * 1e6:.2f} us/step")
+    print(f"finished flows: {dict(finished)}")
+
+
+if __name__ == '__main__':
+    main()
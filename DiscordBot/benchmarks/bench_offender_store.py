@@ -0,0 +1,66 @@
+# bench_offender_store.py
+# Measures the latency of recording one harassment verdict as the number of known users grows, for
+# the SQLite store and for the old whole-file JSON rewrite (which is skipped once it gets too slow).
+#
+#   python benchmarks/bench_offender_store.py --users 1000 100000 1000000
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from user_stats import JSONOffenderStore, SQLiteOffenderStore
+
+
+def populate_sqlite(path, users):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE offenders (user TEXT PRIMARY KEY, violations INTEGER NOT NULL) WITHOUT ROWID")
+    conn.executemany("INSERT INTO offenders VALUES (?, ?)", ((f"user{i}", i % 3) for i in range(users)))
+    conn.commit()
+    conn.close()
+
+
+def time_increments(store, users, verdicts, rng):
+    latencies = []
+    for _ in range(verdicts):
+        user = f"user{rng.randrange(users)}"
+        start = time.perf_counter()
+        store.increment(user)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return statistics.mean(latencies), latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--verdicts", type=int, default=2000)
+    parser.add_argument("--json-max-users", type=int, default=100000, help="largest user count to run the JSON store at")
+    args = parser.parse_args()
+    rng = random.Random(152)
+
+    print(f"{'users':>9} {'store':>7} {'mean us':>9} {'p99 us':>9}")
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "userStatistics.db")
+            populate_sqlite(path, users)
+            store = SQLiteOffenderStore(path)
+            mean, p99 = time_increments(store, users, args.verdicts, rng)
+            store.close()
+            print(f"{users:>9} {'sqlite':>7} {mean * 1e6:>9.1f} {p99 * 1e6:>9.1f}")
+
+            if users <= args.json_max_users:
+                path = os.path.join(tmp, "userStatistics.json")
+                with open(path, "w") as f:
+                    json.dump({f"user{i}": i % 3 for i in range(users)}, f)
+                mean, p99 = time_increments(JSONOffenderStore(path), users, min(args.verdicts, 200), rng)
+                print(f"{users:>9} {'json':>7} {mean * 1e6:>9.1f} {p99 * 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
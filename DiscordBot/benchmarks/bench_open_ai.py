@@ -0,0 +1,94 @@
+# bench_open_ai.py
+# Compares the end-to-end latency of the GPT classification for one message: the old strictly
+# sequential questions (category, hate speech sub-category, username check, username description),
+# the single structured request, and the fallback for accounts without JSON mode, which asks separately
+# but in parallel. The OpenAI API is replaced by a stub with a fixed latency per model.
+#
+#   python benchmarks/bench_open_ai.py --messages 5 --scale 0.2
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import FakeMessage, FakeUser, import_bot, make_bot
+from stubs import OPENAI_LATENCY, chat_answer
+
+SCENARIOS = {
+    # name: (message, username)
+    "hate speech, vulgar username": ("you are a tranny and always will be", "vulgar_name"),
+    "hate speech": ("you are a tranny and always will be", "jenny_88"),
+    "harassment": ("I know your address, idiot, and I'm posting it", "jenny_88"),
+}
+
+
+class ChatStub:
+    '''
+    Stands in for openai.ChatCompletion.create, answering each of the bot's prompts like GPT would,
+    without the HTTP round trip of stubs.OpenAIStub.
+    '''
+    def __init__(self, openai, scale, json_mode=True):
+        self.openai = openai
+        self.scale = scale
+        self.json_mode = json_mode
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def create(self, model, messages, response_format=None, **kwargs):
+        with self.lock:
+            self.calls[model] += 1
+        if response_format is not None and not self.json_mode:
+            raise self.openai.error.InvalidRequestError("response_format is not supported with this model", "response_format")
+        time.sleep(OPENAI_LATENCY[model] * self.scale)
+        return {"choices": [{"message": {"role": "assistant", "content": chat_answer(messages, response_format)}}]}
+
+
+def sequential_eval(client, message):
+    # The classification as it was before: every question waits for the previous answer
+    verdict = client.open_ai_content_verdict(message)
+    usernameIssue = None
+    if verdict["reason"] == "1":
+        verdict["category"] = client.open_ai_hate_speech_category(message)
+        usernameIssue = client.open_ai_username_issue(message)
+    return verdict, usernameIssue
+
+
+async def run(bot, args):
+    client, guild, channel, mod_channel = make_bot(bot)
+    print(f"{'scenario':>30} {'path':>12} {'mean s':>8} {'calls/msg':>10}")
+    for scenario, (text, username) in SCENARIOS.items():
+        author = FakeUser(username)
+        for path in ["sequential", "structured", "fallback"]:
+            stub = ChatStub(client.open_ai_client(), args.scale, json_mode=path != "fallback")
+            client.open_ai_client().ChatCompletion.create = stub.create
+            client.open_ai_structured = True
+            latencies = []
+            for i in range(args.messages):
+                message = FakeMessage(f"{text} #{scenario}{path}{i}", author, channel) # Distinct texts, so nothing is cached
+                start = time.perf_counter()
+                if path == "sequential":
+                    await client.run_classifier(sequential_eval, client, message)
+                else:
+                    await client.eval_text_open_ai(message)
+                latencies.append(time.perf_counter() - start)
+            calls = sum(stub.calls.values()) / args.messages
+            print(f"{scenario:>30} {path:>12} {statistics.mean(latencies):>8.2f} {calls:>10.1f}")
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=0.2, help="fraction of the typical API latencies to sleep")
+    args = parser.parse_args()
+
+    bot = import_bot()
+    asyncio.run(run(bot, args))
+
+
+if __name__ == '__main__':
+    main()
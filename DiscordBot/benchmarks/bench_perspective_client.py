@@ -0,0 +1,57 @@
+# bench_perspective_client.py
+# Compares rebuilding the discovery client per message (the old behaviour) against one long-lived
+# PerspectiveClient, both pointed at a local stub that counts discovery fetches.
+#
+#   python benchmarks/bench_perspective_client.py --messages 200
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from googleapiclient import discovery
+from perspective import PerspectiveClient
+from stubs import PerspectiveStub
+
+
+def per_message_build(stub, texts):
+    for text in texts:
+        client = discovery.build(
+            "commentanalyzer",
+            "v1alpha1",
+            developerKey="stub",
+            discoveryServiceUrl=stub.discovery_url,
+            static_discovery=False,
+            cache_discovery=False,
+        )
+        client.comments().analyze(body={'comment': {'text': text}, 'requestedAttributes': {'TOXICITY': {}}}).execute()
+
+
+def long_lived_client(stub, texts):
+    with tempfile.TemporaryDirectory() as tmp:
+        # Start from an empty cache so the one-off fetch is counted
+        client = PerspectiveClient("stub", discovery_path=os.path.join(tmp, "discovery.json"),
+                                   discovery_url=stub.discovery_url, api_endpoint=stub.url)
+        for text in texts:
+            client.analyze(text)
+        assert client.discovery_fetches == 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+    texts = [f"synthetic message {i}" for i in range(args.messages)]
+
+    for name, run in [("per-message build", per_message_build), ("long-lived client", long_lived_client)]:
+        with PerspectiveStub() as stub:
+            start = time.perf_counter()
+            run(stub, texts)
+            elapsed = time.perf_counter() - start
+            print(f"{name:>18}: {elapsed / len(texts) * 1000:.2f} ms/message, "
+                  f"{stub.discovery_fetches} discovery fetches, {stub.analyze_calls} analyze calls")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# bench_raid.py
+# Streams synthetic channel traffic through the RaidDetector at a simulated rate: chatter from thousands
+# of accounts, with floods of mutated copies of a few texts from dozens of accounts mixed in. Reports
+# how many messages per second the detector can index, the memory the window holds once it is full,
+# and how many reports the raids turn into compared with reporting every flagged message.
+#
+#   python benchmarks/bench_raid.py --messages 200000 --rate 10000
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from raid import RaidDetector
+
+WORDS = ("the stream game chat play round patch build boss song team win lose good bad new old today last next "
+         "really maybe think know like love want need look watch clip highlight mods emote hype pog lul").split()
+VOCABULARY = WORDS + [f"{a}{b}" for a in ("ka", "lo", "mi", "ne", "su", "ta", "ri", "po") for b in range(250)]
+# Zipf's law: the n-th most common word is used 1/n as often as the most common one
+ZIPF = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+RAID_TEXTS = ["everyone go report this streamer she is a fake and a liar",
+              "you people are disgusting get out of this channel now",
+              "raid time spam the chat with this message until the mods quit"]
+FILLERS = ["lol", "!!!", "xd", "fr", "💀"]
+
+
+def mutate(rng, text):
+    # What raiders do to get past duplicate filters: add a number, swap a word, or insert an emoji
+    words = text.split()
+    roll = rng.random()
+    if roll < 0.33:
+        words.append(str(rng.randrange(1000)))
+    elif roll < 0.66:
+        words[rng.randrange(len(words))] = rng.choice(FILLERS)
+    else:
+        words.insert(rng.randrange(len(words)), rng.choice(FILLERS))
+    return " ".join(words)
+
+
+def traffic(count, rate, raid_every, raid_size, raiders, seed):
+    '''
+    (time, channel ID, author ID, text, raid number or None) for `count` messages at `rate` per second.
+    '''
+    rng = random.Random(seed)
+    messages = []
+    raid = None
+    for i in range(count):
+        now = i / rate
+        if i % raid_every == 0:
+            raid = (i // raid_every, RAID_TEXTS[(i // raid_every) % len(RAID_TEXTS)], raid_size)
+        if raid is not None and raid[2] and rng.random() < 0.2:
+            number, text, left = raid
+            raid = (number, text, left - 1)
+            author = 10 ** 6 + number * 1000 + rng.randrange(raiders)
+            messages.append((now, 1, author, mutate(rng, text), number))
+        else:
+            text = " ".join(rng.choices(VOCABULARY, cum_weights=ZIPF, k=rng.randint(3, 12)))
+            messages.append((now, 1, rng.randrange(5000), text, None))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--rate", type=float, default=10000, help="simulated messages per second")
+    parser.add_argument("--raid-every", type=int, default=20000, help="messages between the starts of two raids")
+    parser.add_argument("--raid-size", type=int, default=500, help="messages per raid")
+    parser.add_argument("--raiders", type=int, default=50, help="accounts per raid")
+    parser.add_argument("--window", type=float, default=60.0)
+    parser.add_argument("--max-messages", type=int, default=20000)
+    parser.add_argument("--claim-after", type=float, default=1.0,
+                        help="seconds before a moderator picks up a raid report, after which new raids get their own")
+    args = parser.parse_args()
+
+    messages = traffic(args.messages, args.rate, args.raid_every, args.raid_size, args.raiders, seed=0)
+    detector = RaidDetector(window=args.window, max_messages=args.max_messages)
+
+    start = time.perf_counter()
+    for now, channel_id, author_id, text, _ in messages:
+        detector.add(channel_id, author_id, text, now)
+    elapsed = time.perf_counter() - start
+    print(f"{len(messages)} messages in {elapsed:.2f}s: {len(messages) / elapsed:,.0f} msg/s, "
+          f"{elapsed / len(messages) * 1e6:.1f} us/message")
+
+    # Again, as the bot uses it: every raid message is flagged toxic, so before, each was its own report
+    detector = RaidDetector(window=args.window, max_messages=args.max_messages)
+    raid_messages = folded = 0
+    reports = Counter() # Map from raid number to the raid reports filed for it
+    lookalikes = set() # Chatter clusters that would be raids if they were toxic
+    tracemalloc.start()
+    for now, channel_id, author_id, text, raid in messages:
+        cluster = detector.add(channel_id, author_id, text, now)
+        if raid is None:
+            if cluster is not None and len(cluster.authors) >= detector.min_authors:
+                lookalikes.add(cluster)
+            continue
+        raid_messages += 1
+        cluster.toxic = True
+        if cluster.report is not None:
+            folded += 1
+        elif detector.is_raid(cluster):
+            if detector.fold(cluster, lambda report: now - report.created < args.claim_after) is None:
+                reports[raid] += 1
+                detector.filed(cluster, SimpleNamespace(created=now, channel_id=channel_id))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"window memory: {current / 2 ** 20:.1f} MB held, {peak / 2 ** 20:.1f} MB peak, {detector.stats()}")
+    raids = len({raid for *_, raid in messages if raid is not None})
+    print(f"{raids} raids of {raid_messages} messages: {sum(reports.values())} raid reports ({len(reports)} raids caught) "
+          f"instead of {raid_messages} reports, {folded} messages folded into them; "
+          f"{len(lookalikes)} chatter clusters that look like raids")
+
+
+if __name__ == '__main__':
+    main()
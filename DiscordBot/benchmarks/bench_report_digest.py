@@ -0,0 +1,93 @@
+# bench_report_digest.py
+# A burst of auto-flagged messages reaching the mod channel: counts the posts the bot makes when it
+# announces every report on its own (window 0, each report in its own digest) and with digests over a
+# few seconds, and times rendering the review summary by concatenating strings, as the review flow
+# used to, against the precomputed line templates.
+#
+#   python benchmarks/bench_report_digest.py --reports 1000 --duration 10 --window 5
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import FakeChannel, FakeGuild, FakeMessage, FakeUser
+from stubs import TOXIC_WORDS
+from report import Report
+from report_digest import ReportDigest
+from report_queue import ReportQueue
+from moderation_store import ModerationStore
+
+
+def concatenated_summary(report):
+    # review_summary before the templates
+    reply = "Thank you for starting the reviewing process. \n "
+    for key, value in report.summary().items():
+        reply += key + ": " + str(value) + "\n"
+    return reply + "Is this harassment?\n\n"
+
+
+def templated_summary(report):
+    return "Thank you for starting the reviewing process. \n " + report.render_summary() + "Is this harassment?\n\n"
+
+
+def make_reports(count, channel):
+    reports = []
+    for i in range(count):
+        report = Report(None)
+        message = FakeMessage(f"you are a {TOXIC_WORDS[i % len(TOXIC_WORDS)]} number {i}", FakeUser(f"viewer{i}"), channel)
+        report.message = message
+        report.messageContent = report.decodedMessage = message.content
+        report.reason, report.category, report.score = "1", "3", 0.9
+        reports.append(report)
+    return reports
+
+
+async def announce(reports, duration, window):
+    '''
+    Queue the reports evenly over `duration` seconds and return the digests posted.
+    '''
+    mod_channel = FakeChannel("group-1-mod", FakeGuild())
+    queue = ReportQueue(ModerationStore(":memory:"), None)
+    async def post(channel, content):
+        await channel.send(content)
+    digest = ReportDigest(post, queue, window=window)
+    start = time.monotonic()
+    for i, report in enumerate(reports):
+        await asyncio.sleep(max(0, start + i * duration / len(reports) - time.monotonic()))
+        queue.enqueue(report)
+        digest.add(mod_channel, report)
+    await asyncio.sleep(window)
+    await digest.flush()
+    queue.store.close()
+    return mod_channel.sent
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds the burst lasts")
+    parser.add_argument("--window", type=float, default=5.0, help="digest window, seconds")
+    parser.add_argument("--renders", type=int, default=200000)
+    args = parser.parse_args()
+
+    channel = FakeChannel("group-1", FakeGuild())
+    print(f"{args.reports} flagged messages over {args.duration:.0f}s")
+    for window in [0, args.window]:
+        posts = asyncio.run(announce(make_reports(args.reports, channel), args.duration, window))
+        print(f"window {window:>4}s: {len(posts):>5} mod-channel posts, {sum(map(len, posts)) / 1024:>7.1f} KB, "
+              f"longest {max(map(len, posts))} chars")
+
+    reports = make_reports(100, channel)
+    assert all(concatenated_summary(report) == templated_summary(report) for report in reports)
+    for name, render in [("concatenated", concatenated_summary), ("templates", templated_summary)]:
+        start = time.perf_counter()
+        for i in range(args.renders):
+            render(reports[i % len(reports)])
+        elapsed = time.perf_counter() - start
+        print(f"{name:>12} summaries: {elapsed / args.renders * 1e6:.2f} us each")
+
+
+if __name__ == '__main__':
+    main()
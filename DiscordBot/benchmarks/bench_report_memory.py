@@ -0,0 +1,106 @@
+# bench_report_memory.py
+# Measures the memory held by open reports with tracemalloc. Each report is built from a real
+# discord.Message, as the auto-flagging path does, and then only the report is kept, as the report
+# queue does. "legacy" reproduces the layout reports had before they were slotted: a __dict__ holding
+# the message itself, plus the copy of the report fields each ModReview made.
+#
+#   python benchmarks/bench_report_memory.py --reports 100000
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import discord
+from fakes import FakeChannel, FakeGuild
+from report import Report, State, decode_escapes
+
+
+class LegacyReport:
+    def __init__(self, client):
+        self.state = State.REPORT_START
+        self.client = client
+        self.message = ""
+        self.id = None
+        self.created = 0.0
+        self.score = None
+        self.priority = None
+        self.guild_id = None
+        self.channel_id = None
+        self.message_id = None
+        self.author = None
+        self.messageContent = None
+        self.reason = None
+        self.category = None
+        self.usernameIssue = None
+        self.repeatOffender = False
+        self.decodedMessage = None
+        self.regexes = None
+        self.regex = None
+
+
+def legacy_report(client, message):
+    report = LegacyReport(client)
+    report.messageContent = message.content
+    report.message = message
+    report.author = message.author.name
+    report.decodedMessage = report.messageContent.encode('utf-8').decode('unicode-escape')
+    report.reason = "3"
+    report.score = 0.9
+    report.report_dict = {"Message": report.messageContent,
+                          "Author": report.author,
+                          "Decoded Content": report.decodedMessage,
+                          "Report Reason": report.reason,
+                          "Abuse Category": report.category,
+                          "Username Issue" : report.usernameIssue,
+                          "Repeat Offender": report.repeatOffender}
+    return report
+
+
+def slotted_report(client, message):
+    report = Report(client)
+    report.messageContent = message.content
+    report.message = message
+    report.decodedMessage = decode_escapes(report.messageContent)
+    report.reason = "3"
+    report.score = 0.9
+    return report
+
+
+def make_message(state, channel, i):
+    return discord.Message(state=state, channel=channel, data={
+        "id": str(10 ** 17 + i), "channel_id": str(channel.id), "type": 0, "tts": False, "pinned": False,
+        "author": {"id": str(10 ** 16 + i % 5000), "username": f"user{i % 5000}", "discriminator": "0", "avatar": None},
+        "content": f"you are a worthless idiot and everyone hates you #{i}",
+        "timestamp": "2023-05-01T00:00:00+00:00", "edited_timestamp": None, "mention_everyone": False,
+        "mentions": [], "mention_roles": [], "attachments": [], "embeds": []})
+
+
+def measure(build, client, channel, count):
+    gc.collect()
+    tracemalloc.start()
+    reports = [build(client, make_message(client._connection, channel, i)) for i in range(count)]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del reports
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reports", type=int, default=100000)
+    args = parser.parse_args()
+
+    client = discord.Client(intents=discord.Intents.default())
+    channel = FakeChannel("group-1", FakeGuild())
+
+    print(f"{'layout':>8} {'reports':>8} {'MB':>8} {'bytes/report':>13}")
+    for name, build in [("legacy", legacy_report), ("slotted", slotted_report)]:
+        used = measure(build, client, channel, args.reports)
+        print(f"{name:>8} {args.reports:>8} {used / 2 ** 20:>8.1f} {used / args.reports:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# bench_report_queue.py
+# Measures enqueue and claim+close latency of the durable report queue as the number of open
+# reports grows, and how long recovering them after a restart takes.
+#
+#   python benchmarks/bench_report_queue.py --open 1000 10000 100000
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from moderation_store import ModerationStore
+from report import Report
+from report_queue import ReportQueue
+
+
+def make_report(i):
+    report = Report(None)
+    report.author = f"user{i % 500}"
+    report.messageContent = report.decodedMessage = f"flagged message {i}"
+    report.reason = str(i % 4 + 1)
+    report.guild_id, report.channel_id, report.message_id = 1, 2, 1000 + i
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--open", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--ops", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'open':>8} {'enqueue us':>11} {'claim+close us':>15} {'recover s':>10}")
+    for count in args.open:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ModerationStore(os.path.join(tmp, "moderation.db"))
+            queue = ReportQueue(store, None)
+            with store.lock:
+                store.conn.executemany("INSERT INTO reports (status, created, data) VALUES ('pending', ?, ?)",
+                                       ((time.time(), json.dumps(make_report(i).to_dict())) for i in range(count)))
+                store.conn.commit()
+            queue.recover()
+
+            enqueue = []
+            for i in range(args.ops):
+                report = make_report(count + i)
+                start = time.perf_counter()
+                queue.enqueue(report)
+                enqueue.append(time.perf_counter() - start)
+
+            claim = []
+            for _ in range(args.ops):
+                start = time.perf_counter()
+                report = queue.claim(moderator_id=1, guild_id=1)
+                queue.close(report.id)
+                claim.append(time.perf_counter() - start)
+            store.close()
+
+            store = ModerationStore(os.path.join(tmp, "moderation.db"))
+            start = time.perf_counter()
+            recovered = ReportQueue(store, None).recover()
+            recover = time.perf_counter() - start
+            store.close()
+            assert recovered == count
+
+            print(f"{count:>8} {statistics.mean(enqueue) * 1e6:>11.1f} {statistics.mean(claim) * 1e6:>15.1f} {recover:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
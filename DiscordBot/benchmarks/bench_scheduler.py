@@ -0,0 +1,80 @@
+# bench_scheduler.py
+# Measures push and pop latency of the review scheduler with tens of thousands of queued reports,
+# and checks that what it pops is the report with the highest priority at the time of the pop.
+#
+#   python benchmarks/bench_scheduler.py --queued 10000 50000 100000
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from report import Report
+from scheduler import ReviewScheduler
+
+
+def make_report(i, rng, now):
+    report = Report(None)
+    report.id = i
+    report.author = f"user{rng.randrange(2000)}"
+    report.reason = rng.choice(["1", "2", "3", "3", "3", "4", None])
+    report.score = rng.random() if report.reason else None
+    report.created = now - rng.uniform(0, 6 * 3600)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queued", type=int, nargs="+", default=[10000, 50000, 100000])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--check", type=int, default=200, help="pops to verify against a full scan")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    offences = {f"user{i}": rng.choice([0, 0, 0, 1, 2, 5]) for i in range(2000)}
+
+    print(f"{'queued':>8} {'push us':>8} {'pop us':>8} {'by-id claims':>13} {'checked':>8}")
+    for count in args.queued:
+        now = time.time()
+        scheduler = ReviewScheduler(offender_counts=offences.get)
+        pending = {}
+        for i in range(count):
+            report = make_report(i, rng, now)
+            pending[i] = report
+            scheduler.push(report)
+
+        push = []
+        for i in range(count, count + args.ops):
+            report = make_report(i, rng, now)
+            start = time.perf_counter()
+            scheduler.push(report)
+            push.append(time.perf_counter() - start)
+            pending[i] = report
+
+        # Claim a tenth of the queue by ID, leaving stale heap entries behind
+        for report_id in rng.sample(sorted(pending), len(pending) // 10):
+            del pending[report_id]
+
+        pop = []
+        checked = 0
+        for n in range(args.ops):
+            if n < args.check:
+                later = time.time()
+                expected = max(scheduler.priority(report, later) for report in pending.values())
+            start = time.perf_counter()
+            report_id = scheduler.pop(pending)
+            report = pending.pop(report_id)
+            scheduler.compact(pending)
+            pop.append(time.perf_counter() - start)
+            if n < args.check:
+                assert abs(scheduler.priority(report, later) - expected) < 1e-6
+                checked += 1
+
+        print(f"{count:>8} {statistics.mean(push) * 1e6:>8.2f} {statistics.mean(pop) * 1e6:>8.2f} "
+              f"{count // 10:>13} {checked:>8}")
+
+
+if __name__ == '__main__':
+    main()
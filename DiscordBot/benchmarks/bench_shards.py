@@ -0,0 +1,201 @@
+# bench_shards.py
+# Runs ModBot as 1, 2, ... shard processes sharing one set of databases, as `python bot.py --shards N`
+# does, with a stub gateway per shard instead of Discord: each shard gets the channel traffic of the
+# guilds Discord would route to it, and dispatches every message as its own task. Perspective answers
+# instantly in-process, so the time measured is the bot's own work (ban rules, raid and rate tracking,
+# reports). Reports the combined throughput, then checks the shared state: a ban rule added by one
+# shard is enforced by all of them, and when every shard claims every guild's reports at once, each is
+# claimed once.
+#
+#   python benchmarks/bench_shards.py --shards 1 2 4 --guilds 64 --messages 500
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fakes import BOT_DIR, MOD_GUILD_ID, STUB_TOKENS, FakeChannel, FakeGuild, FakeMessage, FakeUser
+from stubs import TOXIC_WORDS, stub_scores
+
+BANNED_WORD = "zzshardban" # Banned by shard 0 once every shard is running
+RULES = [r"free\s+nitro", r"discord\.gift/\w+", r"(?i)buy followers", r"bit\.ly/\w{6}", r"\bspam{3,}\b"]
+WORDS = "the stream game chat play round patch build boss song team win lose good new today next clip hype".split()
+
+
+class InstantPerspective:
+    def analyze(self, text):
+        return stub_scores(text)
+
+    def analyze_batch(self, texts):
+        return [stub_scores(text) for text in texts]
+
+
+def guild_ids(count):
+    # Snowflakes spread over the shards the way Discord's are: by the timestamp bits above bit 22
+    return [MOD_GUILD_ID] + [(1100000000000000000 >> 22) + i << 22 for i in range(1, count)]
+
+
+def traffic(guild_id, count, banned_from):
+    '''
+    Channel messages for one guild: chatter, toxic messages, spam that ban rules remove, and from
+    message `banned_from` on, a few with the word shard 0 bans at the start.
+    '''
+    rng = random.Random(guild_id)
+    messages = []
+    for i in range(count):
+        roll = rng.random()
+        words = rng.choices(WORDS, k=rng.randint(4, 10))
+        if roll < 0.05:
+            words.insert(rng.randrange(len(words)), rng.choice(TOXIC_WORDS))
+        elif roll < 0.08:
+            words.append(rng.choice(["free nitro here", "discord.gift/abcdef", "buy followers now"]))
+        elif roll < 0.1 and i >= banned_from:
+            words.append(BANNED_WORD)
+        messages.append((rng.randrange(200), " ".join(words)))
+    return messages
+
+
+def build_shard(bot, shard_id, shard_count, guilds):
+    '''
+    A ModBot for one shard, serving the fake guilds Discord would route to it.
+    '''
+    from config import validate_config
+    from verdict_cache import VerdictCache
+    client = bot.ModBot(validate_config(STUB_TOKENS), shard_id=shard_id, shard_count=shard_count, metrics_port=None)
+    client.verdict_cache = VerdictCache()
+    client._connection.user = FakeUser("Group 1 Bot")
+    client.group_num = "1"
+    client.routes.set_group("1")
+    client.perspective = InstantPerspective()
+    client.regexes.refresh_interval = 0.05
+    channels = {}
+    for guild_id in guilds:
+        guild = FakeGuild(guild_id, f"guild {guild_id}")
+        channels[guild_id] = FakeChannel("group-1", guild)
+        mod_channel = FakeChannel("group-1-mod", guild)
+        client.moderation_store.set_mod_channel(guild_id, mod_channel.id)
+        client.routes.add_guild(guild)
+    by_id = {channel.id: channel for guild in channels.values() for channel in guild.guild.text_channels}
+    client.get_channel = by_id.get
+    return client, channels
+
+
+async def serve(client, channels, messages, window=256):
+    '''
+    Deliver the messages like the gateway would: every message is handled in its own task, with at
+    most `window` in flight.
+    '''
+    authors = {}
+    pending = set()
+    delivered = []
+    for guild_id, author, text in messages:
+        user = authors.get((guild_id, author))
+        if user is None:
+            user = authors[guild_id, author] = FakeUser(f"viewer{author}")
+        message = FakeMessage(text, user, channels[guild_id])
+        delivered.append(message)
+        pending.add(asyncio.create_task(client.on_message(message)))
+        if len(pending) >= window:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    if pending:
+        await asyncio.wait(pending)
+    return delivered
+
+
+def run_shard(shard_id, shard_count, directory, guilds, count, barrier, results):
+    os.chdir(directory)
+    sys.path.insert(0, BOT_DIR)
+    import bot
+
+    async def main():
+        client, channels = build_shard(bot, shard_id, shard_count, guilds)
+        # Interleave the guilds' traffic, as a shard sees it
+        streams = [[(guild_id, author, text) for author, text in traffic(guild_id, count, count // 2)] for guild_id in guilds]
+        messages = [message for batch in zip(*streams) for message in batch]
+        barrier.wait()
+        if shard_id == 0:
+            client.regexes.add("group-1", BANNED_WORD)
+        barrier.wait()
+        start = time.perf_counter()
+        delivered = await serve(client, channels, messages)
+        elapsed = time.perf_counter() - start
+        await client.actions.flush()
+        banned = [message.deleted for message in delivered if BANNED_WORD in message.content]
+
+        # Every shard claims every guild's reports as fast as it can, all at the same time
+        barrier.wait()
+        client.report_queue.sync()
+        claimed = 0
+        for guild_id in {report.guild_id for report in client.report_queue.pending.values()}:
+            while client.report_queue.claim(shard_id, guild_id) is not None:
+                claimed += 1
+        results.put({"shard": shard_id, "messages": len(messages), "elapsed": elapsed, "start": start,
+                     "reports": len(client.report_queue.store.open_reports()), "claimed": claimed,
+                     "banned": sum(banned), "banned_sent": len(banned), "rules": len(client.regexes.rules())})
+        client.classifier_pool.shutdown()
+        await client.close()
+
+    asyncio.run(main())
+
+
+def run(shard_count, guilds, count, context):
+    from sharding import shard_of
+    directory = tempfile.mkdtemp(prefix="modbot-shards-")
+    try:
+        # Ban rules every shard loads from the shared store at startup
+        from ban_rules import BanRuleIndex
+        from moderation_store import ModerationStore
+        store = ModerationStore(os.path.join(directory, "moderation.db"))
+        index = BanRuleIndex(store)
+        index.load()
+        for pattern in RULES:
+            index.add("group-1", pattern)
+        store.close()
+
+        barrier = context.Barrier(shard_count)
+        results = context.Queue()
+        processes = [context.Process(target=run_shard, args=(shard_id, shard_count, directory,
+                                                             [g for g in guilds if shard_of(g, shard_count) == shard_id],
+                                                             count, barrier, results))
+                     for shard_id in range(shard_count)]
+        for process in processes:
+            process.start()
+        shards = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        return shards
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--guilds", type=int, default=64)
+    parser.add_argument("--messages", type=int, default=500, help="channel messages per guild")
+    args = parser.parse_args()
+    sys.path.insert(0, BOT_DIR)
+    context = multiprocessing.get_context("spawn")
+    guilds = guild_ids(args.guilds)
+
+    print(f"{os.cpu_count()} CPUs, {args.guilds} guilds, {args.guilds * args.messages} messages")
+    print(f"{'shards':>6} {'msg/s':>9} {'slowest shard s':>16} {'reports':>8} {'claimed':>8}  per shard: messages, "
+          f"rules loaded, messages with the word shard 0 banned removed")
+    for shard_count in args.shards:
+        shards = sorted(run(shard_count, guilds, args.messages, context), key=lambda shard: shard["shard"])
+        messages = sum(shard["messages"] for shard in shards)
+        wall = max(shard["start"] + shard["elapsed"] for shard in shards) - min(shard["start"] for shard in shards)
+        reports = max(shard["reports"] for shard in shards) # Claimed reports stay open until reviewed
+        print(f"{shard_count:>6} {messages / wall:>9.0f} {max(shard['elapsed'] for shard in shards):>16.2f} "
+              f"{reports:>8} {sum(shard['claimed'] for shard in shards):>8}  "
+              + ", ".join(f"#{shard['shard']}: {shard['messages']}, {shard['rules']}, {shard['banned']}/{shard['banned_sent']}"
+                          for shard in shards))
+
+
+if __name__ == '__main__':
+    main()
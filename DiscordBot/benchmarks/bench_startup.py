@@ -0,0 +1,77 @@
+# bench_startup.py
+# Measures how long the bot takes to start: importing bot.py, using `python -X importtime` in a fresh
+# interpreter, then building ModBot and warming up its classifier backends. Also checks that importing
+# bot.py pulls in none of the classifier SDKs and leaves no files behind.
+#
+#   python benchmarks/bench_startup.py --runs 5
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Packages that should only be imported once the bot uses the backend that needs them
+LAZY_MODULES = ["openai", "googleapiclient", "httplib2", "requests", "pdb"]
+
+CONSTRUCT = '''
+import sys, time
+sys.path.insert(0, {bot_dir!r})
+sys.path.insert(0, {bench_dir!r})
+start = time.perf_counter()
+import bot
+from fakes import make_bot
+imported = time.perf_counter()
+client, *_ = make_bot(bot)
+built = time.perf_counter()
+client.warm_up_classifiers()
+warm = time.perf_counter()
+print(imported - start, built - imported, warm - built)
+'''
+
+
+def import_times(cwd):
+    '''
+    Map from module to (self, cumulative) import time in seconds, for one fresh `import bot`.
+    '''
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], cwd=cwd, env={**os.environ, "PYTHONPATH": BOT_DIR},
+                            capture_output=True, text=True, check=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own) / 1e6, int(cumulative) / 1e6, len(name) - len(name.lstrip()))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="number of heaviest imports to list")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix="modbot-startup-")
+    runs = [import_times(scratch) for _ in range(args.runs)]
+    totals = [times["bot"][1] for times in runs]
+    print(f"import bot: median {statistics.median(totals) * 1000:.0f} ms, min {min(totals) * 1000:.0f} ms over {args.runs} runs")
+
+    # The modules bot.py imports directly, heaviest first
+    times = min(runs, key=lambda times: times["bot"][1])
+    direct = sorted(((cumulative, name) for name, (_, cumulative, depth) in times.items() if depth == 3), reverse=True)
+    for cumulative, name in direct[:args.top]:
+        print(f"{name:>20} {cumulative * 1000:>8.1f} ms")
+
+    eager = [name for name in LAZY_MODULES if name in times]
+    print(f"classifier SDKs imported eagerly: {', '.join(eager) or 'none'}")
+    print(f"files left by the import: {', '.join(os.listdir(scratch)) or 'none'}")
+
+    construct = subprocess.run([sys.executable, "-c", CONSTRUCT.format(bot_dir=BOT_DIR, bench_dir=os.path.dirname(os.path.abspath(__file__)))],
+                               cwd=tempfile.mkdtemp(prefix="modbot-startup-"), capture_output=True, text=True, check=True).stdout
+    imported, built, warm = (float(value) for value in construct.split()[-3:])
+    print(f"import {imported * 1000:.0f} ms, ModBot() {built * 1000:.0f} ms, classifier warm-up (off the event loop) {warm * 1000:.0f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# bench_username_cache.py
+# Counts the GPT username checks a chatty offender costs: one user posts a stream of distinct hate
+# speech messages, renames halfway through, and the bot is restarted at the end. Uses the separate-
+# question GPT path, where the username check is its own call.
+#
+#   python benchmarks/bench_username_cache.py --messages 200
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_open_ai import ChatStub
+from fakes import FakeMessage, FakeUser, import_bot, make_bot
+
+
+async def offend(client, channel, author, count, start=0):
+    for i in range(start, start + count):
+        await client.eval_text_open_ai(FakeMessage(f"you are a tranny and always will be #{i}", author, channel))
+
+
+async def run(bot, args):
+    client, guild, channel, mod_channel = make_bot(bot)
+    stub = ChatStub(client.open_ai_client(), args.scale, json_mode=False)
+    client.open_ai_client().ChatCompletion.create = stub.create
+    author = FakeUser("vulgar_name")
+
+    start = time.perf_counter()
+    await offend(client, channel, author, args.messages // 2)
+    author.name = "vulgar_name_2"
+    await offend(client, channel, author, args.messages - args.messages // 2, args.messages // 2)
+    elapsed = time.perf_counter() - start
+    checks = stub.calls["gpt-4"] - args.messages # Every message also asks for its hate speech sub-category
+    print(f"{args.messages} messages in {elapsed:.2f}s, {checks} GPT calls for username checks "
+          f"(before: {2 * args.messages}, a check and a description per message)")
+    print(f"username cache: {client.username_verdicts.stats()}")
+    await client.close()
+
+    # The verdicts are still there after a restart
+    client, guild, channel, mod_channel = make_bot(bot)
+    client.open_ai_client().ChatCompletion.create = stub.create
+    before = stub.calls["gpt-4"]
+    await offend(client, channel, author, 1, args.messages)
+    print(f"after a restart: {stub.calls['gpt-4'] - before - 1} GPT calls for username checks of a known user")
+    await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--scale", type=float, default=0.01, help="fraction of the typical API latencies to sleep")
+    args = parser.parse_args()
+    asyncio.run(run(import_bot(), args))
+
+
+if __name__ == '__main__':
+    main()
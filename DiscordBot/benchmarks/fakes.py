@@ -0,0 +1,108 @@
+# fakes.py
+# Minimal stand-ins for the discord.py objects ModBot touches, so the bot can be driven without a gateway.
+import itertools
+import os
+import sys
+import tempfile
+
+BOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BOT_DIR)
+
+MOD_GUILD_ID = 1103033282779676743
+STUB_TOKENS = {"discord": "stub", "open_ai_key": "stub", "perspective_ai_key": "stub"}
+_ids = itertools.count(1)
+
+
+class FakeResponse:
+    status = 404
+    reason = "Not Found"
+
+
+class FakeUser:
+    def __init__(self, name, id=None):
+        self.id = id if id is not None else next(_ids)
+        self.name = name
+
+
+class FakeGuild:
+    def __init__(self, id=MOD_GUILD_ID, name="CS 152"):
+        self.id = id
+        self.name = name
+        self.text_channels = []
+
+    def get_channel(self, channel_id):
+        for channel in self.text_channels:
+            if channel.id == channel_id:
+                return channel
+        return None
+
+
+class FakeChannel:
+    def __init__(self, name, guild=None):
+        self.id = next(_ids)
+        self.name = name
+        self.guild = guild
+        self.sent = []
+        self.messages = {} # Map from message ID to the messages posted here
+        if guild is not None:
+            guild.text_channels.append(self)
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content)
+
+    async def delete_messages(self, messages):
+        for message in messages:
+            await message.delete()
+
+    async def fetch_message(self, message_id):
+        import discord
+        if message_id not in self.messages:
+            raise discord.errors.NotFound(FakeResponse(), "Unknown Message")
+        return self.messages[message_id]
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = channel.guild
+        self.deleted = False
+        channel.messages[self.id] = self
+
+    async def delete(self):
+        self.deleted = True
+        self.channel.messages.pop(self.id, None)
+
+
+def import_bot():
+    '''
+    Import bot.py and move to a scratch directory, so the databases and log file the bot creates in
+    its working directory don't touch the real ones.
+    '''
+    os.chdir(tempfile.mkdtemp(prefix="modbot-bench-"))
+    import bot
+    return bot
+
+
+def make_bot(bot_module, group_num="1", config=None, **kwargs):
+    '''
+    Build a ModBot wired to a fake guild with the group's normal and mod channels, routed as on_ready would.
+    By default every classifier backend is enabled, with dummy tokens.
+    '''
+    from config import validate_config
+    from verdict_cache import VerdictCache
+    client = bot_module.ModBot(validate_config(config if config is not None else STUB_TOKENS), **kwargs)
+    client.verdict_cache = VerdictCache() # Start cold, without reading or writing a snapshot
+    client._connection.user = FakeUser(f"Group {group_num} Bot")
+    client.group_num = group_num
+    guild = FakeGuild()
+    channel = FakeChannel(f"group-{group_num}", guild)
+    mod_channel = FakeChannel(f"group-{group_num}-mod", guild)
+    client.routes.set_group(group_num)
+    client.routes.add_guild(guild)
+    # Message links and queued reports are looked up through the client's guild and channel caches
+    client.get_guild = {guild.id: guild}.get
+    client.get_channel = guild.get_channel
+    return client, guild, channel, mod_channel
@@ -0,0 +1,283 @@
+# replay.py
+# The standard load test for ModBot: streams a corpus of recorded traffic through on_message, which
+# hands it to handle_channel_message, handle_dm and handle_mod_channel_message as Discord would, with
+# local stub servers standing in for Perspective and OpenAI. Reports throughput, handling latency per
+# kind of message, and API calls per message. Run it before and after every performance change.
+#
+#   python benchmarks/replay.py --synthesize 2000 --out corpus.jsonl
+#   python benchmarks/replay.py corpus.jsonl --speed 0 --json before.json
+#   python benchmarks/replay.py corpus.jsonl --perspective-delay 0.1 --openai-scale 0.2 --error-rate 0.02
+#
+# The corpus is JSONL, one message per line: {"kind": "channel" | "dm" | "mod", "author": name,
+# "content": text, "at": seconds since the start of the recording}. In a DM, "{link:N}" becomes the link
+# to the message replayed from line N (counting from 0), so recorded reports point at replayed messages.
+# Messages are delivered at their recorded times divided by --speed (--speed 0 delivers everything at
+# once), each handled in its own task like discord.py does, except that an author's DMs and mod-channel
+# messages are handled in order.
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import re
+import statistics
+import time
+from collections import Counter, defaultdict
+
+from bench_channel_latency import heartbeat, percentile
+from fakes import FakeChannel, FakeMessage, FakeUser, import_bot, make_bot
+from metrics import REGISTRY
+from perspective import PerspectiveClient
+from stubs import HATE_WORDS, TOXIC_WORDS, OpenAIStub, PerspectiveStub
+
+KINDS = ["channel", "dm", "mod"]
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, float("inf")]
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def synthesize(count, rate=50.0, seed=0):
+    '''
+    A corpus of `count` lines arriving at about `rate` messages per second: channel chatter with
+    repeated and toxic messages, users reporting recent toxic messages over DM, and moderators
+    working through the queue.
+    '''
+    rng = random.Random(seed)
+    topics = ["the stream", "that last round", "the new patch", "my build", "the raid boss", "this song", "the tournament"]
+    benign = ["gg", "lol", "nice one", "what a play", "hi chat", "poggers"]
+    users = [f"viewer{i}" for i in range(200)] + ["vulgar_troll"]
+    lines, toxic_lines = [], []
+    at = 0.0
+    while len(lines) < count:
+        at += rng.expovariate(rate)
+        roll = rng.random()
+        if roll < 0.02 and toxic_lines:
+            # A user reports a recent toxic message, answering a prompt every second or so
+            reporter = rng.choice(users[:-1])
+            for step, content in enumerate(["report", rng.choice(toxic_lines[-20:]), "yes", "3", "no"]):
+                lines.append({"kind": "dm", "author": reporter, "content": content, "at": round(at + step, 3)})
+        elif roll < 0.04:
+            # A moderator reviews the most urgent report
+            moderator = f"mod{rng.randrange(3)}"
+            answers = ["next", "no", "no"] if rng.random() < 0.5 else ["next", "yes", "no"]
+            for step, content in enumerate(answers):
+                lines.append({"kind": "mod", "author": moderator, "content": content, "at": round(at + 2 * step, 3)})
+        else:
+            author = rng.choice(users)
+            if roll < 0.12:
+                content = f"you {rng.choice(TOXIC_WORDS)} {rng.choice(['clown', 'loser', 'bot'])}"
+            elif roll < 0.14:
+                content = f"you are a {rng.choice(HATE_WORDS)} and always will be"
+            elif roll < 0.50:
+                content = rng.choice(benign) # Repeated texts, which the verdict cache answers
+            else:
+                content = f"what do you think of {rng.choice(topics)}? #{rng.randrange(10 ** 6)}"
+            line = {"kind": "channel", "author": author, "content": content, "at": round(at, 3)}
+            if roll < 0.14:
+                toxic_lines.append(line)
+            lines.append(line)
+    lines.sort(key=lambda line: line["at"])
+    # Reports hold the reported line itself until its final position is known
+    position = {id(line): i for i, line in enumerate(lines)}
+    for line in lines:
+        if isinstance(line["content"], dict):
+            line["content"] = f"{{link:{position[id(line['content'])]}}}"
+    return lines[:count]
+
+
+class Replay:
+    '''
+    Builds the fake users, channels and messages for a corpus, delivers them to the bot, and records
+    how long each one took to handle.
+    '''
+    def __init__(self, client, guild, channel, mod_channel):
+        self.client = client
+        self.guild = guild
+        self.channel = channel
+        self.mod_channel = mod_channel
+        self.users = {} # Map from author name to their fake user
+        self.dm_channels = {} # Map from author name to the DM channel with the bot
+        self.replayed = {} # Map from corpus line number to the message replayed from it
+        self.latencies = defaultdict(list) # Map from kind to the handling latency of each message
+        self.errors = Counter() # Map from exception type to the messages whose handler raised it
+        self.previous = {} # Map from (kind, author) to the task handling their last message
+
+    def user(self, name):
+        if name not in self.users:
+            self.users[name] = FakeUser(name)
+        return self.users[name]
+
+    def link(self, match):
+        message = self.replayed.get(int(match.group(1)))
+        if message is None:
+            return "https://discord.com/channels/0/0/0"
+        return f"https://discord.com/channels/{self.guild.id}/{message.channel.id}/{message.id}"
+
+    def build(self, number, line):
+        kind, author = line["kind"], line["author"]
+        if kind == "channel":
+            message = FakeMessage(line["content"], self.user(author), self.channel)
+            self.replayed[number] = message
+            return message
+        if kind == "mod":
+            return FakeMessage(line["content"], self.user(author), self.mod_channel)
+        if author not in self.dm_channels:
+            self.dm_channels[author] = FakeChannel(f"dm-{author}")
+        return FakeMessage(re.sub(r"\{link:(\d+)\}", self.link, line["content"]), self.user(author), self.dm_channels[author])
+
+    async def handle(self, kind, message, due, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self.client.on_message(message)
+        except Exception as e:
+            # discord.py would log it through on_error and carry on
+            self.errors[type(e).__name__] += 1
+        self.latencies[kind].append(time.perf_counter() - due)
+
+    async def run(self, corpus, speed):
+        tasks = []
+        start = time.perf_counter()
+        for number, line in enumerate(corpus):
+            due = start + (line.get("at", 0) / speed if speed else 0)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            message = self.build(number, line)
+            key = (line["kind"], line["author"])
+            previous = self.previous.get(key) if line["kind"] != "channel" else None
+            task = asyncio.create_task(self.handle(line["kind"], message, due, previous))
+            if line["kind"] != "channel":
+                self.previous[key] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+
+def histogram(latencies):
+    counts = [0] * len(BUCKETS)
+    for latency in latencies:
+        counts[next(i for i, bound in enumerate(BUCKETS) if latency <= bound)] += 1
+    return counts
+
+
+def summarize(replay, elapsed, perspective, openai_stub, lags):
+    messages = sum(len(latencies) for latencies in replay.latencies.values())
+    result = {"messages": messages, "elapsed": elapsed, "throughput": messages / elapsed,
+              "errors": dict(replay.errors), "max_loop_lag": max(lags, default=0), "latency": {}}
+    for kind in KINDS:
+        latencies = replay.latencies.get(kind)
+        if latencies:
+            result["latency"][kind] = {"count": len(latencies), "mean": statistics.mean(latencies),
+                                       "p50": percentile(latencies, 50), "p90": percentile(latencies, 90),
+                                       "p99": percentile(latencies, 99), "max": max(latencies),
+                                       "histogram": histogram(latencies)}
+    api = {"perspective_texts": perspective.analyze_calls, "perspective_round_trips": perspective.http_requests,
+           "perspective_errors": perspective.errors, "openai_errors": openai_stub.errors,
+           **{f"openai_{model}": calls for model, calls in sorted(openai_stub.calls.items())}}
+    result["api"] = api
+    result["api_per_message"] = {name: calls / max(messages, 1) for name, calls in api.items()}
+    result["spans"] = {name: {"count": histogram.count, "mean": histogram.sum / histogram.count}
+                       for name, histogram in sorted(REGISTRY.spans.items())}
+    client = replay.client
+    result["bot"] = {"mod_channel_posts": len(replay.mod_channel.sent), "reports_pending": len(client.report_queue),
+                     "verdict_cache": client.verdict_cache.stats(), "batcher": client.perspective_batcher.stats(),
+                     "cascade": client.cascade.stats(), "username_cache": client.username_verdicts.stats(),
+                     "author_rates": client.author_rates.stats(), "moderation_actions": client.actions.stats(),
+                     "report_digest": client.report_digest.stats()}
+    return result
+
+
+def print_summary(result):
+    print(f"{result['messages']} messages in {result['elapsed']:.2f}s ({result['throughput']:.1f} msg/s), "
+          f"max event loop lag {result['max_loop_lag'] * 1000:.1f} ms, errors: {result['errors'] or 'none'}")
+    print(f"{'kind':>8} {'count':>7} {'mean ms':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind, stats in result["latency"].items():
+        print(f"{kind:>8} {stats['count']:>7} " + " ".join(f"{stats[name] * 1000:>8.1f}" for name in ["mean", "p50", "p90", "p99", "max"]))
+    for kind, stats in result["latency"].items():
+        print(f"\n{kind} latency histogram")
+        lower = 0
+        for bound, count in zip(BUCKETS, stats["histogram"]):
+            label = f"{lower * 1000:g}-{bound * 1000:g} ms" if bound != float("inf") else f">{lower * 1000:g} ms"
+            print(f"{label:>16} {count:>7} {'#' * round(50 * count / stats['count'])}")
+            lower = bound
+    print(f"\n{'span':>40} {'count':>8} {'mean ms':>8}")
+    for name, stats in result["spans"].items():
+        print(f"{name:>40} {stats['count']:>8} {stats['mean'] * 1000:>8.2f}")
+    print("\nAPI calls per message")
+    for name, per_message in result["api_per_message"].items():
+        print(f"{name:>30} {per_message:>8.3f} ({result['api'][name]} total)")
+    print()
+    for name, value in result["bot"].items():
+        print(f"{name}: {value}")
+
+
+async def run(args, corpus, perspective, openai_stub):
+    bot_module = import_bot()
+    client, guild, channel, mod_channel = make_bot(bot_module, max_classifier_requests=args.concurrency,
+                                                   batch_size=args.batch_size, batch_delay=args.batch_delay)
+    client.open_ai_client().api_base = openai_stub.url
+    client.perspective = PerspectiveClient("stub", api_endpoint=perspective.url)
+    replay = Replay(client, guild, channel, mod_channel)
+
+    try:
+        stop, lags = asyncio.Event(), []
+        beat = asyncio.create_task(heartbeat(stop, 0.01, lags))
+        # The bot prints every score; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed = await replay.run(corpus, args.speed)
+        stop.set()
+        await beat
+        # Post the last digests and carry out the queued deletions and notices, so the stats count them
+        await client.report_digest.flush()
+        await client.actions.flush()
+        return summarize(replay, elapsed, perspective, openai_stub, lags)
+    finally:
+        # Stops the regex worker and closes the databases
+        client.classifier_pool.shutdown()
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("corpus", nargs="?", help="JSONL corpus to replay")
+    parser.add_argument("--synthesize", type=int, metavar="N", help="write a synthetic corpus of N messages instead of replaying")
+    parser.add_argument("--out", default="corpus.jsonl", help="where --synthesize writes the corpus")
+    parser.add_argument("--rate", type=float, default=50.0, help="messages per second in a synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up over the recorded times (0: all at once)")
+    parser.add_argument("--perspective-delay", type=float, default=0.05, help="Perspective stub latency in seconds")
+    parser.add_argument("--openai-scale", type=float, default=0.1, help="fraction of typical GPT latencies the stub sleeps")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of API calls the stubs fail")
+    parser.add_argument("--no-json-mode", action="store_true", help="the OpenAI stub rejects structured requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight classifier requests")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--batch-delay", type=float, default=0.05, help="seconds before a partial batch is flushed")
+    parser.add_argument("--json", metavar="PATH", help="also write the results as JSON, to compare runs")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        with open(args.out, "w") as f:
+            f.writelines(json.dumps(line) + "\n" for line in synthesize(args.synthesize, args.rate, args.seed))
+        print(f"wrote {args.synthesize} messages to {args.out}")
+        return
+    if not args.corpus:
+        parser.error("a corpus is needed unless --synthesize is given")
+
+    corpus = load_corpus(args.corpus)
+    with PerspectiveStub(delay=args.perspective_delay, error_rate=args.error_rate, seed=args.seed) as perspective, \
+         OpenAIStub(scale=args.openai_scale, error_rate=args.error_rate, json_mode=not args.no_json_mode, seed=args.seed) as openai_stub:
+        result = asyncio.run(run(args, corpus, perspective, openai_stub))
+    print_summary(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    main()
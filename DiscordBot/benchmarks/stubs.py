@@ -0,0 +1,257 @@
+# stubs.py
+# Local stand-ins for the remote classifier APIs, used by the benchmark scripts in this folder.
+import json
+import os
+import random
+import uuid
+from collections import Counter
+from email.parser import Parser
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from perspective import VENDORED_DISCOVERY, CONTENT_ATTRIBUTES
+
+# Words that make the stub score a message as toxic
+TOXIC_WORDS = ("hate", "kill", "stupid", "idiot", "disgusting")
+# Words that make the GPT stub call a message hate speech, and usernames it objects to
+HATE_WORDS = ("tranny",)
+VULGAR_NAMES = ("vulgar",)
+
+# Typical ChatCompletion latencies in seconds
+OPENAI_LATENCY = {"gpt-3.5-turbo": 0.6, "gpt-4": 1.5, "gpt-4-turbo": 1.8}
+
+
+def stub_scores(text, attributes=CONTENT_ATTRIBUTES):
+    '''
+    Deterministic fake attribute scores: any toxic word pushes every attribute above the bot's threshold,
+    and hate speech lands in the uncertain band the cascade asks GPT about.
+    '''
+    lowered = text.lower()
+    if any(word in lowered for word in TOXIC_WORDS):
+        base = 0.9
+    elif any(word in lowered for word in HATE_WORDS):
+        base = 0.6
+    else:
+        base = 0.1
+    return {attribute: base - 0.01 * i for i, attribute in enumerate(attributes)}
+
+
+UNAVAILABLE = {"error": {"code": 503, "message": "The service is currently unavailable.", "status": "UNAVAILABLE"}}
+
+
+def _analyze_response(request):
+    scores = stub_scores(request["comment"]["text"], list(request["requestedAttributes"]))
+    return {"attributeScores": {attribute: {"summaryScore": {"value": value, "type": "PROBABILITY"}}
+                                for attribute, value in scores.items()}}
+
+
+def chat_answer(messages, response_format=None):
+    '''
+    What GPT would answer to each of the bot's prompts, decided by keywords in the message and username.
+    '''
+    system, question = messages[0]["content"], messages[-1]["content"]
+    if response_format is not None:
+        asked = json.loads(question)
+        hate = any(word in asked["message"] for word in HATE_WORDS)
+        toxic = hate or any(word in asked["message"].lower() for word in TOXIC_WORDS)
+        return json.dumps({"toxic": toxic, "reason": "1" if hate else "3" if toxic else None, "category": "3" if hate else None,
+                           "username_issue": "The username is vulgar." if any(word in asked["username"] for word in VULGAR_NAMES) else None})
+    if system.startswith("You are a message moderation system"):
+        if any(word in question for word in HATE_WORDS):
+            return "True, 1"
+        return "True, 3" if any(word in question.lower() for word in TOXIC_WORDS) else "False, None"
+    if system.startswith("Which category"):
+        return "3"
+    if system.startswith("True/False"):
+        return "True" if any(word in question for word in VULGAR_NAMES) else "False"
+    return "The username is vulgar."
+
+
+def _parse_batch(content_type, body):
+    '''
+    Split a multipart/mixed batch request into (Content-ID, JSON body) pairs.
+    '''
+    message = Parser().parsestr(f"Content-Type: {content_type}\r\n\r\n" + body.decode("utf-8"))
+    parts = []
+    for part in message.get_payload():
+        # Each part is a serialized HTTP request: request line and headers, a blank line, then the JSON body
+        inner = part.get_payload().replace("\r\n", "\n")
+        parts.append((part["Content-ID"], json.loads(inner.split("\n\n", 1)[1])))
+    return parts
+
+
+class PerspectiveStub:
+    '''
+    Threaded HTTP server that speaks enough of the Perspective API for the bot: it serves the
+    discovery document and answers analyze calls after an optional delay, counting both. A fraction
+    `error_rate` of the texts get a 503 instead of scores.
+    '''
+    def __init__(self, delay=0.0, port=0, error_rate=0.0, seed=0):
+        self.delay = delay
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.discovery_fetches = 0
+        self.analyze_calls = 0 # Texts scored, whether sent alone or inside a batch
+        self.http_requests = 0 # Analyze and batch round trips
+        self.errors = 0 # Texts answered with an error
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+    @property
+    def discovery_url(self):
+        return self.url + "$discovery/rest?version=v1alpha1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if not self.path.startswith("/$discovery/rest"):
+                    return self._reply(404, {"error": "not found"})
+                with stub._lock:
+                    stub.discovery_fetches += 1
+                with open(VENDORED_DISCOVERY) as f:
+                    document = json.load(f)
+                document["rootUrl"] = document["baseUrl"] = stub.url
+                self._reply(200, document)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                if self.path.startswith("/v1alpha1/comments:analyze"):
+                    requests = [json.loads(body)]
+                elif self.path.startswith("/batch"):
+                    parts = _parse_batch(self.headers["Content-Type"], body)
+                    requests = [request for _, request in parts]
+                else:
+                    return self._reply(404, {"error": "not found"})
+
+                with stub._lock:
+                    stub.http_requests += 1
+                    stub.analyze_calls += len(requests)
+                    failed = [stub.random.random() < stub.error_rate for _ in requests]
+                    stub.errors += sum(failed)
+                if stub.delay:
+                    time.sleep(stub.delay)
+
+                if self.path.startswith("/batch"):
+                    return self._reply_batch([(content_id, UNAVAILABLE if fail else _analyze_response(request))
+                                              for (content_id, request), fail in zip(parts, failed)])
+                if failed[0]:
+                    return self._reply(503, UNAVAILABLE)
+                self._reply(200, _analyze_response(requests[0]))
+
+            def _reply_batch(self, responses):
+                boundary = uuid.uuid4().hex
+                chunks = []
+                for content_id, payload in responses:
+                    status = "503 Service Unavailable" if payload is UNAVAILABLE else "200 OK"
+                    chunks.append(f"--{boundary}\r\nContent-Type: application/http\r\n"
+                                  f"Content-ID: <response-{content_id[1:-1]}>\r\n\r\n"
+                                  f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n\r\n"
+                                  f"{json.dumps(payload)}\r\n")
+                body = ("".join(chunks) + f"--{boundary}--\r\n").encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/mixed; boundary={boundary}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+class OpenAIStub:
+    '''
+    Threaded HTTP server answering the OpenAI chat completions endpoint like GPT would (see
+    chat_answer), after the model's latency in OPENAI_LATENCY times `scale`. A fraction `error_rate`
+    of the calls fail with a 500; without `json_mode`, structured requests are rejected like they
+    are for models that don't support it. Point the openai package at it with `openai.api_base = stub.url`.
+    '''
+    def __init__(self, scale=1.0, port=0, error_rate=0.0, json_mode=True, seed=0):
+        self.scale = scale
+        self.error_rate = error_rate
+        self.json_mode = json_mode
+        self.random = random.Random(seed)
+        self.calls = Counter() # Map from model to the number of completions asked of it
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if not self.path.startswith("/v1/chat/completions"):
+                    return self._reply(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+                model = body["model"]
+                with stub._lock:
+                    stub.calls[model] += 1
+                    failed = stub.random.random() < stub.error_rate
+                    stub.errors += failed
+                if body.get("response_format") is not None and not stub.json_mode:
+                    return self._reply(400, {"error": {"message": "response_format is not supported with this model",
+                                                       "type": "invalid_request_error", "param": "response_format"}})
+                time.sleep(OPENAI_LATENCY.get(model, 1.0) * stub.scale)
+                if failed:
+                    return self._reply(500, {"error": {"message": "The server had an error while processing your request.",
+                                                       "type": "server_error"}})
+                answer = chat_answer(body["messages"], body.get("response_format"))
+                self._reply(200, {"id": "chatcmpl-" + uuid.uuid4().hex, "object": "chat.completion", "model": model,
+                                  "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}]})
+
+        return Handler
@@ -1,51 +1,139 @@
 # bot.py
+import argparse
+import asyncio
 import discord
-from discord.ext import commands
-import os
 import json
 import logging
+import queue
 import re
-import requests
-from report import Report
+from datetime import timedelta
+from report import Report, decode_escapes
 from report import ModReview
-import pdb
-from collections import defaultdict
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+
+# Packages for automated section (Milestone 3); the classifier SDKs are imported when first used
+from config import load_config
+from cascade import Cascade, load_thresholds
+from batcher import ScoreBatcher
+from verdict_cache import VerdictCache
+from ban_rules import BanRuleIndex, RegexSandbox
+from user_stats import open_offender_store
+from username_cache import UsernameVerdictCache
+from moderation_store import ModerationStore
+from report_queue import ReportQueue
+from scheduler import ReviewScheduler, severity_class
+from raid import RaidDetector
+from author_rates import AuthorRateTracker
+from channel_routes import ChannelRouter, MOD, MONITORED
+from moderation_actions import ModerationActions, REMOVED_NOTICE
+from report_digest import ReportDigest
+from metrics import REGISTRY, SamplingProfiler, span
 
-# Packages for automated section (Milestone 3)
-import openai 
-from googleapiclient import discovery
-
-# Set up logging to the console
 logger = logging.getLogger('discord')
-logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
 
 # There should be a file called 'tokens.json' inside the same folder as this file
 token_path = 'tokens.json'
-if not os.path.isfile(token_path):
-    raise Exception(f"{token_path} not found!")
-with open(token_path) as f:
-    # If you get an error here, it means your token is formatted incorrectly. Did you put it in quotes?
-    tokens = json.load(f)
-    discord_token = tokens['discord']
-    open_ai_key = tokens['open_ai_key']
-    perspective_ai_key = tokens['perspective_ai_key']
+
+OPEN_AI_ORGANIZATION = "org-YVZe9QFuR0Ke0J0rqr7l2R2L"
+
+# The single-request GPT classification answers in JSON mode, which needs a model that supports it
+STRUCTURED_MODEL = "gpt-4-turbo"
+STRUCTURED_PROMPT = (
+    "You are a message moderation system on twitch. You are given a chat message and its author's username as JSON. "
+    "Answer with a JSON object with the keys \"toxic\", \"reason\", \"category\" and \"username_issue\".\n"
+    "toxic: true if the message is toxic, false otherwise.\n"
+    "reason: if the message is toxic, its category as a string: \"1\" Transphobic Hate Speech, \"2\" Nudity or Sexual Activity, "
+    "\"3\" Harassment, \"4\" Imminent Danger; otherwise null. Hate speech includes deadnaming, use of transphobic slurs, "
+    "and misgendering.\n"
+    "category: if reason is \"1\", the kind of hate speech as a string: \"1\" the content includes deadnaming, "
+    "\"2\" the content misgenders someone, \"3\" the content includes a slur; otherwise null.\n"
+    "username_issue: if the username is vulgar or inappropriate, a short description of the issue; otherwise null.")
+
+
+def structured_unsupported(error):
+    '''
+    Whether GPT rejected a structured request because of the model or JSON mode, rather than because of
+    the message in it.
+    '''
+    text = str(error).lower()
+    return (getattr(error, "param", None) in ["model", "response_format"] or getattr(error, "code", None) == "model_not_found"
+            or "response_format" in text or "does not exist" in text)
+
+
+def setup_logging(path='discord.log'):
+    '''
+    Log to a file through a queue: records are handed to a listener thread that writes them, so
+    logging never blocks the event loop. Returns the listener, to stop when the bot exits.
+    '''
+    logger.setLevel(logging.DEBUG)
+    handler = logging.FileHandler(filename=path, encoding='utf-8', mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    log_listener = QueueListener(log_queue, handler)
+    log_listener.start()
+    return log_listener
 
 
 class ModBot(discord.Client):
-    def __init__(self): 
+    def __init__(self, config, max_classifier_requests=8, batch_size=32, batch_delay=0.05, metrics_port=9464,
+                 action_window=1.0, digest_window=5.0, shard_id=None, shard_count=None): 
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(command_prefix='.', intents=intents)
+        super().__init__(command_prefix='.', intents=intents, shard_id=shard_id, shard_count=shard_count)
+        # With shards, every shard process shares the databases below; see sharding.py
+        sharded = shard_count is not None
+        self.config = config # Tokens and enabled classifiers, from config.load_config
+        self.classifiers = config["classifiers"] # Map from classifier backend to whether it is enabled
         self.group_num = None
-        self.mod_channels = {} # Map from guild to the mod channel id for that guild
+        self.routes = ChannelRouter() # What to do with each channel's messages, by channel ID
+        self.mod_channels = self.routes.mod_channels # Map from guild ID to the mod channel for that guild, for the guilds this shard serves
         self.reports = {} # Map from user IDs to the state of their report
         self.mod_reviews = defaultdict(list) # Map from mod IDs to the state of the reports they're working on
-        self.currReport = None # The current report being passed through the flow
-        self.userStatsFile = "./userStatistics.json" # User statistics for how many times a user has been reported
-        self.regexes = {}
+        self.userStatsFile = "./userStatistics.json" # Old per-user violation counts, imported into the store below
+        self.offender_stats = open_offender_store("./userStatistics.db", legacy_json=self.userStatsFile) # How many times each user has been reported
+        self.username_verdicts = UsernameVerdictCache("./usernameVerdicts.db") # Username checks, by author ID and current name
+        self.moderation_store = ModerationStore("./moderation.db", shard_id) # Durable report queue, ban rules and mod channels
+        thresholds = load_thresholds("./thresholds.json") # Classifier thresholds and rate limits, tuned offline with DataAnalysis/sweep.py
+        throttle = thresholds["throttle"]
+        self.author_rates = AuthorRateTracker(rate=throttle["rate"], burst=throttle["burst"]) # How fast each author is posting in each monitored channel
+        self.throttle_delete = throttle["delete"] # Whether messages over an author's rate limit are removed
+        self.throttle_timeout = throttle["timeout"] # Seconds an author who floods a channel is timed out for, 0 for never
+        self.review_scheduler = ReviewScheduler(offender_counts=self.offender_stats.get,
+                                                author_pressure=self.author_rates.pressure) # Orders pending reports by severity and age
+        self.report_queue = ReportQueue(self.moderation_store, self, self.review_scheduler) # Reports waiting for a moderator, by ID
+        self.report_queue.recover()
+        self.regexes = BanRuleIndex(store=self.moderation_store) # Regexes moderators have banned, indexed by channel name
+        self.regexes.load()
+        self.regex_sandbox = RegexSandbox(self.regexes) # Runs the banned regexes in a worker process with a time budget
+        self.perspective = None # Perspective API client, built once on first use
+        self.openai = None # The openai module, imported on first use
+        self.perspective_thresholds = thresholds["perspective"] # Map from Perspective attribute to the score above which it counts as toxic
+        self.cascade = Cascade.load("./local_model.json", **thresholds["cascade"]) # Which classifiers a channel message goes through
+        if not self.classifiers["open_ai"]:
+            self.cascade.gpt_band = None
+        self.open_ai_structured = True # Whether GPT can answer in one structured request (see open_ai_structured_verdict)
+        self.verdict_cache = VerdictCache(snapshot_path=f"./verdictCache{'.' + str(shard_id) if sharded else ''}.json") # Classifier verdicts for recently seen texts
+        self.verdict_cache.load()
+        self.raid_detector = RaidDetector() # Near-copies of recent channel messages, to report a raid once
+
+        # Classifier calls block on HTTP, so they run in a worker pool with a cap on in-flight requests
+        self.classifier_pool = ThreadPoolExecutor(max_workers=max_classifier_requests, thread_name_prefix="classifier")
+        self.classifier_slots = asyncio.Semaphore(max_classifier_requests)
+
+        # Channel messages are scored in micro-batches: one API round trip per `batch_size` messages or `batch_delay` seconds
+        self.perspective_batcher = ScoreBatcher(self.score_perspective_batch, max_batch=batch_size, max_delay=batch_delay)
+
+        # Deletions and notices are carried out in bulk, once per `action_window` seconds per channel
+        self.actions = ModerationActions(self.send, window=action_window)
+        # New reports are announced in the mod channel in one digest per `digest_window` seconds
+        self.report_digest = ReportDigest(self.actions.post, self.report_queue, window=digest_window)
+
+        self.metrics_port = metrics_port # Port of the local Prometheus endpoint, None to not serve one
+        self.metrics_server = None
+        self.profiler = SamplingProfiler() # Toggled with the `profile` command in the mod channel
 
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
@@ -60,12 +148,81 @@ class ModBot(discord.Client):
         else:
             raise Exception("Group number not found in bot's name. Name format should be \"Group # Bot\".")
 
-        # Find the mod channel in each guild that this bot should report to
+        # Route every channel by ID, and tell the other shards where each guild's mod channel is
+        self.routes.set_group(self.group_num)
         for guild in self.guilds:
-            for channel in guild.text_channels:
-                if channel.name == f'group-{self.group_num}-mod':
-                    self.mod_channels[guild.id] = channel
-        
+            self.routes.add_guild(guild)
+        self.moderation_store.set_guilds(guild.id for guild in self.guilds)
+        for guild_id, channel in self.mod_channels.items():
+            self.moderation_store.set_mod_channel(guild_id, channel.id)
+
+        # Build the classifier clients in the background, so the first message doesn't pay for them
+        # and nothing here holds up the events that follow ready
+        self.classifier_pool.submit(self.warm_up_classifiers)
+
+        # Serve the hot-path metrics to a local Prometheus scraper
+        if self.metrics_port is not None and self.metrics_server is None:
+            REGISTRY.add_gauges(self.metrics_gauges)
+            self.metrics_server = await REGISTRY.serve(port=self.metrics_port)
+            print(f'Serving metrics on http://127.0.0.1:{self.metrics_port}/metrics')
+
+    # Channels created, renamed or deleted after startup. Only text channels are routed, as at startup:
+    # a category or voice channel with the group's name can't be the mod channel
+
+    async def on_guild_channel_create(self, channel):
+        if not isinstance(channel, discord.TextChannel):
+            return
+        if self.routes.update(channel).role == MOD:
+            self.moderation_store.set_mod_channel(channel.guild.id, channel.id)
+
+    async def on_guild_channel_update(self, before, after):
+        if not isinstance(after, discord.TextChannel):
+            await self.on_guild_channel_delete(after)
+            return
+        was_mod = self.mod_channels.get(after.guild.id) is not None
+        if self.routes.update(after).role == MOD:
+            self.moderation_store.set_mod_channel(after.guild.id, after.id)
+        elif was_mod and after.guild.id not in self.mod_channels:
+            self.moderation_store.remove_mod_channel(after.guild.id)
+
+    async def on_guild_channel_delete(self, channel):
+        was_mod = channel.guild.id in self.mod_channels
+        self.routes.remove(channel)
+        if was_mod and channel.guild.id not in self.mod_channels:
+            self.moderation_store.remove_mod_channel(channel.guild.id)
+
+    async def on_guild_join(self, guild):
+        self.routes.add_guild(guild)
+        self.moderation_store.set_guilds([guild.id])
+        if guild.id in self.mod_channels:
+            self.moderation_store.set_mod_channel(guild.id, self.mod_channels[guild.id].id)
+
+    async def on_guild_remove(self, guild):
+        if guild.id in self.mod_channels:
+            self.moderation_store.remove_mod_channel(guild.id)
+        self.moderation_store.remove_guild(guild.id)
+        self.routes.remove_guild(guild)
+
+    async def close(self):
+        await self.report_digest.flush()
+        await self.actions.flush()
+        # Keep the verdict cache warm across restarts
+        self.verdict_cache.save()
+        self.profiler.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.regex_sandbox.close()
+        # Reviews in progress end with the process; their reports go back to the queue right away, so
+        # moderators on other shards don't have to wait for this one to restart
+        for reviews in self.mod_reviews.values():
+            for review in reviews:
+                self.report_queue.release(review.report.id)
+        self.mod_reviews.clear()
+        self.offender_stats.close()
+        self.username_verdicts.close()
+        self.report_queue.save()
+        self.moderation_store.close()
+        await super().close()
 
     async def on_message(self, message):
         '''
@@ -78,12 +235,17 @@ class ModBot(discord.Client):
 
         # Check if this message was sent in a server ("guild") or if it's a DM
         if message.guild:
-            if message.channel.name == f'group-{self.group_num}-mod':
-                await self.handle_mod_channel_message(message)
+            route = self.routes.route(message.channel)
+            if route.role == MOD:
+                with span("on_message.mod"):
+                    await self.handle_mod_channel_message(message)
             else:
-                await self.handle_channel_message(message)
+                over_limit = route.role == MONITORED and self.author_rates.record(message.channel.id, message.author.id)
+                with span("on_message.channel"):
+                    await self.handle_channel_message(message, over_limit, route)
         else:
-            await self.handle_dm(message)
+            with span("on_message.dm"):
+                await self.handle_dm(message)
 
     async def handle_dm(self, message):
         # Handle a help message
@@ -91,7 +253,7 @@ class ModBot(discord.Client):
             reply =  "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
             reply += "Use the `ban` command to start the process for banning a regex from a channel.\n"
-            await message.channel.send(reply)
+            await self.send(message.channel, reply)
             return
 
         author_id = message.author.id
@@ -109,27 +271,43 @@ class ModBot(discord.Client):
         # Let the report class handle this message; forward all the messages it returns to us
         responses = await self.reports[author_id].handle_message(message, self.mod_channels)
         for r in responses:
-            await message.channel.send(r)
+            await self.send(message.channel, r)
 
-        # If the report is complete or cancelled, remove it from our map
+        # If the report is complete or cancelled, remove it from our map; submitted reports go to the moderators
         if self.reports[author_id].report_complete():
-            await self.handle_mod_channel_message(message, "start", self.reports[author_id])
-            self.reports.pop(author_id)
+            report = self.reports.pop(author_id)
+            if report.report_submitted():
+                await self.handle_mod_channel_message(message, "start", report)
 
-    async def handle_channel_message(self, message):
+    async def handle_channel_message(self, message, over_limit=False, route=None):
         # Only handle messages sent in the "group-#" channel
-        if not message.channel.name == f'group-{self.group_num}':
+        route = route or self.routes.route(message.channel)
+        if route.role != MONITORED:
             return
+
+        # Authors posting faster than the channel allows are slowed down, if the thresholds file says how:
+        # their extra messages are removed, or they are timed out, or both
+        if over_limit and (self.throttle_delete or self.throttle_timeout):
+            await self.throttle(message)
+            if self.throttle_delete:
+                return
         
-        # Check if the message for this channel matches any of the specific regexes
-        for channel, regex in self.regexes.items():
-            if channel == f'group-{self.group_num}':
-                pattern = re.compile(regex)
-                matched = re.search(pattern, message.content) != None
+        # Check if the message matches any of the regexes banned from this channel
+        self.regexes.refresh()
+        with span("regex_match"):
+            matched = await self.regex_sandbox.match(route.name, message.content)
+        if matched is not None:
+            self.actions.delete(message)
+            self.actions.notify(message.channel, REMOVED_NOTICE)
+            return
 
-                if matched:
-                    await message.delete()
-                    await message.channel.send("This message has been removed for violating the channel's guidelines.")
+        # Copies of a raid whose report is waiting for a moderator are added to it instead of being classified again
+        cluster = self.raid_detector.add(message.channel.id, message.author.id, message.content)
+        if cluster is not None and cluster.report is not None:
+            if self.raid_pending(cluster.report):
+                self.raid_grew(cluster.report)
+                return
+            cluster.report = None # Moderators already have that report; if the raid goes on, it gets a new one
 
         # Forward the message to the mod channel
         # mod_channel = self.mod_channels[message.guild.id]
@@ -138,45 +316,162 @@ class ModBot(discord.Client):
         # await mod_channel.send(self.code_format(scores))
 
         # Open ai evaluation
-        # isToxic_open_ai, report_open_ai = self.eval_text_open_ai(message)
+        # isToxic_open_ai, report_open_ai = await self.eval_text_open_ai(message)
         # if isToxic_open_ai:
         #    await self.handle_mod_channel_message(message, "start", report_open_ai)
 
-        # Perspective ai evaluation
-        isToxic_perspective_ai, report_perspective_ai = self.eval_text_perspective_ai(message)
-        if isToxic_perspective_ai:
-            await self.handle_mod_channel_message(message, "start", report_perspective_ai)
+        # Local model, then Perspective ai, then Open ai evaluation for the messages Perspective is unsure about
+        isToxic, report = await self.classify_message(message)
+        if isToxic:
+            if cluster is not None:
+                cluster.toxic = True
+                if self.raid_detector.is_raid(cluster):
+                    report = self.raid_report(cluster, report)
+                    if report is None:
+                        return
+            await self.handle_mod_channel_message(message, "start", report)
+
+    async def throttle(self, message):
+        '''
+        Act on a message sent over its author's rate limit, as configured: remove it, and the first time
+        in a burst, warn the author; and the first time in a burst, time the author out where the bot is
+        allowed to.
+        '''
+        if self.throttle_delete:
+            self.actions.delete(message)
+        if not self.author_rates.throttle(message.channel.id, message.author.id):
+            return
+        REGISTRY.inc("authors_throttled")
+        logger.info("Throttling %s in #%s", message.author.name, message.channel.name)
+        if self.throttle_delete:
+            self.actions.notify(message.channel, f"{message.author.name}, you are sending messages too quickly. "
+                                                 "Your messages are being removed until you slow down.")
+        timeout = getattr(message.author, "timeout", None) # Only guild members can be timed out
+        if self.throttle_timeout and timeout is not None:
+            try:
+                await timeout(timedelta(seconds=self.throttle_timeout), reason="Sending messages too quickly")
+            except discord.HTTPException:
+                pass
+
+    def raid_report(self, cluster, report):
+        '''
+        Turn the report on a raid's latest message into the one report for the whole raid. Returns None
+        if the raid is already reported and waiting for a moderator, after adding the cluster to it.
+        '''
+        # Another copy may have been reported while this one was being classified
+        if cluster.report is None or not self.raid_pending(cluster.report):
+            self.raid_detector.fold(cluster, self.raid_pending)
+        if cluster.report is not None and self.raid_pending(cluster.report):
+            self.raid_grew(cluster.report)
+            return None
+        report.reason = "1"
+        report.category = "5"
+        self.raid_detector.filed(cluster, report)
+        report.raid = self.raid_detector.describe(report)
+        return report
+
+    def raid_grew(self, report):
+        # Keep the stored report's raid size current for restarts and other shards
+        report.raid = self.raid_detector.describe(report) or report.raid
+        self.report_queue.update(report)
+
+    def raid_pending(self, report):
+        self.report_queue.sync()
+        return report.id in self.report_queue.pending
+
+    def mod_channel_for(self, guild_id):
+        '''
+        The mod channel of the guild a reported message is in, or None if it has none. Reports only go
+        to the guild's own moderators. Channels in guilds served by other shards are sent to by ID.
+        '''
+        if guild_id in self.mod_channels:
+            return self.mod_channels[guild_id]
+        channel_id = self.moderation_store.mod_channels().get(guild_id)
+        if channel_id is None:
+            return None
+        return self.get_channel(channel_id) or self.get_partial_messageable(channel_id, guild_id=guild_id)
+
+    async def guild_channel(self, guild_id, channel_id):
+        '''
+        Look up a channel in a guild, for a message link. Guilds another shard serves aren't in this
+        process's cache, so their channels are fetched over HTTP. Returns (whether the bot is in the
+        guild, the channel or None).
+        '''
+        guild = self.get_guild(guild_id)
+        if guild is not None:
+            return True, guild.get_channel(channel_id)
+        if not self.moderation_store.has_guild(guild_id):
+            return False, None
+        try:
+            channel = await self.fetch_channel(channel_id)
+        except (discord.NotFound, discord.Forbidden):
+            return True, None
+        return True, channel if getattr(channel.guild, "id", None) == guild_id else None
 
     async def handle_mod_channel_message(self, message, keyword="", report=None):
-        mod_channel = self.mod_channels[1103033282779676743]
-
         if keyword == "start":
-            reply =  "Use the `review` command to begin the reviewing process.\n"
-            reply += "Use the `dismiss` command to cancel the review process.\n"
-            self.currReport = report
-            await mod_channel.send(reply)
+            mod_channel = self.mod_channel_for(report.guild_id)
+            if mod_channel is None:
+                logger.warning("Not reporting %s's message: guild %s has no mod channel", report.author, report.guild_id)
+                return
+            # Queue the report and announce it in the next digest; the guild's moderators claim it by its ID
+            self.report_queue.enqueue(report)
+            self.report_digest.add(mod_channel, report)
             return
         
+        # Queue commands never reach a review in progress, whose answers are read by their first letter
+        words = message.content.split()
+        command = words[0] if words else None
+        if command == ModReview.QUEUE_KEYWORD:
+            await self.send(message.channel, self.queue_summary(message.guild.id))
+            return
+
+        if command == ModReview.PROFILE_KEYWORD:
+            await self.send(message.channel, self.toggle_profiler(message.content))
+            return
+
+        if command == ModReview.ENABLE_RULE_KEYWORD:
+            await self.send(message.channel, self.enable_rule(words))
+            return
+
         author_id = message.author.id
         responses = []
+        claiming = command in [ModReview.START_REVIEW_KEYWORD, ModReview.NEXT_REVIEW_KEYWORD]
 
-        # If we don't currently have an active review for this moderator, add one
+        if author_id in self.mod_reviews and claiming:
+            await self.send(message.channel, "Finish or `dismiss` the current review first.")
+            return
+
+        # If we don't currently have an active review for this moderator, claim a report for them
         if author_id not in self.mod_reviews:
-            self.mod_reviews[author_id].append(ModReview(self, self.currReport, self.userStatsFile))
+            if not claiming:
+                return
+            report_id = int(words[1]) if len(words) > 1 and words[1].isdigit() else None
+            report = self.report_queue.claim(author_id, message.guild.id, report_id)
+            if report is None:
+                if report_id is None:
+                    await self.send(message.channel, "There are no reports waiting for review.")
+                else:
+                    await self.send(message.channel, f"Report #{report_id} is not waiting for review.")
+                return
+            await report.resolve_message()
+            self.mod_reviews[author_id].append(ModReview(self, report, self.offender_stats))
 
         # Let the review class handle this message; forward all the messages it returns to uss
         for review in self.mod_reviews[author_id]:
             responses = await review.handle_mod_message(message, self.mod_channels)
 
-            for r in responses:
-                await message.channel.send(r)
+            for r in responses or []:
+                await self.send(message.channel, r)
 
-        # If the report is complete or cancelled, remove it from our map
+        # If the report is complete or cancelled, remove it from our map and close it in the queue
         # This assumes that a moderator must work on one report at a time
         remaining_mod_reviews = []
         for review in self.mod_reviews[author_id]:
             if not review.review_complete():
                 remaining_mod_reviews.append(review)
+            else:
+                self.report_queue.close(review.report.id)
 
         if not remaining_mod_reviews:
             # If a moderator is not working on any reports, remove them from the map
@@ -185,60 +480,176 @@ class ModBot(discord.Client):
             # Otherwise, update the number of remainining reports they have
             self.mod_reviews[author_id] = remaining_mod_reviews
     
-    def eval_text_perspective_ai(self, message):
-        ''''
-        Evaluate whether a message is toxic or not and send the message info along if it is.
+    def queue_summary(self, guild_id):
         '''
-        report = Report(self)
-        report.messageContent = message.content
-        report.message = message
-        report.author = message.author.name
-        report.decodedMessage = report.messageContent.encode('utf-8').decode('unicode-escape')
-        report.repeatOffender = False
-
-        API_KEY = perspective_ai_key
-
-        client = discovery.build(
-            "commentanalyzer",
-            "v1alpha1",
-            developerKey=API_KEY,
-            discoveryServiceUrl="https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1",
-            static_discovery=False,
-        )
+        A guild's pending reports per severity class and how long its claimed reports of each class waited.
+        '''
+        self.report_queue.sync()
+        pending = Counter(severity_class(report) for report in self.report_queue.pending.values() if report.guild_id == guild_id)
+        reply = f"{sum(pending.values())} reports pending.\n"
+        for severity, count in pending.most_common():
+            reply += f"{severity}: {count} pending\n"
+        for severity, stats in self.review_scheduler.stats(guild_id).items():
+            reply += (f"{severity}: {stats['claimed']} claimed, waited {stats['mean_wait']:.0f}s on average "
+                      f"(p50 {stats['p50_wait']:.0f}s, p95 {stats['p95_wait']:.0f}s, max {stats['max_wait']:.0f}s)\n")
+        return reply
+
+    async def send(self, channel, content):
+        with span("discord_send"):
+            return await channel.send(content)
+
+    def enable_rule(self, words):
+        '''
+        `enable <rule>` turns a ban rule back on after the regex sandbox disabled it for being too slow.
+        '''
+        if len(words) < 2 or not words[1].isdigit():
+            return "Use `enable <rule>` with the number of a ban rule."
+        self.regexes.refresh()
+        rule = self.regexes.enable(int(words[1]))
+        if rule is None:
+            return f"There is no ban rule {words[1]}."
+        return f"Ban rule {rule.id} is enabled again in #{rule.channel}."
+
+    def toggle_profiler(self, command):
+        '''
+        `profile start` samples the event loop's stack until `profile stop`, which replies with the
+        functions it spent the most time in.
+        '''
+        words = command.split()
+        action = words[1] if len(words) > 1 else ("stop" if self.profiler.active else "start")
+        if action == "start":
+            self.profiler.start()
+            return "Profiling the event loop. Use `profile stop` to see the results."
+        if action == "stop":
+            if not self.profiler.active:
+                return "The profiler isn't running."
+            self.profiler.stop()
+            return "```\n" + self.profiler.report()[:1900] + "\n```"
+        return "Use `profile start` or `profile stop`."
+
+    def metrics_gauges(self):
+        batcher = self.perspective_batcher.stats()
+        cache = self.verdict_cache.stats()
+        return {"reports_pending": len(self.report_queue),
+                "reports_claimed": len(self.report_queue.claimed),
+                "batcher_queue_depth": batcher["queue_depth"],
+                "classifier_requests_in_flight": batcher["in_flight"],
+                "verdict_cache_entries": cache["entries"],
+                "verdict_cache_hit_rate": cache["hit_rate"],
+                "raid_window_messages": len(self.raid_detector.entries),
+                "tracked_authors": len(self.author_rates.buckets),
+                "routed_channels": len(self.routes.routes),
+                "moderation_actions_waiting": len(self.actions.channels),
+                "report_digests_waiting": len(self.report_digest.channels)}
+
+    async def run_classifier(self, classifier, *args):
+        '''
+        Run a blocking classifier off the event loop so a slow API call doesn't stall other handlers.
+        At most `max_classifier_requests` calls are in flight; the rest wait their turn here.
+        '''
+        with span("classifier." + getattr(classifier, "__name__", "classifier")):
+            async with self.classifier_slots:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.classifier_pool, classifier, *args)
 
+    async def score_perspective_batch(self, texts):
+        return await self.run_classifier(self.perspective_client().analyze_batch, texts)
 
-        analyze_content_request = {
-            'comment': { 'text': message.content },
-            'requestedAttributes': {'TOXICITY': {}, 
-                                    'SEVERE_TOXICITY': {},
-                                    'IDENTITY_ATTACK': {},
-                                    'INSULT' : {},
-                                    'PROFANITY' : {},
-                                    'THREAT' : {},
-                                    'SEXUALLY_EXPLICIT': {}
-                                    }
-        }
+    def perspective_client(self):
+        '''
+        Return the bot's Perspective client, building it the first time it is needed.
+        '''
+        if self.perspective is None:
+            from perspective import PerspectiveClient
+            self.perspective = PerspectiveClient(self.config["perspective_ai_key"])
+        return self.perspective
 
-        response_content = client.comments().analyze(body=analyze_content_request).execute()
+    def open_ai_client(self):
+        '''
+        Return the openai module, importing and configuring it the first time GPT is asked something.
+        '''
+        if self.openai is None:
+            import openai
+            openai.organization = OPEN_AI_ORGANIZATION
+            openai.api_key = self.config["open_ai_key"]
+            # print(openai.Model.list()) # Can used to verify GPT-4 access
+            self.openai = openai
+        return self.openai
+
+    def warm_up_classifiers(self):
+        '''
+        Import and build the enabled classifier backends. Blocks, so it runs in the classifier pool.
+        '''
+        if self.classifiers["perspective"]:
+            self.perspective_client().service
+        if self.classifiers["open_ai"]:
+            self.open_ai_client()
 
-        categoryScores = {}
-        for category, value in response_content["attributeScores"].items():
-            categoryScores[category] = value["summaryScore"]["value"]
+    async def classify_message(self, message):
+        '''
+        Run a channel message through the classifier cascade: the local model clears obviously benign
+        messages without any API call, Perspective scores the rest, and GPT decides the ones whose
+        Perspective score falls in the uncertain band.
+        '''
+        if self.cascade.clears(message.content):
+            return False, None
+        if not self.classifiers["perspective"]:
+            if not self.classifiers["open_ai"]:
+                return False, None
+            return await self.eval_text_open_ai(message)
+        isToxic, report = await self.classify_perspective(message)
+        if self.cascade.escalates(report.score):
+            score = report.score
+            isToxic, report = await self.eval_text_open_ai(message)
+            report.score = score
+        return isToxic, report
 
-        maxCategory = max(categoryScores, key=categoryScores.get)
-        summaryScore = response_content["attributeScores"][maxCategory]["summaryScore"]["value"]
-        is_content_toxic = summaryScore > 0.6
-        print(summaryScore)
+    async def classify_perspective(self, message):
+        '''
+        Evaluate a channel message with Perspective, answering repeated texts from the verdict cache
+        and sending the rest through the micro-batcher. The cache holds the raw scores, so retuned
+        thresholds apply to cached texts too.
+        '''
+        scores = await self.verdict_cache.get_or_classify("perspective_scores", message.content, self.perspective_batcher.score)
+        return self.perspective_report(message, self.perspective_verdict(scores))
 
+    def perspective_verdict(self, categoryScores):
+        '''
+        Decide from the Perspective scores whether a text is toxic and, if so, which report reason it falls under.
+        A text is toxic if any attribute scores above that attribute's threshold; the highest such attribute
+        gives the reason.
+        '''
+        default = self.perspective_thresholds["default"]
+        toxicScores = {category: score for category, score in categoryScores.items()
+                       if score > self.perspective_thresholds.get(category, default)}
+        is_content_toxic = bool(toxicScores)
+        maxCategory = max(toxicScores or categoryScores, key=categoryScores.get)
+        summaryScore = categoryScores[maxCategory]
+        logger.debug("Perspective: %s %.3f", maxCategory, summaryScore)
+
+        reason = None
         if is_content_toxic:
             if maxCategory == "IDENTITY_ATTACK":
-                report.reason = "1"
+                reason = "1"
             elif maxCategory == "SEXUALLY_EXPLICIT":
-                report.reason = "2"
+                reason = "2"
             elif maxCategory == "IMMINENT_DANGER":
-                report.reason = "4"
+                reason = "4"
             else:
-                report.reason = "3"
+                reason = "3"
+        return {"toxic": is_content_toxic, "scores": categoryScores, "reason": reason}
+
+    def perspective_report(self, message, verdict):
+        '''
+        Build the report for the mod channel from a Perspective verdict.
+        '''
+        report = Report(self)
+        report.messageContent = message.content
+        report.message = message
+        report.decodedMessage = decode_escapes(report.messageContent)
+        report.repeatOffender = False
+        report.reason = verdict["reason"]
+        report.score = max(verdict["scores"].values())
 
         """
         analyze_username_request = {
@@ -261,24 +672,110 @@ class ModBot(discord.Client):
             report.reason
             """
 
-        return is_content_toxic, report
+        return verdict["toxic"], report
 
-    def eval_text_open_ai(self, message):
-        ''''
-        Evaluate whether a message is toxic or not and send the message info along if it is.
+    async def eval_text_open_ai(self, message):
+        '''
+        Evaluate whether a message is toxic or not and send the message info along if it is. GPT answers
+        every question in one structured request; if that doesn't work out, the questions are asked
+        separately, with the ones that don't depend on each other in flight at the same time.
         '''
-        isToxic = True
         report = Report(self)
         report.messageContent = message.content
         report.message = message
-        report.author = message.author.name
-        report.decodedMessage = report.messageContent.encode('utf-8').decode('unicode-escape')
+        report.decodedMessage = decode_escapes(report.messageContent)
         report.repeatOffender = False
 
-        openai.organization = "org-YVZe9QFuR0Ke0J0rqr7l2R2L"
-        openai.api_key = open_ai_key
-        # print(openai.Model.list()) # Can used to verify GPT-4 access
+        verdict = self.verdict_cache.get("open_ai", message.content)
+        if verdict is None:
+            if self.open_ai_structured:
+                verdict = await self.run_classifier(self.open_ai_structured_verdict, message)
+            if verdict is None:
+                verdict = await self.open_ai_separate_verdict(message)
+            # The username issue belongs to this author, so it is cached with their username rather than the text
+            usernameIssue = verdict.pop("usernameIssue")
+            self.verdict_cache.put("open_ai", message.content, verdict)
+            if usernameIssue is not None or verdict["reason"] == "1":
+                self.username_verdicts.put(message.author.id, message.author.name, usernameIssue)
+        elif verdict["reason"] == "1":
+            usernameIssue = await self.check_username(message)
+        isToxic = verdict["toxic"]
+        report.reason = verdict["reason"]
+        report.category = verdict["category"]
+
+        # Hate speech also gets its author's username checked
+        if verdict["reason"] == "1":
+            report.usernameIssue = usernameIssue
+
+        return isToxic, report
 
+    def open_ai_structured_verdict(self, message):
+        '''
+        Ask GPT for the whole verdict on a message and its author's username in a single JSON answer.
+        Returns None if the model can't be used this way or the answer doesn't fit the schema.
+        '''
+        openai = self.open_ai_client()
+        try:
+            response = openai.ChatCompletion.create(
+                model=STRUCTURED_MODEL,
+                response_format={"type": "json_object"},
+                messages=[
+                {"role": "system", "content": STRUCTURED_PROMPT},
+                {"role": "user", "content": json.dumps({"username": "user123", "message": "I love puppies"})},
+                {"role": "assistant", "content": json.dumps({"toxic": False, "reason": None, "category": None, "username_issue": None})},
+                {"role": "user", "content": json.dumps({"username": "jenny_88", "message": "Your profile says Elizabeth but I know your real name is Elijah."})},
+                {"role": "assistant", "content": json.dumps({"toxic": True, "reason": "1", "category": "1", "username_issue": None})},
+                {"role": "user", "content": json.dumps({"username": "xXnudesXx", "message": "Can I get some nude pics? You should come over to my place for a good time"})},
+                {"role": "assistant", "content": json.dumps({"toxic": True, "reason": "2", "category": None,
+                                                             "username_issue": "The username refers to sexual content."})},
+                {"role": "user", "content": json.dumps({"username": message.author.name, "message": message.content})},
+                ]
+            )
+        except openai.error.InvalidRequestError as e:
+            # Stop trying only if the model or JSON mode isn't available to this account; anything else,
+            # such as a message too long for the model, falls back for this message alone
+            if structured_unsupported(e):
+                self.open_ai_structured = False
+            return None
+
+        try:
+            output = json.loads(response['choices'][0]['message']['content'])
+            verdict = {"toxic": bool(output["toxic"]), "scores": None,
+                       "reason": str(output["reason"]) if output["reason"] else None,
+                       "category": str(output["category"]) if output["category"] else None,
+                       "usernameIssue": output["username_issue"] or None}
+        except (ValueError, KeyError, TypeError):
+            return None
+        if verdict["reason"] not in [None, "1", "2", "3", "4"] or verdict["category"] not in [None, "1", "2", "3"]:
+            return None
+        return verdict
+
+    async def open_ai_separate_verdict(self, message):
+        '''
+        The verdict from one question per call. Only the sub-category depends on the first answer; it
+        and the username checks run concurrently.
+        '''
+        verdict = await self.run_classifier(self.open_ai_content_verdict, message)
+        verdict["usernameIssue"] = None
+        if verdict["reason"] == "1":
+            verdict["category"], verdict["usernameIssue"] = await asyncio.gather(
+                self.run_classifier(self.open_ai_hate_speech_category, message),
+                self.check_username(message))
+        return verdict
+
+    async def check_username(self, message):
+        '''
+        The issue with the author's username, asking GPT only if this user's current name hasn't been checked.
+        '''
+        author = message.author
+        return await self.username_verdicts.get_or_check(author.id, author.name,
+                                                         lambda: self.run_classifier(self.open_ai_username_issue, message))
+
+    def open_ai_content_verdict(self, message):
+        '''
+        Ask GPT whether a message is toxic and its high-level category.
+        '''
+        openai = self.open_ai_client()
         # Ask gpt-4 whether a message is toxic and what category a message belongs to (high-level, not limited to hate speech)
         response = openai.ChatCompletion.create(
             model="gpt-3.5-turbo",
@@ -306,68 +803,71 @@ class ModBot(discord.Client):
         # Save the high-level category in the report information
         output = response['choices'][0]['message']['content']
         output = output.split(", ")
-        isToxic = output[0] == "True"
-        isHateSpeech = output[1] == "1"
-        report.reason = output[1]
+        verdict = {"toxic": output[0] == "True", "scores": None, "reason": output[1], "category": None}
+        return verdict
 
-        # If the category is hate-speech, ask what the lower-level category of hate speech is?
-        if isHateSpeech:
-            # If gpt-4 determines it's hate speech, ask it to fill out some information
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                {"role": "system", "content": "Which category does the hate spech fall into?" +
-                        "1. The content includes deadnaming" + "\n" + 
-                        "2. The content misgenders someone" + "\n" +
-                        "3. The content includes a slur"
-                        "4. The content is non-toxic"},
-                {"role": "user", "content": "Your profile says Elizabeth but I know your real name is Elijah."},
-                {"role": "assistant", "content": "1"},
-                {"role": "user", "content": "I know what your pronouns are, but I'm just going to call you by he/him."},
-                {"role": "assistant", "content": "2"},
-                {"role": "user", "content": "Tranny"},
-                {"role": "assistant", "content": "3"},
-                {"role": "user", "content": message.content},
-                ]
-            )
+    def open_ai_hate_speech_category(self, message):
+        '''
+        Ask GPT which kind of hate speech a message is.
+        '''
+        openai = self.open_ai_client()
+        response = openai.ChatCompletion.create(
+            model="gpt-4",
+            messages=[
+            {"role": "system", "content": "Which category does the hate spech fall into?" +
+                    "1. The content includes deadnaming" + "\n" + 
+                    "2. The content misgenders someone" + "\n" +
+                    "3. The content includes a slur"
+                    "4. The content is non-toxic"},
+            {"role": "user", "content": "Your profile says Elizabeth but I know your real name is Elijah."},
+            {"role": "assistant", "content": "1"},
+            {"role": "user", "content": "I know what your pronouns are, but I'm just going to call you by he/him."},
+            {"role": "assistant", "content": "2"},
+            {"role": "user", "content": "Tranny"},
+            {"role": "assistant", "content": "3"},
+            {"role": "user", "content": message.content},
+            ]
+        )
+        return response['choices'][0]['message']['content']
 
-            report.category = response['choices'][0]['message']['content']
+    def open_ai_username_issue(self, message):
+        '''
+        Ask GPT whether the author's username is inappropriate and, if so, describe the issue.
+        '''
+        openai = self.open_ai_client()
+        response = openai.ChatCompletion.create(
+            model="gpt-4",
+            messages=[
+            {"role": "system", "content": "True/False: This username is vulgar/inappropriate."},
+            {"role": "user", "content": ""},
+            {"role": "assistant", "content": "True"},
+            {"role": "user", "content": ""},
+            {"role": "assistant", "content": "False"},
+            {"role": "user", "content": ""},
+            {"role": "assistant", "content": "False"},
+            {"role": "user", "content": message.author.name},
+            ]
+        )
+
+        output = response['choices'][0]['message']['content']
+        output = output == "True"
 
+        if output:
+            # If gpt-4 determines it's hate speech, ask it to fill out some information
             response = openai.ChatCompletion.create(
                 model="gpt-4",
                 messages=[
-                {"role": "system", "content": "True/False: This username is vulgar/inappropriate."},
+                {"role": "system", "content": "Describe the issue with the twitch account username."},
                 {"role": "user", "content": ""},
-                {"role": "assistant", "content": "True"},
+                {"role": "assistant", "content": ""},
                 {"role": "user", "content": ""},
-                {"role": "assistant", "content": "False"},
-                {"role": "user", "content": ""},
-                {"role": "assistant", "content": "False"},
+                {"role": "assistant", "content": ""},
                 {"role": "user", "content": message.author.name},
                 ]
             )
+            return response['choices'][0]['message']['content']
+        return None
 
-            output = response['choices'][0]['message']['content']
-            output = output == "True"
-
-            if output:
-                # If gpt-4 determines it's hate speech, ask it to fill out some information
-                response = openai.ChatCompletion.create(
-                    model="gpt-4",
-                    messages=[
-                    {"role": "system", "content": "Describe the issue with the twitch account username."},
-                    {"role": "user", "content": ""},
-                    {"role": "assistant", "content": ""},
-                    {"role": "user", "content": ""},
-                    {"role": "assistant", "content": ""},
-                    {"role": "user", "content": message.author.name},
-                    ]
-                )
-                report.usernameIssue = response['choices'][0]['message']['content']
-        
-        return isToxic, report
-
-    
     def code_format(self, text):
         ''''
         TODO: Once you know how you want to show that a message has been 
@@ -377,5 +877,16 @@ class ModBot(discord.Client):
         return "Evaluated: '" + text+ "'"
 
 
-client = ModBot()
-client.run(discord_token)
\ No newline at end of file
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", type=int, help="run this many shards, one process each (see sharding.py)")
+    args = parser.parse_args()
+    config = load_config(token_path)
+    if args.shards:
+        from sharding import run_shards
+        run_shards(config, args.shards)
+    else:
+        log_listener = setup_logging()
+        client = ModBot(config)
+        client.run(config["discord"])
+        log_listener.stop()
\ No newline at end of file
@@ -0,0 +1,229 @@
+# cascade.py
+# The cheap first stage of the classifier cascade, and the tools to train and evaluate it offline.
+#
+#   python cascade.py train --data labeled.json --out local_model.json
+#   python cascade.py evaluate --data heldout.json --model local_model.json --clear-below 0.15
+#
+# Datasets use the format of DataAnalysis/preds_data.json plus the message texts: a JSON object with
+# "Texts" and "Labels" (1 for toxic, 0 for benign) lists, and optionally the recorded predictions of
+# the remote stages as "P-Pred" / "G-Pred" (0 or 1) and Perspective's summary scores as "P-Score".
+import argparse
+import json
+import math
+import os
+import random
+import zlib
+from array import array
+from collections import Counter
+from report import normalize_text
+
+# Classifier thresholds used when the thresholds file doesn't set them. DataAnalysis/sweep.py writes the
+# "perspective" section from labeled scores: a threshold per Perspective attribute, plus a default. The
+# "throttle" section sets the per-author posting rate in monitored channels (messages per second and
+# burst) and what happens to an author over it: deleting their extra messages and timing them out for
+# `timeout` seconds are both off unless turned on here.
+DEFAULT_THRESHOLDS = {"perspective": {"default": 0.6},
+                      "cascade": {"clear_below": 0.15, "gpt_band": [0.45, 0.75]},
+                      "throttle": {"rate": 0.5, "burst": 8, "delete": False, "timeout": 0}}
+
+
+def load_thresholds(path):
+    '''
+    The classifier thresholds in the JSON file at `path`, section by section over DEFAULT_THRESHOLDS.
+    '''
+    thresholds = {section: dict(values) for section, values in DEFAULT_THRESHOLDS.items()}
+    if os.path.isfile(path):
+        with open(path) as f:
+            for section, values in json.load(f).items():
+                thresholds.setdefault(section, {}).update(values)
+    return thresholds
+
+
+class HashedNgramModel:
+    '''
+    Logistic regression over hashed word 1-2 grams and character 3-grams of the normalized text.
+    Scoring a message costs one pass over its n-grams and needs no network or extra packages.
+    '''
+    def __init__(self, buckets=2 ** 18, weights=None, bias=0.0):
+        self.buckets = buckets
+        self.weights = weights if weights is not None else array('d', bytes(8 * buckets))
+        self.bias = bias
+
+    def features(self, text):
+        words = normalize_text(text).split()
+        grams = set(words)
+        grams.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for word in words:
+            padded = f"<{word}>"
+            grams.update("#" + padded[i:i + 3] for i in range(len(padded) - 2))
+        mask = self.buckets - 1
+        return {zlib.crc32(gram.encode('utf-8')) & mask for gram in grams}
+
+    def score(self, text):
+        '''
+        Probability that `text` is toxic.
+        '''
+        weights = self.weights
+        z = self.bias + sum(weights[i] for i in self.features(text))
+        return 1 / (1 + math.exp(-max(min(z, 30), -30)))
+
+    @classmethod
+    def train(cls, texts, labels, epochs=5, learning_rate=0.2, l2=1e-6, buckets=2 ** 18, seed=0):
+        model = cls(buckets)
+        examples = [(model.features(text), label) for text, label in zip(texts, labels)]
+        rng = random.Random(seed)
+        weights = model.weights
+        for _ in range(epochs):
+            rng.shuffle(examples)
+            for features, label in examples:
+                z = model.bias + sum(weights[i] for i in features)
+                gradient = 1 / (1 + math.exp(-max(min(z, 30), -30))) - label
+                for i in features:
+                    weights[i] -= learning_rate * (gradient + l2 * weights[i])
+                model.bias -= learning_rate * gradient
+        return model
+
+    def save(self, path):
+        # Only the non-zero weights are stored; most buckets are never hit
+        data = {"buckets": self.buckets, "bias": self.bias,
+                "weights": {str(i): w for i, w in enumerate(self.weights) if w}}
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        model = cls(data["buckets"], bias=data["bias"])
+        for i, w in data["weights"].items():
+            model.weights[int(i)] = w
+        return model
+
+
+class Cascade:
+    '''
+    Thresholds deciding how far a channel message goes through the classifier cascade:
+
+    - the local model clears messages scoring below `clear_below` without any API call (with no
+      model loaded, every message goes on);
+    - Perspective scores the rest, and decides on its own unless its highest attribute score falls
+      in `gpt_band` (low, high), in which case GPT makes the call. `gpt_band=None` disables GPT.
+    '''
+    def __init__(self, model=None, clear_below=0.15, gpt_band=(0.45, 0.75)):
+        self.model = model
+        self.clear_below = clear_below
+        self.gpt_band = tuple(gpt_band) if gpt_band is not None else None
+        self.outcomes = Counter() # Map from the stage that decided a message to the number of messages
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        '''
+        A cascade using the local model saved at `path`, or without a local stage if there is none.
+        '''
+        return cls(HashedNgramModel.load(path) if os.path.isfile(path) else None, **kwargs)
+
+    def clears(self, text):
+        if self.model is None or self.model.score(text) >= self.clear_below:
+            return False
+        self.outcomes["local"] += 1
+        return True
+
+    def escalates(self, score):
+        '''
+        Whether a Perspective score is too uncertain to act on without asking GPT.
+        '''
+        escalate = self.gpt_band is not None and score is not None and self.gpt_band[0] <= score < self.gpt_band[1]
+        self.outcomes["gpt" if escalate else "perspective"] += 1
+        return escalate
+
+    def stats(self):
+        total = sum(self.outcomes.values())
+        return {"messages": total,
+                "decided_by": dict(self.outcomes),
+                "perspective_calls_avoided": self.outcomes["local"],
+                "gpt_calls": self.outcomes["gpt"]}
+
+
+def precision_recall(labels, predictions):
+    tp = sum(1 for y, p in zip(labels, predictions) if y and p)
+    fp = sum(1 for y, p in zip(labels, predictions) if not y and p)
+    fn = sum(1 for y, p in zip(labels, predictions) if y and not p)
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def evaluate(data, cascade):
+    '''
+    Replay a labeled dataset through the cascade and through the remote stages alone. Messages that
+    reach a remote stage take its recorded prediction; without recorded predictions the label is used,
+    so the difference shows only what the local stage costs.
+    '''
+    labels = data["Labels"]
+    perspective = data.get("P-Pred", labels)
+    gpt = data.get("G-Pred", perspective)
+    scores = data.get("P-Score", [None] * len(labels))
+
+    baseline, cascaded = [], []
+    calls = Counter()
+    for text, p_pred, g_pred, p_score in zip(data["Texts"], perspective, gpt, scores):
+        escalate = cascade.gpt_band is not None and p_score is not None and cascade.gpt_band[0] <= p_score < cascade.gpt_band[1]
+        remote = g_pred if escalate else p_pred
+        baseline.append(remote)
+        calls["baseline perspective"] += 1
+        calls["baseline gpt"] += escalate
+
+        if cascade.clears(text):
+            cascaded.append(0)
+            continue
+        cascaded.append(remote)
+        calls["cascade perspective"] += 1
+        calls["cascade gpt"] += escalate
+    return {"messages": len(labels),
+            "cleared_locally": len(labels) - calls["cascade perspective"],
+            "calls": calls,
+            "baseline": precision_recall(labels, baseline),
+            "cascade": precision_recall(labels, cascaded)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="fit the local model on a labeled dataset")
+    train.add_argument("--data", required=True)
+    train.add_argument("--out", default="local_model.json")
+    train.add_argument("--epochs", type=int, default=5)
+    evaluation = commands.add_parser("evaluate", help="report API calls avoided and the precision/recall cost")
+    evaluation.add_argument("--data", required=True)
+    evaluation.add_argument("--model", default="local_model.json")
+    evaluation.add_argument("--clear-below", type=float, nargs="+", default=[0.05, 0.1, 0.15, 0.2, 0.3])
+    evaluation.add_argument("--gpt-band", type=float, nargs=2, default=[0.45, 0.75])
+    args = parser.parse_args()
+
+    with open(args.data) as f:
+        data = json.load(f)
+
+    if args.command == "train":
+        model = HashedNgramModel.train(data["Texts"], data["Labels"], epochs=args.epochs)
+        model.save(args.out)
+        print(f"trained on {len(data['Labels'])} messages, saved to {args.out}")
+        return
+
+    model = HashedNgramModel.load(args.model)
+    print(f"{'clear below':>11} {'cleared':>8} {'persp. calls':>13} {'gpt calls':>10} {'precision':>10} {'recall':>7} {'f1':>6}")
+    for i, threshold in enumerate(args.clear_below):
+        result = evaluate(data, Cascade(model, threshold, tuple(args.gpt_band)))
+        calls = result["calls"]
+        if i == 0:
+            precision, recall, f1 = result["baseline"]
+            print(f"{'api only':>11} {0:>8} {calls['baseline perspective']:>13} {calls['baseline gpt']:>10} "
+                  f"{precision:>10.3f} {recall:>7.3f} {f1:>6.3f}")
+        precision, recall, f1 = result["cascade"]
+        print(f"{threshold:>11.2f} {result['cleared_locally']:>8} {calls['cascade perspective']:>13} {calls['cascade gpt']:>10} "
+              f"{precision:>10.3f} {recall:>7.3f} {f1:>6.3f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# channel_routes.py
+
+# What the bot does with a guild channel's messages
+MOD = "mod" # The group's mod channel: moderator commands and reviews
+MONITORED = "monitored" # The group's channel: ban rules and classifiers
+IGNORED = "ignored"
+
+
+class Route:
+    __slots__ = ["role", "name", "guild_id"]
+
+    def __init__(self, role, name, guild_id):
+        self.role = role
+        self.name = name # The channel's name, which its ban rules are filed under (see BanRuleIndex)
+        self.guild_id = guild_id
+
+
+class ChannelRouter:
+    '''
+    Index from channel ID to what the bot does with the channel's messages, so dispatching a message
+    is one dict lookup instead of comparing its channel's name with the group's channel names. Filled
+    from the guilds the bot is in when it connects and kept up to date from the channel create, update
+    and delete events, so renamed and new channels are picked up. Also keeps each guild's mod channel.
+    '''
+    def __init__(self):
+        self.group_num = None
+        self.channel_name = None
+        self.mod_channel_name = None
+        self.routes = {} # Map from channel ID to its Route
+        self.mod_channels = {} # Map from guild ID to that guild's mod channel
+
+    def set_group(self, group_num):
+        '''
+        Set the group whose channels the bot looks after, which decides every channel's role.
+        '''
+        self.group_num = group_num
+        self.channel_name = f'group-{group_num}'
+        self.mod_channel_name = f'group-{group_num}-mod'
+        for route in self.routes.values():
+            route.role = self.role_of(route.name)
+
+    def role_of(self, name):
+        if name == self.channel_name:
+            return MONITORED
+        if name == self.mod_channel_name:
+            return MOD
+        return IGNORED
+
+    def route(self, channel):
+        '''
+        The route for a channel. Channels the index doesn't know, such as threads, are routed by name
+        without being added to it.
+        '''
+        route = self.routes.get(channel.id)
+        if route is None:
+            guild = getattr(channel, "guild", None)
+            route = Route(self.role_of(getattr(channel, "name", None)), getattr(channel, "name", None), guild.id if guild else None)
+        return route
+
+    def add_guild(self, guild):
+        for channel in guild.text_channels:
+            self.update(channel)
+
+    def remove_guild(self, guild):
+        for channel in guild.text_channels:
+            self.remove(channel)
+        self.mod_channels.pop(guild.id, None)
+
+    def update(self, channel):
+        '''
+        Add a new channel or re-route a changed one. Returns its route.
+        '''
+        route = self.routes[channel.id] = Route(self.role_of(channel.name), channel.name, channel.guild.id)
+        if route.role == MOD:
+            self.mod_channels[route.guild_id] = channel
+        elif getattr(self.mod_channels.get(route.guild_id), "id", None) == channel.id:
+            del self.mod_channels[route.guild_id]
+        return route
+
+    def remove(self, channel):
+        route = self.routes.pop(channel.id, None)
+        if route is not None and getattr(self.mod_channels.get(route.guild_id), "id", None) == channel.id:
+            del self.mod_channels[route.guild_id]
+        return route
+
+    def stats(self):
+        roles = {MOD: 0, MONITORED: 0, IGNORED: 0}
+        for route in self.routes.values():
+            roles[route.role] += 1
+        return {"channels": len(self.routes), **roles}
@@ -0,0 +1,63 @@
+# config.py
+import json
+import os
+
+# Classifier backends, and the token each of them needs
+BACKENDS = {"perspective": "perspective_ai_key", "open_ai": "open_ai_key"}
+TOKENS = ["discord"] + list(BACKENDS.values())
+
+
+class ConfigError(Exception):
+    pass
+
+
+def load_config(path):
+    '''
+    Read and check the bot's tokens file. Returns the tokens plus "classifiers", a map from backend to
+    whether it is enabled: a backend is on when its token is set, unless "classifiers" turns it off.
+    '''
+    if not os.path.isfile(path):
+        raise ConfigError(f"{path} not found!")
+    with open(path) as f:
+        try:
+            config = json.load(f)
+        except ValueError as e:
+            raise ConfigError(f"{path} is not valid JSON ({e}). Did you put your tokens in quotes?")
+    return validate_config(config, path)
+
+
+def validate_config(config, source="config"):
+    '''
+    Check a config and fill in the classifiers it leaves out, raising ConfigError with every problem found.
+    '''
+    if not isinstance(config, dict):
+        raise ConfigError(f"{source} should hold a JSON object with your tokens.")
+    problems = []
+    for key in config:
+        if key not in TOKENS and key != "classifiers":
+            problems.append(f"unknown key {key!r}")
+    for key in TOKENS:
+        if key in config and (not isinstance(config[key], str) or not config[key]):
+            problems.append(f"{key!r} should be a non-empty string")
+    if "discord" not in config:
+        problems.append("'discord' token is missing")
+
+    classifiers = config.get("classifiers", {})
+    if not isinstance(classifiers, dict):
+        problems.append("'classifiers' should map a backend to true or false")
+        classifiers = {}
+    enabled = {}
+    for backend, token in BACKENDS.items():
+        wanted = classifiers.get(backend, token in config)
+        if not isinstance(wanted, bool):
+            problems.append(f"'classifiers.{backend}' should be true or false")
+        elif wanted and token not in config:
+            problems.append(f"the {backend} classifier is enabled but {token!r} is missing")
+        enabled[backend] = wanted is True
+    for backend in classifiers:
+        if backend not in BACKENDS:
+            problems.append(f"unknown classifier {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+    if problems:
+        raise ConfigError(f"{source}: " + "; ".join(problems))
+    return {**{key: config[key] for key in TOKENS if key in config}, "classifiers": enabled}
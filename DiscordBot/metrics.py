@@ -0,0 +1,202 @@
+# metrics.py
+import asyncio
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+# Upper bounds of the span duration histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1) # The last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    '''
+    Times the block it wraps into a histogram of its registry, and counts it as an error if the
+    block raises. Works around awaits as well as blocking code.
+    '''
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.metrics.inc("span_errors", span=self.name)
+        return False
+
+
+class Metrics:
+    '''
+    Counters and span duration histograms for the bot's hot paths, rendered in the Prometheus text
+    format. Gauges are collected when the metrics are rendered, from callbacks returning a map from
+    gauge name to value, so components can expose their existing stats without pushing updates.
+    '''
+    def __init__(self, prefix="modbot"):
+        self.prefix = prefix
+        self.lock = threading.Lock() # Spans and counters are also updated from the classifier worker threads
+        self.counters = Counter() # Map from (name, sorted label pairs) to its count
+        self.spans = {} # Map from span name to its duration histogram
+        self.gauges = [] # Callbacks returning {name: value}
+
+    def span(self, name):
+        return Span(self, name)
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.spans.get(name)
+            if histogram is None:
+                histogram = self.spans[name] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += amount
+
+    def add_gauges(self, collect):
+        self.gauges.append(collect)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            spans = sorted((name, list(h.counts), h.sum, h.count) for name, h in self.spans.items())
+
+        name = f"{self.prefix}_span_seconds"
+        lines += [f"# HELP {name} Time spent in each instrumented span.", f"# TYPE {name} histogram"]
+        for span, counts, total, count in spans:
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{{span="{span}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{span="{span}"}} {total:.6f}')
+            lines.append(f'{name}_count{{span="{span}"}} {count}')
+
+        typed = set()
+        for (counter, labels), value in counters:
+            name = f"{self.prefix}_{counter}_total"
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        for collect in self.gauges:
+            for gauge, value in collect().items():
+                name = f"{self.prefix}_{gauge}"
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host="127.0.0.1", port=9464):
+        '''
+        Serve the metrics at http://host:port/metrics from the event loop. Returns the asyncio server.
+        '''
+        async def handle(reader, writer):
+            try:
+                request = await reader.readline()
+                while (await reader.readline()).strip(): # Skip the headers
+                    pass
+                parts = request.split()
+                if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+                    status, body = "200 OK", self.render().encode("utf-8")
+                else:
+                    status, body = "404 Not Found", b"not found\n"
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+class SamplingProfiler:
+    '''
+    Samples the stack of one thread (by default the one that starts it, i.e. the event loop) every
+    `interval` seconds from a background thread, and counts how often each function is running and
+    on the stack. Cheap enough to switch on in production for a while.
+    '''
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.samples = 0
+        self.running = Counter() # Map from function to the samples it was executing in
+        self.on_stack = Counter() # Map from function to the samples it was anywhere on the stack in
+
+    @property
+    def active(self):
+        return self.thread is not None
+
+    def start(self, thread_id=None):
+        if self.active:
+            return
+        target = thread_id if thread_id is not None else threading.get_ident()
+        self.samples = 0
+        self.running.clear()
+        self.on_stack.clear()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._sample, args=(target,), name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if not self.active:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+    def _sample(self, target):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.running[self._describe(frame)] += 1
+            seen = set()
+            while frame is not None:
+                seen.add(self._describe(frame))
+                frame = frame.f_back
+            self.on_stack.update(seen)
+
+    @staticmethod
+    def _describe(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def report(self, top=10):
+        if not self.samples:
+            return "No samples were taken."
+        lines = [f"{self.samples} samples every {self.interval * 1000:g} ms", "running:"]
+        lines += [f"{count / self.samples:6.1%} {function}" for function, count in self.running.most_common(top)]
+        lines.append("on the stack:")
+        lines += [f"{count / self.samples:6.1%} {function}" for function, count in self.on_stack.most_common(top)]
+        return "\n".join(lines)
+
+
+# The bot's metrics; modules time their hot paths with `with span(name):`
+REGISTRY = Metrics()
+span = REGISTRY.span
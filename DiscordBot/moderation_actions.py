@@ -0,0 +1,166 @@
+# moderation_actions.py
+import asyncio
+import logging
+import time
+
+import discord
+
+logger = logging.getLogger('discord')
+
+# Requests per second Discord allows on each route, per channel, as (requests, seconds). Discord
+# doesn't publish these and may change them; they are only used to pace requests, and discord.py still
+# waits out any 429 it gets.
+ROUTE_LIMITS = {"delete": (5, 1.0), "bulk_delete": (1, 1.0), "send": (5, 5.0)}
+GLOBAL_LIMIT = (50, 1.0)
+MAX_BULK_DELETE = 100 # Discord's limit for one bulk delete
+
+REMOVED_NOTICE = ("This message has been removed for violating the channel's guidelines.",
+                  "{count} messages have been removed for violating the channel's guidelines.")
+REVIEW_REMOVED_NOTICE = ("This message has been removed for violating Twitch's guidelines.",
+                         "{count} messages have been removed for violating Twitch's guidelines.")
+
+
+class RouteBucket:
+    '''
+    Paces requests on one route: at most `limit` every `per` seconds, as a token bucket.
+    '''
+    __slots__ = ["limit", "per", "tokens", "updated"]
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.tokens = float(limit)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.limit, self.tokens + (now - self.updated) * self.limit / self.per)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.limit)
+
+
+class ChannelActions:
+    __slots__ = ["channel", "deletions", "notices", "due", "flushing"]
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.deletions = [] # Messages to delete
+        self.notices = {} # Map from notice (a string or a (singular, plural) pair) to how many times it was posted
+        self.due = asyncio.Event() # Set to carry the actions out before the window ends
+        self.flushing = None # The task that carries out this channel's actions at the end of the window
+
+
+class ModerationActions:
+    '''
+    Queue of the bot's moderation actions on channels, carried out in bulk: the messages to delete in a
+    channel over `window` seconds are deleted with one bulk delete per 100, and the notices posted there
+    in that time become one message, with repeats of the same notice merged into a count. Requests are
+    paced per channel and route to stay under Discord's rate limits (see ROUTE_LIMITS), so a raid costs
+    a few requests a second instead of two per removed message.
+    '''
+    def __init__(self, send, window=1.0):
+        self.send = send # Coroutine function posting a message to a channel
+        self.window = window
+        self.channels = {} # Map from channel ID to its ChannelActions waiting to be carried out
+        self.tasks = set() # Tasks carrying out a window's actions, waiting or running
+        self.buckets = {} # Map from (route, channel ID) to its RouteBucket
+        self.global_bucket = RouteBucket(*GLOBAL_LIMIT)
+
+        self.queued = 0 # Actions queued
+        self.requests = 0 # API requests made to carry them out
+
+    def delete(self, message):
+        self._channel(message.channel).deletions.append(message)
+
+    def notify(self, channel, notice):
+        '''
+        Post a notice to a channel. A notice is a string, or a (singular, plural) pair whose plural, with
+        "{count}" in it, stands for several copies posted in the same window.
+        '''
+        pending = self._channel(channel).notices
+        pending[notice] = pending.get(notice, 0) + 1
+
+    def _channel(self, channel):
+        self.queued += 1
+        actions = self.channels.get(channel.id)
+        if actions is None:
+            actions = self.channels[channel.id] = ChannelActions(channel)
+            actions.flushing = asyncio.create_task(self._flush_later(actions))
+            self.tasks.add(actions.flushing)
+            actions.flushing.add_done_callback(self.tasks.discard)
+        return actions
+
+    async def _flush_later(self, actions):
+        try:
+            try:
+                await asyncio.wait_for(actions.due.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush(actions)
+        except Exception:
+            logger.exception("Moderation actions in #%s failed", getattr(actions.channel, "name", actions.channel.id))
+
+    async def _flush(self, actions):
+        # Actions queued from here on wait for the next window
+        if self.channels.get(actions.channel.id) is actions:
+            del self.channels[actions.channel.id]
+        channel = actions.channel
+        deletions = actions.deletions
+        for start in range(0, len(deletions), MAX_BULK_DELETE):
+            await self._delete(channel, deletions[start:start + MAX_BULK_DELETE])
+        if actions.notices:
+            lines = [notice if isinstance(notice, str) else notice[count > 1].format(count=count)
+                     for notice, count in actions.notices.items()]
+            await self._request("send", channel, self.send, channel, "\n".join(lines)[:2000])
+
+    async def _delete(self, channel, messages):
+        if len(messages) > 1:
+            try:
+                await self._request("bulk_delete", channel, channel.delete_messages, messages)
+                return
+            except discord.HTTPException:
+                # Bulk deletes refuse messages older than two weeks; delete them one at a time
+                pass
+        for message in messages:
+            await self._request("delete", channel, message.delete)
+
+    async def _request(self, route, channel, call, *args):
+        bucket = self.buckets.get((route, channel.id))
+        if bucket is None:
+            bucket = self.buckets[route, channel.id] = RouteBucket(*ROUTE_LIMITS[route])
+        await bucket.acquire()
+        await self.global_bucket.acquire()
+        self.requests += 1
+        try:
+            return await call(*args)
+        except discord.NotFound:
+            # Already deleted, or the channel is gone
+            return None
+        except discord.HTTPException as e:
+            if route == "bulk_delete":
+                raise
+            logger.warning("Moderation action %s in #%s failed: %s", route, getattr(channel, "name", channel.id), e)
+
+    async def post(self, channel, content):
+        '''
+        Post a message to a channel now, paced like the queued actions and sharing their rate limits.
+        '''
+        return await self._request("send", channel, self.send, channel, content)
+
+    async def flush(self):
+        '''
+        Carry out every queued action now, without waiting for the end of its window, and wait for the
+        windows already being carried out. Each window is still carried out once, by its own task.
+        '''
+        for actions in self.channels.values():
+            actions.due.set()
+        await asyncio.gather(*self.tasks)
+
+    def stats(self):
+        return {"queued": self.queued,
+                "requests": self.requests,
+                "channels_waiting": len(self.channels)}
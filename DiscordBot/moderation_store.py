@@ -0,0 +1,198 @@
+# moderation_store.py
+import json
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+CLAIMED = "claimed"
+CLOSED = "closed"
+
+
+class ModerationStore:
+    '''
+    Durable moderation state in a SQLite database (WAL mode): the reports waiting for or under review,
+    the regexes banned from each channel, each guild's mod channel and the guilds the bot is in. Every change is committed before
+    the call returns, so pending work and ban rules survive a crash or restart.
+
+    Several bot processes (one per shard, see sharding.py) can open the same database: report claims
+    are atomic, ban rule IDs come from the database, and every ban rule change bumps a version number
+    that the other processes poll to know when to reload their rules.
+    '''
+    def __init__(self, path, shard_id=None):
+        self.path = path
+        self.shard_id = shard_id # Recorded with the reports this process claims
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS reports (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT NOT NULL,
+                claimed_by INTEGER,
+                created REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS reports_open ON reports (status) WHERE status != 'closed';
+            CREATE TABLE IF NOT EXISTS ban_rules (
+                id INTEGER PRIMARY KEY,
+                channel TEXT NOT NULL,
+                pattern TEXT NOT NULL,
+                disabled INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS mod_channels (
+                guild_id INTEGER PRIMARY KEY,
+                channel_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS guilds (
+                guild_id INTEGER PRIMARY KEY,
+                shard_id INTEGER
+            );
+        """)
+        if "claimed_shard" not in [column[1] for column in self.conn.execute("PRAGMA table_info(reports)")]:
+            self.conn.execute("ALTER TABLE reports ADD COLUMN claimed_shard INTEGER")
+        # Rule IDs are never reused, since the regex worker caches compiled rules by ID
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) SELECT 'ban_rule_id', coalesce(max(id), 0) FROM ban_rules")
+        self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('ban_rules_version', 0)")
+        self.conn.commit()
+
+    def _write(self, sql, params=()):
+        with self.lock:
+            cursor = self.conn.execute(sql, params)
+            self.conn.commit()
+            return cursor
+
+    # Reports
+
+    def add_report(self, data, created=None):
+        '''
+        Store a new pending report and return its ID.
+        '''
+        return self._write("INSERT INTO reports (status, created, data) VALUES (?, ?, ?)",
+                           (PENDING, created or time.time(), json.dumps(data))).lastrowid
+
+    def set_report_status(self, report_id, status, claimed_by=None):
+        self._write("UPDATE reports SET status = ?, claimed_by = ?, claimed_shard = ? WHERE id = ?",
+                    (status, claimed_by, self.shard_id if status == CLAIMED else None, report_id))
+
+    def update_report(self, report_id, data):
+        '''
+        Save changed details of a report that is still pending.
+        '''
+        self._write("UPDATE reports SET data = ? WHERE id = ? AND status = ?", (json.dumps(data), report_id, PENDING))
+
+    def claim_report(self, report_id, claimed_by):
+        '''
+        Mark a pending report as claimed. Returns False if it isn't pending any more, for instance
+        because a moderator on another shard got to it first.
+        '''
+        return self._write("UPDATE reports SET status = ?, claimed_by = ?, claimed_shard = ? WHERE id = ? AND status = ?",
+                           (CLAIMED, claimed_by, self.shard_id, report_id, PENDING)).rowcount == 1
+
+    def open_reports(self, after=0, ids=None):
+        '''
+        Every report with an ID above `after` (or in `ids`) that hasn't been closed yet, oldest first, as
+        (id, status, created, data, claimed shard) tuples.
+        '''
+        query = "SELECT id, status, created, data, claimed_shard FROM reports WHERE status != ? AND id > ?"
+        if ids is None:
+            batches = [()]
+        else:
+            ids = sorted(ids)
+            batches = [ids[start:start + 500] for start in range(0, len(ids), 500)]
+        rows = []
+        with self.lock:
+            for batch in batches:
+                sql = query + (f" AND id IN ({','.join('?' * len(batch))})" if ids is not None else "") + " ORDER BY id"
+                rows += self.conn.execute(sql, (CLOSED, after, *batch)).fetchall()
+        return [(report_id, status, created, json.loads(data), shard) for report_id, status, created, data, shard in rows]
+
+    def report_states(self):
+        '''
+        Map from the ID of every report that hasn't been closed to its status.
+        '''
+        with self.lock:
+            return dict(self.conn.execute("SELECT id, status FROM reports WHERE status != ?", (CLOSED,)))
+
+    def changed(self):
+        '''
+        A number that changes whenever another process commits a change to the database.
+        '''
+        with self.lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    # Ban rules
+
+    def next_ban_rule_id(self):
+        with self.lock:
+            (rule_id,) = self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'ban_rule_id' RETURNING value").fetchone()
+            self.conn.commit()
+            return rule_id
+
+    def save_ban_rule(self, rule):
+        '''
+        Save a new or changed ban rule and return the new ban rules version.
+        '''
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO ban_rules (id, channel, pattern, disabled) VALUES (?, ?, ?, ?)",
+                              (rule.id, rule.channel, rule.pattern, int(rule.disabled)))
+            (version,) = self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'ban_rules_version' RETURNING value").fetchone()
+            self.conn.commit()
+            return version
+
+    def delete_ban_rule(self, rule_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM ban_rules WHERE id = ?", (rule_id,))
+            (version,) = self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'ban_rules_version' RETURNING value").fetchone()
+            self.conn.commit()
+            return version
+
+    def ban_rules_version(self):
+        '''
+        A number that changes whenever any process changes a ban rule.
+        '''
+        with self.lock:
+            return self.conn.execute("SELECT value FROM meta WHERE key = 'ban_rules_version'").fetchone()[0]
+
+    def ban_rules(self):
+        with self.lock:
+            return self.conn.execute("SELECT id, channel, pattern, disabled FROM ban_rules ORDER BY id").fetchall()
+
+    # Mod channels
+
+    def set_mod_channel(self, guild_id, channel_id):
+        self._write("INSERT OR REPLACE INTO mod_channels (guild_id, channel_id) VALUES (?, ?)", (guild_id, channel_id))
+
+    def remove_mod_channel(self, guild_id):
+        self._write("DELETE FROM mod_channels WHERE guild_id = ?", (guild_id,))
+
+    def mod_channels(self):
+        '''
+        Map from guild ID to the ID of its mod channel, for the guilds every process has seen.
+        '''
+        with self.lock:
+            return dict(self.conn.execute("SELECT guild_id, channel_id FROM mod_channels ORDER BY rowid"))
+
+    # Guilds, so a process can tell a guild another shard serves from one the bot isn't in
+
+    def set_guilds(self, guild_ids):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO guilds (guild_id, shard_id) VALUES (?, ?)",
+                                  ((guild_id, self.shard_id) for guild_id in guild_ids))
+            self.conn.commit()
+
+    def remove_guild(self, guild_id):
+        self._write("DELETE FROM guilds WHERE guild_id = ?", (guild_id,))
+
+    def has_guild(self, guild_id):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM guilds WHERE guild_id = ?", (guild_id,)).fetchone() is not None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,114 @@
+# perspective.py
+import json
+import os
+import threading
+import httplib2
+from googleapiclient import discovery
+
+DISCOVERY_URL = "https://commentanalyzer.googleapis.com/$discovery/rest?version=v1alpha1"
+# Checked-in copy of the discovery document so startup never has to fetch it
+VENDORED_DISCOVERY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "discovery", "commentanalyzer_v1alpha1.json")
+
+# Attributes requested for every channel message
+CONTENT_ATTRIBUTES = ['TOXICITY',
+                      'SEVERE_TOXICITY',
+                      'IDENTITY_ATTACK',
+                      'INSULT',
+                      'PROFANITY',
+                      'THREAT',
+                      'SEXUALLY_EXPLICIT']
+
+
+class PerspectiveClient:
+    '''
+    Long-lived client for the Perspective comment analyzer. The service object is built once from a
+    discovery document on disk (fetching and caching it there first if it is missing) and is then
+    reused for every analyze call. httplib2 connections are not thread-safe, so each worker thread
+    that calls analyze keeps its own long-lived connection.
+    '''
+    def __init__(self, api_key, discovery_path=VENDORED_DISCOVERY, discovery_url=DISCOVERY_URL, api_endpoint=None, timeout=10):
+        self.api_key = api_key
+        self.discovery_path = discovery_path
+        self.discovery_url = discovery_url
+        self.api_endpoint = api_endpoint # Overrides the document's rootUrl, e.g. to point at a local stub
+        self.timeout = timeout
+        self.http = httplib2.Http(timeout=timeout)
+        self._local = threading.local()
+        self._build_lock = threading.Lock()
+        self.discovery_fetches = 0 # Number of times the discovery document was fetched over the network
+        self._service = None
+
+    @property
+    def service(self):
+        with self._build_lock:
+            if self._service is None:
+                document = self._load_discovery()
+                if self.api_endpoint:
+                    # Rewrite the root rather than using client_options so the batch endpoint moves too
+                    document["rootUrl"] = document["baseUrl"] = self.api_endpoint
+                self._service = discovery.build_from_document(
+                    document,
+                    developerKey=self.api_key,
+                    http=self.http,
+                )
+        return self._service
+
+    def _load_discovery(self):
+        '''
+        Read the discovery document from disk, fetching it once and caching it if it isn't there yet.
+        '''
+        if not os.path.isfile(self.discovery_path):
+            response, content = self.http.request(self.discovery_url)
+            self.discovery_fetches += 1
+            if response.status != 200:
+                raise Exception(f"Could not fetch the Perspective discovery document ({response.status}).")
+            os.makedirs(os.path.dirname(self.discovery_path) or ".", exist_ok=True)
+            with open(self.discovery_path, 'wb') as f:
+                f.write(content)
+
+        with open(self.discovery_path) as f:
+            return json.load(f)
+
+    def _thread_http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = httplib2.Http(timeout=self.timeout)
+        return http
+
+    def _analyze_request(self, text, attributes):
+        analyze_request = {
+            'comment': { 'text': text },
+            'requestedAttributes': {attribute: {} for attribute in attributes}
+        }
+        return self.service.comments().analyze(body=analyze_request)
+
+    @staticmethod
+    def _category_scores(response):
+        categoryScores = {}
+        for category, value in response["attributeScores"].items():
+            categoryScores[category] = value["summaryScore"]["value"]
+        return categoryScores
+
+    def analyze(self, text, attributes=CONTENT_ATTRIBUTES):
+        '''
+        Score a piece of text and return a map from attribute name to its summary score.
+        '''
+        response = self._analyze_request(text, attributes).execute(http=self._thread_http())
+        return self._category_scores(response)
+
+    def analyze_batch(self, texts, attributes=CONTENT_ATTRIBUTES):
+        '''
+        Score several texts in one HTTP round trip through the API's batch endpoint. Returns a list in
+        the same order as `texts`; an entry is the exception instead of a score map if that text failed.
+        '''
+        results = [None] * len(texts)
+
+        def callback(request_id, response, exception):
+            index = int(request_id)
+            results[index] = exception if exception is not None else self._category_scores(response)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for index, text in enumerate(texts):
+            batch.add(self._analyze_request(text, attributes), request_id=str(index))
+        batch.execute(http=self._thread_http())
+        return results
@@ -0,0 +1,198 @@
+# raid.py
+import random
+import time
+from collections import deque
+from report import normalize_text
+
+_MASK = (1 << 64) - 1
+_rng = random.Random(152)
+# Odd multipliers of the multiply-shift hash functions used for MinHash
+_MULTIPLIERS = [_rng.randrange(1 << 64) | 1 for _ in range(64)]
+
+
+def features(text):
+    '''
+    The pairs of consecutive words of a message's normalized text. Pairs rather than words, since chat
+    shares most of its words ("the", "stream") but rarely in the same order.
+    '''
+    words = normalize_text(text).split()
+    return set(zip(words, words[1:]))
+
+
+def describe(clusters):
+    '''
+    What moderators are told about a raid made of `clusters`. Counts only add up the clusters' own
+    counts, so an account in two of them is counted twice.
+    '''
+    first_seen = min(cluster.first_seen for cluster in clusters)
+    last_seen = max(cluster.last_seen for cluster in clusters)
+    return (f"{sum(cluster.messages for cluster in clusters)} near-identical messages from "
+            f"{sum(len(cluster.authors) for cluster in clusters)} accounts in {last_seen - first_seen:.0f}s")
+
+
+def minhash(grams, size):
+    '''
+    `size`-byte MinHash signature of a set of features, as an int: for each hash function, one byte of
+    the smallest hash of any feature. Two signatures agree on a byte with probability J + (1 - J) / 256,
+    where J is the Jaccard similarity of the two sets, so bytes are enough and keep signatures small.
+    Uses Python's string hash, so signatures are only comparable within one process.
+    '''
+    xs = [hash(gram) & _MASK for gram in grams]
+    return int.from_bytes(bytes(min([a * x & _MASK for x in xs]) >> 24 & 255 for a in _MULTIPLIERS[:size]), 'little')
+
+
+class RaidCluster:
+    '''
+    Recent messages that are near-copies of each other, and the authors who sent them.
+    '''
+    __slots__ = ["text", "channel_id", "first_seen", "last_seen", "messages", "live", "authors", "toxic", "report"]
+
+    def __init__(self, text, channel_id, now):
+        self.text = text # The first message's text
+        self.channel_id = channel_id
+        self.first_seen = now
+        self.last_seen = now
+        self.messages = 0 # Messages ever added
+        self.live = 0 # Messages still in the window
+        self.authors = {} # Map from author ID to their messages still in the window
+        self.toxic = False # Set once a classifier flags one of the messages
+        self.report = None # The raid report filed for this cluster
+
+
+class RaidDetector:
+    '''
+    Index of the channel messages of the last `window` seconds (at most `max_messages` of them) by MinHash
+    LSH, grouping near-copies into clusters. Signatures are split into `bands` bands of `rows` bytes, and
+    the clusters of the latest `candidates` messages that share one of a message's bands are its
+    candidates, so the work per message doesn't depend on the size of the window. It joins the cluster of
+    the candidate message whose signature agrees with its own on the most bytes, if that is at least
+    `min_similarity` of them. Raiders mutate one base text, so two copies differ by two edits; comparing
+    with the nearest copy rather than the cluster's first message keeps a raid in one cluster. A cluster
+    is a raid once `min_authors` different accounts are in it and one of its messages was found toxic.
+    '''
+    def __init__(self, window=60.0, max_messages=20000, bands=8, rows=2, candidates=4, min_similarity=0.6, min_authors=5,
+                 min_features=3):
+        self.window = window
+        self.max_messages = max_messages
+        self.bands = bands
+        self.rows = rows
+        self.candidates = candidates
+        self.size = bands * rows
+        self.min_agreement = round(min_similarity * self.size)
+        self.min_authors = min_authors
+        self.min_features = min_features # Shorter texts ("gg", "lol") are too common to tell a raid from chatter
+        self.entries = deque() # (time, signature, channel ID, author ID, cluster) for the messages in the window, oldest first
+        self.channel_reports = {} # Map from channel ID to its latest raid report and the clusters folded into it
+        self.buckets = {} # Map from band key (see _keys) to its entries in the window, oldest first (lists: most hold one entry)
+
+        self.indexed = 0
+        self.joined = 0 # Messages that joined an existing cluster
+        self.raids = 0
+
+    def add(self, channel_id, author_id, text, now=None):
+        '''
+        Index a channel message and return its cluster, or None if the text is too short to index.
+        '''
+        now = time.monotonic() if now is None else now
+        self.expire(now)
+        grams = features(text)
+        if len(grams) < self.min_features:
+            return None
+        signature = minhash(grams, self.size)
+
+        keys = self._keys(channel_id, signature)
+        cluster, best = None, self.min_agreement - 1
+        seen = set()
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                continue
+            for entry in bucket[-self.candidates:]:
+                if entry[1] in seen:
+                    continue
+                seen.add(entry[1])
+                # Equal bytes are the zero bytes of the XOR
+                agreement = (entry[1] ^ signature).to_bytes(self.size, 'little').count(0)
+                if agreement > best:
+                    cluster, best = entry[4], agreement
+        if cluster is None:
+            cluster = RaidCluster(text, channel_id, now)
+        else:
+            self.joined += 1
+
+        entry = (now, signature, channel_id, author_id, cluster)
+        self.entries.append(entry)
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = []
+            bucket.append(entry)
+        cluster.messages += 1
+        cluster.live += 1
+        cluster.authors[author_id] = cluster.authors.get(author_id, 0) + 1
+        cluster.last_seen = now
+        self.indexed += 1
+        return cluster
+
+    def _keys(self, channel_id, signature):
+        # One int per band, holding the channel, the band's number and its bytes
+        bits = 8 * self.rows
+        mask = (1 << bits) - 1
+        base = channel_id << 8
+        return [(base | band) << bits | (signature >> (band * bits) & mask) for band in range(self.bands)]
+
+    def expire(self, now):
+        '''
+        Drop the messages that left the window. Entries leave in the order they came, so each is the
+        oldest entry of every bucket it is in.
+        '''
+        entries = self.entries
+        while entries and (entries[0][0] < now - self.window or len(entries) >= self.max_messages):
+            _, signature, channel_id, author_id, cluster = entries.popleft()
+            for key in self._keys(channel_id, signature):
+                bucket = self.buckets[key]
+                del bucket[0]
+                if not bucket:
+                    del self.buckets[key]
+            cluster.live -= 1
+            cluster.authors[author_id] -= 1
+            if not cluster.authors[author_id]:
+                del cluster.authors[author_id]
+
+    def is_raid(self, cluster):
+        return cluster.toxic and len(cluster.authors) >= self.min_authors
+
+    def fold(self, cluster, is_open):
+        '''
+        Fold a cluster that just became a raid into the raid report last filed for its channel, if
+        `is_open(report)` says moderators haven't picked that report up yet, so one raid mutating its
+        text past the similarity threshold still makes one report. Returns that report, or None.
+        '''
+        filed = self.channel_reports.get(cluster.channel_id)
+        if filed is None or not is_open(filed[0]):
+            return None
+        filed[1].append(cluster)
+        cluster.report = filed[0]
+        return filed[0]
+
+    def filed(self, cluster, report):
+        cluster.report = report
+        self.channel_reports[cluster.channel_id] = (report, [cluster])
+        self.raids += 1
+
+    def describe(self, report):
+        '''
+        The raid summary for a report filed in its channel, or None if it is no longer that channel's
+        latest raid report.
+        '''
+        filed = self.channel_reports.get(report.channel_id)
+        if filed is None or filed[0] is not report:
+            return None
+        return describe(filed[1])
+
+    def stats(self):
+        return {"window_messages": len(self.entries),
+                "buckets": len(self.buckets),
+                "indexed": self.indexed,
+                "joined": self.joined,
+                "raids": self.raids}
@@ -0,0 +1,61 @@
+# record_scores.py
+# Sends a labeled dataset through Perspective and records the raw score of every attribute, the input
+# DataAnalysis/sweep.py tunes the bot's thresholds from.
+#
+#   python record_scores.py --data labeled.json --out ../DataAnalysis/scores.json
+#
+# The input is a JSON object with "Texts" and "Labels" lists, like the cascade's datasets. The output
+# keeps both and adds one list per attribute (null where the request failed) and "P-Score", the highest
+# attribute score of each text, which is what the cascade's GPT band is compared against.
+import argparse
+import json
+import os
+import time
+from perspective import CONTENT_ATTRIBUTES, PerspectiveClient
+
+
+def record_scores(client, texts, batch_size=50, progress=True):
+    '''
+    Map from attribute to the list of scores of `texts`, None for texts the API failed on.
+    '''
+    columns = {attribute: [] for attribute in CONTENT_ATTRIBUTES}
+    start = time.perf_counter()
+    for offset in range(0, len(texts), batch_size):
+        for result in client.analyze_batch(texts[offset:offset + batch_size]):
+            failed = isinstance(result, Exception)
+            for attribute, column in columns.items():
+                column.append(None if failed else result.get(attribute))
+        if progress:
+            done = min(offset + batch_size, len(texts))
+            print(f"{done}/{len(texts)} texts scored in {time.perf_counter() - start:.0f}s")
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", required=True, help="JSON file with Texts and Labels")
+    parser.add_argument("--out", default="scores.json")
+    parser.add_argument("--tokens", default="tokens.json", help="file holding the perspective_ai_key")
+    parser.add_argument("--batch-size", type=int, default=50, help="texts per batch request")
+    parser.add_argument("--api-endpoint", help="score against another endpoint, e.g. a local stub")
+    args = parser.parse_args()
+
+    with open(args.tokens) as f:
+        api_key = json.load(f)['perspective_ai_key']
+    with open(args.data) as f:
+        data = json.load(f)
+
+    columns = record_scores(PerspectiveClient(api_key, api_endpoint=args.api_endpoint), data["Texts"], args.batch_size)
+    scores = [[s for s in row if s is not None] for row in zip(*columns.values())]
+    output = {"Texts": data["Texts"], "Labels": data["Labels"], **columns,
+              "P-Score": [max(row) if row else None for row in scores]}
+    tmp_path = args.out + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(output, f)
+    os.replace(tmp_path, args.out)
+    failed = sum(1 for score in output["P-Score"] if score is None)
+    print(f"wrote {len(data['Texts'])} rows to {args.out} ({failed} failed)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,28 @@
 from enum import Enum, auto
 import discord
 import re
-import json
+import time
 from unidecode import unidecode
+from ban_rules import validate_pattern, UnsafeRegexError
+from state_machine import ANY, Flow, FlowState, Transition
+from moderation_actions import REVIEW_REMOVED_NOTICE
+
+
+def normalize_text(text):
+    '''
+    Canonical form of a message used to recognise copies of the same text: transliterated to ASCII,
+    lower-cased, with runs of whitespace collapsed.
+    '''
+    return " ".join(unidecode(text).lower().split())
+
+
+def decode_escapes(text):
+    '''
+    The text with backslash escapes (e.g. \\u0041) decoded. Returns `text` itself when there is nothing
+    to decode, so reports don't hold two copies of the same content.
+    '''
+    decoded = text.encode('utf-8').decode('unicode-escape')
+    return text if decoded == text else decoded
 
 
 class State(Enum):
@@ -25,6 +45,7 @@ class State(Enum):
     OTHER_VIOLATIONS = auto()
     REPEAT_OFFENDER = auto()
     REMOVE_MESSAGE = auto()
+    CHECK_VIOLATIONS = auto()
     REVIEW_COMPLETE = auto()
     ADVERSARIAL = auto()
     ROUTINE = auto()
@@ -32,190 +53,207 @@ class State(Enum):
     BAN_REGEX = auto()
     ASK_REGEX = auto()
 
+
+# The details in a report summary: (attribute, label, template for its line)
+SUMMARY_FIELDS = [(field, label, f"{label}: {{}}\n".format) for field, label in [
+    ("messageContent", "Message"), ("author", "Author"), ("decodedMessage", "Decoded Content"), ("reason", "Report Reason"),
+    ("category", "Abuse Category"), ("usernameIssue", "Username Issue"), ("repeatOffender", "Repeat Offender"), ("raid", "Raid")]]
+
+
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
     HELP_KEYWORD = "help"
     BAN_REGEX_KEYWORD = "ban"
 
-    def __init__(self, client, regexes = {}):
+    # Fields that are saved with a report in the report queue
+    SAVED_FIELDS = ["author", "author_id", "messageContent", "reason", "category", "usernameIssue", "repeatOffender",
+                    "decodedMessage", "score", "guild_id", "channel_id", "message_id", "raid"]
+
+    # Reports stay open in the queue for a long time, so they only hold IDs and plain values. The reported
+    # discord.Message is looked up again through the client when a review needs it (see resolve_message).
+    __slots__ = ["state", "client", "id", "created", "score", "priority", "guild_id", "channel_id", "message_id", "_message",
+                 "author", "author_id", "messageContent", "reason", "category", "usernameIssue", "repeatOffender",
+                 "decodedMessage", "raid", "regexes", "regex", "regex_error", "rule_id", "cancelled"]
+
+    def __init__(self, client, regexes = None):
         self.state = State.REPORT_START
         self.client = client
-        self.message = ""
+        self.id = None # Assigned when the report is queued for moderators
+        self.created = time.time()
+        self.score = None # Highest classifier score, if a classifier flagged the message
+        self.priority = None # Review priority, assigned by the ReviewScheduler
+
+        # Where the reported message lives; the message itself is only held while a moderator reviews it
+        self.guild_id = None
+        self.channel_id = None
+        self.message_id = None
+        self._message = None
         
         # These class variables are details regarding the abuse, some may stay
         # equal to their initial value depending on the abuse category
         self.author = None
+        self.author_id = None
         self.messageContent = None
         self.reason = None
         self.category = None
         self.usernameIssue = None
         self.repeatOffender = False
         self.decodedMessage = None
+        self.raid = None # How many near-copies of the message were sent by how many accounts, for raid reports
         self.regexes = regexes
         self.regex = None
+        self.regex_error = None
+        self.rule_id = None
+        self.cancelled = False # Whether the user cancelled the report instead of submitting it
+
+    @property
+    def message(self):
+        '''
+        The reported message, once resolve_message has looked it up.
+        '''
+        return self._message
+
+    @message.setter
+    def message(self, message):
+        # Keep the IDs (and the author, which the review needs) rather than the message itself
+        self._message = None
+        if message:
+            self.guild_id = message.guild.id if message.guild else None
+            self.channel_id = message.channel.id
+            self.message_id = message.id
+            self.author = message.author.name
+            self.author_id = message.author.id
     
     async def handle_message(self, message, mod_channels):
         '''
-        This function makes up the meat of the user-side reporting flow. It defines how we transition between states and what 
-        prompts to offer at each of those states. You're welcome to change anything you want; this skeleton is just here to
-        get you started and give you a model for working with Discord. 
+        This function makes up the meat of the user-side reporting flow: it feeds the message to REPORT_FLOW
+        (at the bottom of this file), which defines how we transition between states and what prompts to
+        offer at each of those states.
         '''
-        if message.content == self.BAN_REGEX_KEYWORD:
-            self.state = State.ASK_REGEX
-            return ["Please enter the regex you want to ban."]
-        if self.state == State.ASK_REGEX:
-            self.state = State.BAN_REGEX
-            self.regex = message.content
-            return ["Please enter the channel name you want to ban the regex from."]
-        if self.state == State.BAN_REGEX:
-            self.state = State.REPORT_COMPLETE
-            self.regexes[message.content] = self.regex
-            return ["The regex has been banned from the specified channel. "]
-
-        if message.content == self.CANCEL_KEYWORD:
-            self.state = State.REPORT_COMPLETE
-            return ["Report cancelled."]
-        
-        if self.state == State.REPORT_START:
-            reply =  "Thank you for starting the reporting process. "
-            reply += "Say `help` at any time for more information.\n\n"
-            reply += "Please copy paste the link to the message you want to report.\n"
-            reply += "You can obtain this link by right-clicking the message and clicking `Copy Message Link`."
-            self.state = State.AWAITING_MESSAGE
-            return [reply]
-        
-        if self.state == State.AWAITING_MESSAGE:
-            # Parse out the three ID strings from the message link
-            m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
-            if not m:
-                return ["I'm sorry, I couldn't read that link. Please try again or say `cancel` to cancel."]
-            guild = self.client.get_guild(int(m.group(1)))
-            if not guild:
-                return ["I cannot accept reports of messages from guilds that I'm not in. Please have the guild owner add me to the guild and try again."]
-            channel = guild.get_channel(int(m.group(2)))
-            if not channel:
-                return ["It seems this channel was deleted or never existed. Please try again or say `cancel` to cancel."]
-            try:
-                message = await channel.fetch_message(int(m.group(3)))
-            except discord.errors.NotFound:
-                return ["It seems this message was deleted or never existed. Please try again or say `cancel` to cancel."]
-
-            # Here we've found the message - it's up to you to decide what to do next!
-            self.state = State.MESSAGE_IDENTIFIED
-            self.message = message
-            self.author = message.author.name
-            self.messageContent = message.content
-
-            self.decodedMessage = self.messageContent.encode('utf-8').decode('unicode-escape')
-            
-            return ["I found this message:", "```" + message.author.name + ": " + message.content + "```" + "\n" + 
-                    "Are you sure this is the message you would like to report?", 
-                    "Otherwise, this report will be cancelled."]
-        # User has been asked to confirm whether this is the message they actually want to report
-        if self.state == State.MESSAGE_IDENTIFIED:
-            # Prompt to user to select the type of harassment
-            if message.content[0] in ["y", "Y"]:
-                self.state = State.SELECTING
-                return ["Please reply with the number corresponding to the reason for reporting this post:" + 
-                        "\n1. Hate Speech" + "\n2. Nudity or Sexual Activity" + "\n3. Harassment" + "\n4. Imminent Danger"]
-            # User decided not to report this message/user
-            else:
-                self.state = State.REPORT_COMPLETE
-                return ["Report cancelled."]
-        # User selected abuse type
-        if self.state == State.SELECTING:
-            self.reason = message.content
-            # User selects Hate Speech
-            if (message.content == "1"):
-                self.state = State.CATEGORY
-                return ["Please select the category of hate speech this post falls into." + "\n" + 
-                        "1. The content includes deadnaming" + "\n" + 
-                        "2. The content misgenders someone" + "\n" +
-                        "3. The content includes a slur" + "\n" +
-                        "4. The username is vulgar or inappropriate" + "\n" + 
-                        "5. This content is part of a raid" ]
-            # Everything else
-            else:
-                await self.forwardToMods(mod_channels)
-                self.state = State.BLOCK
-                return ["We have forwarded the information to our moderator team." + "\n" + "Would you like to block this user?"]
-        # User selects Hate Speech type: 1: Deadnaming, 2: Misgendering, 3: Slurs
-        if self.state == State.CATEGORY:
-            self.category = message.content
-            category = None
-            if message.content == "1": 
-                category = "deadnaming"
-            elif message.content == "2":
-                category = "misgendering"
-            elif message.content == "3":
-                category = "using a slur"
-            elif message.content == "4":
-                category = "using an inappropriate username"
-            elif message.content == "5":
-                category = "being part of a raid"
-            else:
-                category = "hate speech"
-
-            confirmation_msg = f'You are about to report this content for {category}. Please select \'cancel\' if this report was made in error.\n'
-            if message.content in ["1", "2", "3"]: 
-                await self.forwardToMods(mod_channels)
-                self.state = State.BLOCK
-                return [confirmation_msg, "We have forwarded the information to our moderator team." + "\n" + "Would you like to block this user to prevent them from sending  you more messages in the future?"]
-            # Vulgar / Inappropriate username
-            if (message.content == "4"):
-                self.state = State.DESCRIBE_ISSUE
-                return ["Please briefly describe the issue with this user's username."]
-            # Raid
-            if (message.content == "5"):
-                self.state = State.RAID
-                return ["To your knowledge, has this user a repeat offender or been a part of other raids? " + 
-                            "If unsure, please select \'no.\'"]
-        # Prompt the user to describe the issue with this person's username
-        if self.state == State.DESCRIBE_ISSUE:
-            self.usernameIssue = message.content
-            await self.forwardToMods(mod_channels)
-            self.state = State.BLOCK
-            return ["We have forwarded the information to our moderator team." + "\n" + "Would you like to block this user to prevent them from sending you more messages in the future?"]
-        # Prompt the user to answer whether this person is a repeat offender or not
-        if self.state == State.RAID:
-            self.repeatOffender = (message.content[0] in ["y", "Y"])
-            await self.forwardToMods(mod_channels)
-            self.state = State.BLOCK
-            return ["We have forwarded the information to our moderator team." + "\n" + "Would you like to block this user to prevent them from sending you more messages in the future?"]
-        # User has blocked another user, conclude user reporting flow
-        if self.state == State.BLOCK:
-            if message.content[0] in ["y", "Y"]:
-                self.state = State.REPORT_COMPLETE
-                return ["The user has been blocked. ", "Thank you for reporting. Our content moderation team will review the " + 
-                        "content and email you an update once we decide on appropriate action. This may include content and/or account removal."]
-            else:
-                self.state = State.REPORT_COMPLETE
-                return ["Thank you for reporting. Our content moderation team will review the " + 
-                        "content and email you an update once we decide on appropriate action. This may include content and/or account removal."]   
-        
+        return await REPORT_FLOW.step(self, message, mod_channels)
+
+    # Readers and actions used by REPORT_FLOW
+
+    async def find_message(self, message):
+        # Parse out the three ID strings from the message link
+        m = re.search('/(\d+)/(\d+)/(\d+)', message.content)
+        if not m:
+            return "bad link"
+        known, channel = await self.client.guild_channel(int(m.group(1)), int(m.group(2)))
+        if not known:
+            return "unknown guild"
+        if not channel:
+            return "unknown channel"
+        try:
+            found = await channel.fetch_message(int(m.group(3)))
+        except discord.errors.NotFound:
+            return "unknown message"
+
+        # Here we've found the message
+        self.message = found
+        self.messageContent = found.content
+        self.decodedMessage = decode_escapes(self.messageContent)
+        return "found"
+
+    def check_regex(self, message):
+        try:
+            validate_pattern(message.content)
+        except re.error as e:
+            self.regex_error = f"That regex is invalid ({e})."
+            return "rejected"
+        except UnsafeRegexError as e:
+            self.regex_error = f"That regex could freeze the bot ({e})."
+            return "rejected"
+        return "valid"
+
+    def save_regex(self, message, mod_channels):
+        self.regex = message.content
+
+    def ban_regex(self, message, mod_channels):
+        self.rule_id = self.regexes.add(message.content, self.regex).id
+
+    def save_reason(self, message, mod_channels):
+        self.reason = message.content
+
+    def save_category(self, message, mod_channels):
+        self.category = message.content
+
+    def save_username_issue(self, message, mod_channels):
+        self.usernameIssue = message.content
+
+    def save_repeat_offender(self, message, mod_channels):
+        self.repeatOffender = yes_or_no(self, message) == "yes"
+
+    def cancel(self, message, mod_channels):
+        self.cancelled = True
+
     def report_complete(self):
         return self.state == State.REPORT_COMPLETE
-    
-    async def forwardToMods(self, mod_channels):
-        message = self.message
-        mod_channel = mod_channels[message.guild.id]
-
-        # A dictionary of relevant report information
-        reportInfo = {"Message": self.messageContent,
-                      "Author": self.author,
-                      "Message Content": self.messageContent,
-                      "Decoded Content": self.decodedMessage,
-                      "Report Reason": self.reason,
-                      "Abuse Category": self.category,
-                      "Username Issue" : self.usernameIssue,
-                      "Repeat Offender": self.repeatOffender}
-        # await mod_channel.send(reportInfo)
-        #scores = self.eval_text(message.content)
-        #await mod_channel.send(self.code_format(scores)
-    
+
+    def report_submitted(self):
+        '''
+        Whether the user finished reporting a message, rather than cancelling or banning a regex.
+        '''
+        return self.report_complete() and not self.cancelled and self.messageContent is not None
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.SAVED_FIELDS}
+
+    @classmethod
+    def from_dict(cls, client, data):
+        report = cls(client)
+        for field, value in data.items():
+            setattr(report, field, value)
+        report.state = State.REPORT_COMPLETE
+        return report
+
+    async def resolve_message(self):
+        '''
+        Look up the reported message for a review: from the client's message cache if it is still there,
+        otherwise from Discord. Returns None if the message has since been deleted.
+        '''
+        if self._message or self.message_id is None:
+            return self._message
+        self._message = discord.utils.get(self.client.cached_messages, id=self.message_id)
+        if self._message:
+            return self._message
+        channel = self.client.get_channel(self.channel_id)
+        if channel is None:
+            _, channel = await self.client.guild_channel(self.guild_id, self.channel_id)
+        if channel is None:
+            return None
+        try:
+            self._message = await channel.fetch_message(self.message_id)
+        except discord.errors.NotFound:
+            self._message = None
+        return self._message
+
+    def summary(self):
+        '''
+        The report details shown to moderators, skipping the ones that weren't filled in.
+        '''
+        details = ((label, getattr(self, field)) for field, label, _ in SUMMARY_FIELDS)
+        return {label: value for label, value in details if value is not None}
+
+    def render_summary(self):
+        '''
+        The summary as text, one "Label: value" line per detail.
+        '''
+        lines = []
+        for field, _, line in SUMMARY_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                lines.append(line(value))
+        return "".join(lines)
+
+
 class ModReview:
     START_REVIEW_KEYWORD = "review"
+    NEXT_REVIEW_KEYWORD = "next"
+    QUEUE_KEYWORD = "queue"
+    PROFILE_KEYWORD = "profile"
+    ENABLE_RULE_KEYWORD = "enable"
     DISMISS_KEYWORD = "dismiss"
 
     def __init__(self, client, report, userStats):
@@ -223,139 +261,194 @@ class ModReview:
         self.client = client
         self.userStats = userStats
         self.threshold = 3
+        self.violations = 0
 
-        # Report information sent to the moderating channel
+        # The report under review, shared with the report queue rather than copied
         self.report = report
-        self.report_dict = {"Message": report.messageContent,
-                      "Author": report.author,
-                      "Decoded Content": report.decodedMessage,
-                      "Report Reason": report.reason,
-                      "Abuse Category": report.category,
-                      "Username Issue" : report.usernameIssue,
-                      "Repeat Offender": report.repeatOffender}
     
     async def handle_mod_message(self, message, mod_channels):
         '''
-        This function makes up the meat of the moderator-side reporting flow. It defines how we transition between states and what 
-        prompts to offer at each of those states. 
+        This function makes up the meat of the moderator-side reporting flow: it feeds the message to
+        REVIEW_FLOW (at the bottom of this file), which defines how we transition between states and what
+        prompts to offer at each of those states.
         '''
-        if message.content == self.DISMISS_KEYWORD:
-            self.state = State.REVIEW_COMPLETE
-            return ["Report dismissed."]
-        
-        if self.state == State.REVIEW_START or message.content == self.START_REVIEW_KEYWORD:
-            reply =  "Thank you for starting the reviewing process. \n "
-            for key, value in self.report_dict.items():
-                if value is not None:
-                    reply += key + ": " + str(value) + "\n"
-            reply += "Is this harassment?\n\n"
-            self.state = State.HARASSMENT
-            return [reply]
-        if self.state == State.HARASSMENT:
-            if message.content[0] in ["y", "Y"]:
-                self.state = State.DANGER
-                
-                userStatsDict = {}
-                with open(self.userStats) as userStats:
-                    userStatsDict = json.load(userStats)
-                    userStatsDict[self.report.message.author.name] = userStatsDict.get(self.report.message.author.name, 0) + 1
-
-                    # If the user has been a perpetrator more than the allotted number of times,
-                    # permanently ban them
-                    if userStatsDict[self.report.message.author.name] >= self.threshold:
-                        return ["The user has been permanently banned for surpassing the number of allowed violations."]
-                    
-                with open(self.userStats, 'w') as userStats:
-                    json.dump(userStatsDict, userStats)
-
-                return ["Does this report indicate a user is in imminent danger?"]
-            else:
-                self.state = State.ADVERSARIAL
-                return ["Is this a case of adversarial flagging?"]
-        if self.state == State.ADVERSARIAL:
-            if message.content in ["y", "Y"]:
-                self.state = State.ROUTINE
-                return ["Is harassment routine (over frequent reporting from one user) or is it coordinated (one user reported by many users)?"]
-            else:
-                return ["Thank you. This review is complete."]
-        if self.state == State.ROUTINE:
-            if message.content in ["y", "Y"]:
-                self.state = State.REVIEW_COMPLETE
-                return ["The user has been temporarily banned and flagged for violating Community Guidelines."]
-            else:
-                return ["Thank you. This review is complete."]
-        # Determine if this person is in danger
-        if self.state == State.DANGER:
-            # There is imminent danger
-            if message.content[0] in ["y", "Y"]:
-                self.state = State.REVIEW_COMPLETE
-                return ["The authorities have been contacted with this user's details."]
-            # No imminent danger, case states on category of the report
-            
-            else:
-                # If the high-level reason for the report is hate speech, then proceed, otherwise 
-                # finish the report
-                if self.report.reason == "1":
-                    category = self.report.category
-                    # Misgendering, Deadnaming, or slurs
-                    if category in ["1", "2", "3"]:
-                        # Remove the original message
-                        await self.report.message.delete()
-                        await self.report.message.channel.send("This message has been removed for violating Twitch's guidelines.")
-
-                        # Check if the user has other violations
-                        self.state = State.OTHER_VIOLATIONS
-                        return ["The message has been removed. Does the user have other violations?"]
-                    elif category == "4":
-                        self.state = State.REVIEW_COMPLETE
-                        return ["The user has been permanently banned."]
-                    elif category == "5":
-                        self.state = State.REPEAT_OFFENDER
-                        return ["To your knowledge, has this user a repeat offender or been a part of other raids? ",
-                                "If unsure, please select \'no.\'"]
-                    else:
-                        if category is None:
-                            # This report does not have the category included
-                            self.state = State.FILLED_CATEGORY
-                            return ["Please select the category of hate speech this post falls into." + "\n" + 
-                                "1. The content includes deadnaming" + "\n" + 
-                                "2. The content misgenders someone" + "\n" +
-                                "3. The content includes a slur" + "\n" +
-                                "4. The username is vulgar or inappropriate" + "\n" + 
-                                "5. This content is part of a raid" ]
-                else:
-                    self.state = State.REPORT_COMPLETE
-                    return ["Thank you for reporting."]
-        if self.state == State.FILLED_CATEGORY:
-            category = message.content
-            # Misgendering, Deadnaming, or slurs
-            if category in ["1", "2", "3"]:
-                # Remove the original message
-                await self.report.message.delete()
-
-                # Check if the user has other violations
-                self.state = State.OTHER_VIOLATIONS
-                return ["The message has been removed. Does the user have other violations?"]
-            if category == "4":
-                self.state = State.REVIEW_COMPLETE
-                return ["The user has been permanently banned."]
-            if category == "5":
-                self.state = State.REPEAT_OFFENDER
-                return ["To your knowledge, has this user a repeat offender or been a part of other raids? ",
-                        "If unsure, please select \'no.\'"]
-        if self.state == State.OTHER_VIOLATIONS:
-            if message.content[0] in ["y", "Y"]:
-                self.state = State.REVIEW_COMPLETE
-                return ["The user has been temporarily banned and flagged for violating Community Guidelines."]
-            else:
-                self.state = State.REVIEW_COMPLETE
-                return ["Thank you. This review is complete."]
-        if self.state == State.REPEAT_OFFENDER:
-            self.state = State.REVIEW_COMPLETE
-            if message.content[0] in ["y", "Y"]:
-                return ["The user has been permanently banned."]
-            else:
-                return ["The user has been temporarily banned and flagged for violating Community Guidelines."]
+        return await REVIEW_FLOW.step(self, message, mod_channels)
+
+    # Readers and actions used by REVIEW_FLOW
+
+    def record_violation(self, message, mod_channels):
+        self.violations = self.userStats.increment(self.report.author)
+
+    def violation_outcome(self, message):
+        # If the user has been a perpetrator more than the allotted number of times, permanently ban them
+        return "banned" if self.violations >= self.threshold else "allowed"
+
+    def danger_outcome(self, message):
+        if yes_or_no(self, message) == "yes":
+            return "danger"
+        # No imminent danger: if the high-level reason for the report is hate speech, the category
+        # decides what happens next, otherwise the review is finished
+        if self.report.reason != "1":
+            return "not hate speech"
+        return {"1": "remove", "2": "remove", "3": "remove", "4": "username", "5": "raid"}.get(self.report.category, "uncategorized")
+
+    def remove_message(self, message, mod_channels):
+        # Remove the original message, unless it's already gone; the bot deletes in bulk (see ModerationActions)
+        if self.report.message:
+            self.client.actions.delete(self.report.message)
+
+    def post_removal_notice(self, message, mod_channels):
+        if self.report.message:
+            self.client.actions.notify(self.report.message.channel, REVIEW_REMOVED_NOTICE)
 
     def review_complete(self):
         return self.state == State.REVIEW_COMPLETE
+
+
+def yes_or_no(machine, message):
+    return "yes" if message.content[:1] in ["y", "Y"] else "no"
+
+
+# Prompts, built once
+
+START_PROMPT = ("Thank you for starting the reporting process. Say `help` at any time for more information.\n\n"
+                "Please copy paste the link to the message you want to report.\n"
+                "You can obtain this link by right-clicking the message and clicking `Copy Message Link`.")
+REASON_MENU = ("Please reply with the number corresponding to the reason for reporting this post:"
+               "\n1. Hate Speech\n2. Nudity or Sexual Activity\n3. Harassment\n4. Imminent Danger")
+HATE_SPEECH_MENU = ("Please select the category of hate speech this post falls into.\n"
+                    "1. The content includes deadnaming\n"
+                    "2. The content misgenders someone\n"
+                    "3. The content includes a slur\n"
+                    "4. The username is vulgar or inappropriate\n"
+                    "5. This content is part of a raid")
+HATE_SPEECH_CATEGORIES = {"1": "deadnaming", "2": "misgendering", "3": "using a slur"}
+FORWARDED = "We have forwarded the information to our moderator team."
+BLOCK_PROMPT = FORWARDED + "\nWould you like to block this user?"
+BLOCK_FUTURE_PROMPT = FORWARDED + "\nWould you like to block this user to prevent them from sending you more messages in the future?"
+THANK_YOU_FOR_REPORTING = ("Thank you for reporting. Our content moderation team will review the content and email you an update "
+                           "once we decide on appropriate action. This may include content and/or account removal.")
+RAID_PROMPT = "To your knowledge, has this user a repeat offender or been a part of other raids? "
+UNSURE = "If unsure, please select \'no.\'"
+NOT_FOUND = " Please try again or say `cancel` to cancel."
+
+PERMANENT_BAN = "The user has been permanently banned."
+TEMPORARY_BAN = "The user has been temporarily banned and flagged for violating Community Guidelines."
+REVIEW_DONE = "Thank you. This review is complete."
+REVIEW_HEADER = "Thank you for starting the reviewing process for report #{id}.\n".format
+
+
+def found_message(report):
+    return f"```{report.author}: {report.messageContent}```\nAre you sure this is the message you would like to report?"
+
+
+def regex_rejected(report):
+    return report.regex_error + " Please enter the regex you want to ban."
+
+
+def regex_banned(report):
+    return f"The regex has been banned from the specified channel (rule {report.rule_id}). "
+
+
+def review_summary(review):
+    return REVIEW_HEADER(id=review.report.id) + review.report.render_summary() + "Is this harassment?\n\n"
+
+
+# The user-side reporting flow, and the flow for banning a regex from a channel
+REPORT_FLOW = Flow("report", State.REPORT_START, [State.REPORT_COMPLETE], keywords={
+    Report.BAN_REGEX_KEYWORD: Transition(State.ASK_REGEX, ["Please enter the regex you want to ban."]),
+    Report.CANCEL_KEYWORD: Transition(State.REPORT_COMPLETE, ["Report cancelled."], [Report.cancel]),
+}, states={
+    State.REPORT_START: FlowState({ANY: Transition(State.AWAITING_MESSAGE, [START_PROMPT])}),
+    State.AWAITING_MESSAGE: FlowState({
+        "bad link": Transition(State.AWAITING_MESSAGE, ["I'm sorry, I couldn't read that link." + NOT_FOUND]),
+        "unknown guild": Transition(State.AWAITING_MESSAGE, ["I cannot accept reports of messages from guilds that I'm not in. "
+                                                             "Please have the guild owner add me to the guild and try again."]),
+        "unknown channel": Transition(State.AWAITING_MESSAGE, ["It seems this channel was deleted or never existed." + NOT_FOUND]),
+        "unknown message": Transition(State.AWAITING_MESSAGE, ["It seems this message was deleted or never existed." + NOT_FOUND]),
+        "found": Transition(State.MESSAGE_IDENTIFIED, ["I found this message:", found_message, "Otherwise, this report will be cancelled."]),
+    }, read=Report.find_message),
+    # User has been asked to confirm whether this is the message they actually want to report
+    State.MESSAGE_IDENTIFIED: FlowState({
+        "yes": Transition(State.SELECTING, [REASON_MENU]),
+        "no": Transition(State.REPORT_COMPLETE, ["Report cancelled."], [Report.cancel]),
+    }, read=yes_or_no),
+    # User selected abuse type; only hate speech has sub-categories
+    State.SELECTING: FlowState({
+        "1": Transition(State.CATEGORY, [HATE_SPEECH_MENU], [Report.save_reason]),
+        ANY: Transition(State.BLOCK, [BLOCK_PROMPT], [Report.save_reason]),
+    }),
+    # User selects hate speech type: 1: Deadnaming, 2: Misgendering, 3: Slurs, 4: Username, 5: Raid
+    State.CATEGORY: FlowState({
+        **{key: Transition(State.BLOCK, [f"You are about to report this content for {category}. "
+                                         "Please select 'cancel' if this report was made in error.\n", BLOCK_FUTURE_PROMPT],
+                           [Report.save_category])
+           for key, category in HATE_SPEECH_CATEGORIES.items()},
+        "4": Transition(State.DESCRIBE_ISSUE, ["Please briefly describe the issue with this user's username."], [Report.save_category]),
+        "5": Transition(State.RAID, [RAID_PROMPT + UNSURE], [Report.save_category]),
+        ANY: Transition(State.CATEGORY, [HATE_SPEECH_MENU]),
+    }),
+    State.DESCRIBE_ISSUE: FlowState({ANY: Transition(State.BLOCK, [BLOCK_FUTURE_PROMPT], [Report.save_username_issue])}),
+    State.RAID: FlowState({ANY: Transition(State.BLOCK, [BLOCK_FUTURE_PROMPT], [Report.save_repeat_offender])}),
+    # User has blocked another user (or not), conclude user reporting flow
+    State.BLOCK: FlowState({
+        "yes": Transition(State.REPORT_COMPLETE, ["The user has been blocked. ", THANK_YOU_FOR_REPORTING]),
+        "no": Transition(State.REPORT_COMPLETE, [THANK_YOU_FOR_REPORTING]),
+    }, read=yes_or_no),
+    State.ASK_REGEX: FlowState({
+        "rejected": Transition(State.ASK_REGEX, [regex_rejected]),
+        "valid": Transition(State.BAN_REGEX, ["Please enter the channel name you want to ban the regex from."], [Report.save_regex]),
+    }, read=Report.check_regex),
+    State.BAN_REGEX: FlowState({ANY: Transition(State.REPORT_COMPLETE, [regex_banned], [Report.ban_regex])}),
+}).validate()
+
+# The moderator-side review flow
+REVIEW_FLOW = Flow("review", State.REVIEW_START, [State.REVIEW_COMPLETE], keywords={
+    ModReview.DISMISS_KEYWORD: Transition(State.REVIEW_COMPLETE, ["Report dismissed."]),
+}, states={
+    State.REVIEW_START: FlowState({ANY: Transition(State.HARASSMENT, [review_summary])}),
+    State.HARASSMENT: FlowState({
+        "yes": Transition(State.CHECK_VIOLATIONS, [], [ModReview.record_violation]),
+        "no": Transition(State.ADVERSARIAL, ["Is this a case of adversarial flagging?"]),
+    }, read=yes_or_no),
+    State.CHECK_VIOLATIONS: FlowState({
+        "banned": Transition(State.REVIEW_COMPLETE, ["The user has been permanently banned for surpassing the number of allowed violations."]),
+        "allowed": Transition(State.DANGER, ["Does this report indicate a user is in imminent danger?"]),
+    }, read=ModReview.violation_outcome, automatic=True),
+    State.ADVERSARIAL: FlowState({
+        "yes": Transition(State.ROUTINE, ["Is harassment routine (over frequent reporting from one user) or is it coordinated "
+                                          "(one user reported by many users)?"]),
+        "no": Transition(State.REVIEW_COMPLETE, [REVIEW_DONE]),
+    }, read=yes_or_no),
+    State.ROUTINE: FlowState({
+        "yes": Transition(State.REVIEW_COMPLETE, [TEMPORARY_BAN]),
+        "no": Transition(State.REVIEW_COMPLETE, [REVIEW_DONE]),
+    }, read=yes_or_no),
+    # Determine if this person is in danger, otherwise act on the category of the report
+    State.DANGER: FlowState({
+        "danger": Transition(State.REVIEW_COMPLETE, ["The authorities have been contacted with this user's details."]),
+        "remove": Transition(State.OTHER_VIOLATIONS, ["The message has been removed. Does the user have other violations?"],
+                             [ModReview.remove_message, ModReview.post_removal_notice]),
+        "username": Transition(State.REVIEW_COMPLETE, [PERMANENT_BAN]),
+        "raid": Transition(State.REPEAT_OFFENDER, [RAID_PROMPT, UNSURE]),
+        "uncategorized": Transition(State.FILLED_CATEGORY, [HATE_SPEECH_MENU]),
+        "not hate speech": Transition(State.REVIEW_COMPLETE, ["Thank you for reporting."]),
+    }, read=ModReview.danger_outcome),
+    # The report didn't have a hate speech category, so the moderator fills it in
+    State.FILLED_CATEGORY: FlowState({
+        **{key: Transition(State.OTHER_VIOLATIONS, ["The message has been removed. Does the user have other violations?"],
+                           [ModReview.remove_message])
+           for key in HATE_SPEECH_CATEGORIES},
+        "4": Transition(State.REVIEW_COMPLETE, [PERMANENT_BAN]),
+        "5": Transition(State.REPEAT_OFFENDER, [RAID_PROMPT, UNSURE]),
+        ANY: Transition(State.FILLED_CATEGORY, [HATE_SPEECH_MENU]),
+    }),
+    State.OTHER_VIOLATIONS: FlowState({
+        "yes": Transition(State.REVIEW_COMPLETE, [TEMPORARY_BAN]),
+        "no": Transition(State.REVIEW_COMPLETE, [REVIEW_DONE]),
+    }, read=yes_or_no),
+    State.REPEAT_OFFENDER: FlowState({
+        "yes": Transition(State.REVIEW_COMPLETE, [PERMANENT_BAN]),
+        "no": Transition(State.REVIEW_COMPLETE, [TEMPORARY_BAN]),
+    }, read=yes_or_no),
+}).validate()
@@ -0,0 +1,119 @@
+# report_digest.py
+import asyncio
+import logging
+
+import discord
+
+from scheduler import severity_class
+
+logger = logging.getLogger('discord')
+
+MAX_MESSAGE = 2000 # Discord's limit for one message
+
+# Templates for the digest, formatted once per post or report
+DIGEST_HEADER = "{count} new reports are waiting for review ({pending} pending):\n".format
+DIGEST_HEADER_ONE = "1 new report is waiting for review ({pending} pending):\n".format
+DIGEST_LINE = "`#{id}` {severity}: {author}: {text}\n".format
+DIGEST_RAID = "`#{id}` {severity}: raid: {raid}\n".format
+DIGEST_MORE = "...and {count} more; `next` claims the most urgent report.\n".format
+DIGEST_HELP = ("Use `review <id>` to claim a report, or `next` to begin reviewing the most urgent one.\n"
+               "Use the `dismiss` command to cancel the review process, or `queue` to see what is waiting.\n")
+
+
+def digest_line(report, max_text=80):
+    # One line per report, and no pings from quoted mentions
+    text = " ".join(discord.utils.escape_mentions(report.messageContent or "").split())
+    if len(text) > max_text:
+        text = text[:max_text - 3] + "..."
+    if report.raid:
+        return DIGEST_RAID(id=report.id, severity=severity_class(report), raid=report.raid)
+    return DIGEST_LINE(id=report.id, severity=severity_class(report), author=report.author, text=text)
+
+
+class ReportDigest:
+    '''
+    Announces new reports in the mod channels in digests: the reports queued for a guild's mod channel over
+    `window` seconds are listed in one message, one line per report with its ID, most urgent first,
+    followed by the commands to claim them. Reports a moderator claimed before the digest went out are
+    left out. A burst of flagged messages is one post instead of one per report.
+    '''
+    def __init__(self, post, queue, window=5.0, max_lines=20):
+        self.post = post # Coroutine function posting a message to a channel
+        self.queue = queue # The ReportQueue the reports are in
+        self.window = window
+        self.max_lines = max_lines
+        self.channels = {} # Map from guild ID to (its mod channel, reports queued for the next digest)
+        self.due = {} # Map from guild ID to an event set to post its next digest before the window ends
+        self.flushing = set() # Tasks posting a digest, waiting or running
+
+        self.reports = 0 # Reports announced
+        self.digests = 0 # Messages posted
+
+    def add(self, channel, report):
+        '''
+        Announce a report about a message in `report.guild_id` in that guild's mod channel, `channel`.
+        '''
+        guild_id = report.guild_id
+        pending = self.channels.get(guild_id)
+        if pending is None:
+            pending = self.channels[guild_id] = (channel, [])
+            due = self.due[guild_id] = asyncio.Event()
+            task = asyncio.create_task(self._flush_later(guild_id, due))
+            self.flushing.add(task)
+            task.add_done_callback(self.flushing.discard)
+        pending[1].append(report)
+
+    async def _flush_later(self, guild_id, due):
+        try:
+            try:
+                await asyncio.wait_for(due.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            await self._flush(guild_id)
+        except Exception:
+            logger.exception("Posting the report digest failed")
+
+    async def _flush(self, guild_id):
+        # Reports queued from here on wait for the next digest
+        del self.due[guild_id]
+        channel, reports = self.channels.pop(guild_id)
+        self.queue.sync()
+        reports = [report for report in reports if report.id in self.queue.pending]
+        if not reports:
+            return
+        self.reports += len(reports)
+        self.digests += 1
+        await self.post(channel, self.render(reports))
+
+    def render(self, reports):
+        pending = self.queue.count(reports[0].guild_id)
+        reports = sorted(reports, key=lambda report: report.priority or 0, reverse=True)
+        if len(reports) == 1:
+            header = DIGEST_HEADER_ONE(pending=pending)
+        else:
+            header = DIGEST_HEADER(count=len(reports), pending=pending)
+        size = len(header) + len(DIGEST_HELP) + len(DIGEST_MORE(count=len(reports)))
+        lines = []
+        for report in reports[:self.max_lines]:
+            line = digest_line(report)
+            if size + len(line) > MAX_MESSAGE:
+                break
+            size += len(line)
+            lines.append(line)
+        if len(lines) < len(reports):
+            lines.append(DIGEST_MORE(count=len(reports) - len(lines)))
+        return header + "".join(lines) + DIGEST_HELP
+
+    async def flush(self):
+        '''
+        Post every waiting digest now, without waiting for the end of its window, and wait for the
+        digests already being posted.
+        '''
+        for due in self.due.values():
+            due.set()
+        await asyncio.gather(*self.flushing)
+
+    def stats(self):
+        return {"reports": self.reports,
+                "digests": self.digests,
+                "channels_waiting": len(self.channels)}
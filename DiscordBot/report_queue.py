@@ -0,0 +1,144 @@
+# report_queue.py
+import asyncio
+from collections import OrderedDict
+from moderation_store import PENDING, CLAIMED, CLOSED
+from report import Report
+from scheduler import ReviewScheduler
+
+
+class ReportQueue:
+    '''
+    Reports waiting for moderator review, backed by the ModerationStore. Every report gets an ID when
+    it is enqueued; moderators claim reports of their own guild by ID (or the most urgent one, as ordered
+    by the ReviewScheduler) and close them when the review is done. Open reports are kept in memory as well,
+    so enqueueing and claiming cost O(log n) besides the single database write.
+
+    When several shards share the store, each catches up with the reports the others queued, claimed or
+    closed with `sync`, and a claim only succeeds in the store for one of them.
+    '''
+    def __init__(self, store, client, scheduler=None, save_delay=1.0):
+        self.store = store
+        self.client = client
+        self.scheduler = scheduler or ReviewScheduler()
+        self.pending = OrderedDict() # Map from report ID to Report, oldest first
+        self.claimed = {} # Map from report ID to (moderator ID, Report)
+        self.data_version = None # The store's data version when this queue last synced
+        self.save_delay = save_delay
+        self.unsaved = {} # Map from report ID to a pending report whose changes haven't been saved yet
+        self.saving = None # Timer that saves them
+
+    def recover(self):
+        '''
+        Reload every open report after a restart. Reviews in progress are lost with the process, so
+        the reports this process had claimed go back to pending; other shards' claims are left alone.
+        '''
+        for report_id, status, created, data, shard in self.store.open_reports():
+            if status == CLAIMED and shard != self.store.shard_id:
+                continue
+            self._add(report_id, created, data)
+            if status == CLAIMED:
+                self.store.set_report_status(report_id, PENDING)
+        return len(self.pending)
+
+    def sync(self):
+        '''
+        Catch up with other shards: pick up the reports they queued or put back, and drop the ones they
+        claimed or closed. Only reads the store when another process has written to it since the last
+        sync. Returns how many reports were added.
+        '''
+        data_version = self.store.changed()
+        if data_version == self.data_version:
+            return 0
+        self.data_version = data_version
+        states = self.store.report_states()
+        for report_id in [report_id for report_id in self.pending if states.get(report_id) != PENDING]:
+            del self.pending[report_id]
+        missing = [report_id for report_id, status in states.items()
+                   if status == PENDING and report_id not in self.pending and report_id not in self.claimed]
+        for report_id, _, created, data, _ in self.store.open_reports(ids=missing):
+            self._add(report_id, created, data)
+        self.scheduler.compact(self.pending)
+        return len(missing)
+
+    def _add(self, report_id, created, data):
+        report = Report.from_dict(self.client, data)
+        report.id = report_id
+        report.created = created
+        self.pending[report_id] = report
+        self.scheduler.push(report)
+
+    def enqueue(self, report):
+        report.id = self.store.add_report(report.to_dict(), report.created)
+        self.pending[report.id] = report
+        self.scheduler.push(report)
+        return report.id
+
+    def update(self, report):
+        '''
+        Save the changed details of a pending report, such as the size of a raid that is still going on.
+        Changes are saved together `save_delay` seconds after the first one, so a fast-changing report
+        costs one write per `save_delay` rather than one per change.
+        '''
+        self.unsaved[report.id] = report
+        if self.saving is None:
+            self.saving = asyncio.get_running_loop().call_later(self.save_delay, self.save)
+
+    def save(self):
+        if self.saving is not None:
+            self.saving.cancel()
+            self.saving = None
+        for report_id, report in self.unsaved.items():
+            self.store.update_report(report_id, report.to_dict())
+        self.unsaved.clear()
+
+    def claim(self, moderator_id, guild_id, report_id=None):
+        '''
+        Claim a pending report about a message in `guild_id` for review: the given one, or the guild's
+        most urgent if no ID is given. Returns the report, or None if there is no such pending report.
+        '''
+        self.sync()
+        while True:
+            wanted = self.scheduler.pop(self.pending, guild_id) if report_id is None else report_id
+            report = self.pending.get(wanted)
+            if report is None or report.guild_id != guild_id:
+                return None
+            del self.pending[wanted]
+            if self.store.claim_report(wanted, moderator_id):
+                break
+            # Another shard claimed or closed it first
+            if report_id is not None:
+                return None
+        # Another shard may have updated the report since this one loaded it
+        if wanted not in self.unsaved:
+            for _, _, _, data, _ in self.store.open_reports(ids=[wanted]):
+                for field, value in data.items():
+                    setattr(report, field, value)
+        self.scheduler.record_claim(report)
+        self.scheduler.compact(self.pending)
+        self.claimed[wanted] = (moderator_id, report)
+        return report
+
+    def release(self, report_id):
+        '''
+        Put a claimed report back in the queue, at the priority it had, without closing it.
+        '''
+        if report_id not in self.claimed:
+            return
+        _, report = self.claimed.pop(report_id)
+        self.store.set_report_status(report_id, PENDING)
+        self.pending[report_id] = report
+        self.scheduler.push(report)
+
+    def close(self, report_id):
+        self.claimed.pop(report_id, None)
+        self.pending.pop(report_id, None)
+        self.store.set_report_status(report_id, CLOSED)
+
+    def count(self, guild_id):
+        '''
+        How many reports about messages in `guild_id` are pending.
+        '''
+        return sum(1 for report in self.pending.values() if report.guild_id == guild_id)
+
+    def __len__(self):
+        return len(self.pending)
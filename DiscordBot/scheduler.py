@@ -0,0 +1,108 @@
+# scheduler.py
+import heapq
+import itertools
+import time
+from collections import Counter, deque
+
+# Report reasons, as numbered in the user reporting flow
+SEVERITY_CLASSES = {"4": "imminent danger", "1": "hate speech", "2": "sexual content", "3": "harassment"}
+SEVERITY_WEIGHTS = {"4": 100.0, "1": 40.0, "2": 30.0, "3": 20.0}
+DEFAULT_WEIGHT = 10.0
+
+
+def severity_class(report):
+    return SEVERITY_CLASSES.get(report.reason, "other")
+
+
+class ReviewScheduler:
+    '''
+    Orders pending reports for moderators with a heap. A report's priority is its severity weight,
+    plus its classifier score, the author's past violations and how fast they are posting in the
+    reported channel, plus `aging_rate` points for every
+    second it has waited. Aging raises every report at the same rate, so ordering by the priority
+    each report had at time zero stays correct forever and nothing has to be re-heaped as time passes.
+
+    Each guild's reports have a heap of their own, since moderators only review their own guild's reports.
+    Reports removed out of order (claimed by ID) are skipped lazily when they reach the top.
+    '''
+    def __init__(self, offender_counts=None, author_pressure=None, score_weight=20.0, offender_weight=5.0, max_offences=5,
+                 pressure_weight=15.0, aging_rate=1 / 60, wait_samples=1000):
+        self.offender_counts = offender_counts # Callable from author name to past violation count
+        self.author_pressure = author_pressure # Callable from (channel ID, author ID) to their posting rate, 0 to 1
+        self.score_weight = score_weight
+        self.offender_weight = offender_weight
+        self.max_offences = max_offences
+        self.pressure_weight = pressure_weight
+        self.aging_rate = aging_rate
+        self.heaps = {} # Map from guild ID to its heap of (-priority at time zero, sequence, report ID)
+        self._seq = itertools.count()
+
+        # Queue-wait metrics per guild and severity class
+        self.waits = {} # Map from (guild ID, severity class) to the most recent wait times, in seconds
+        self.wait_samples = wait_samples
+        self.claimed = Counter()
+        self.total_wait = Counter()
+
+    def base_priority(self, report):
+        score = report.score if report.score is not None else 0.5 # Reports filed by users carry no classifier score
+        offences = self.offender_counts(report.author) if self.offender_counts and report.author else 0
+        pressure = self.author_pressure(report.channel_id, report.author_id) if self.author_pressure and report.author_id else 0
+        return (SEVERITY_WEIGHTS.get(report.reason, DEFAULT_WEIGHT)
+                + self.score_weight * score
+                + self.offender_weight * min(offences, self.max_offences)
+                + self.pressure_weight * pressure)
+
+    def priority(self, report, now=None):
+        now = time.time() if now is None else now
+        return self.base_priority(report) + self.aging_rate * (now - report.created)
+
+    def push(self, report):
+        report.priority = self.base_priority(report) - self.aging_rate * report.created
+        heapq.heappush(self.heaps.setdefault(report.guild_id, []), (-report.priority, next(self._seq), report.id))
+
+    def pop(self, pending, guild_id=None):
+        '''
+        Return the ID of the guild's highest-priority report that is still in `pending`, or None.
+        '''
+        heap = self.heaps.get(guild_id, [])
+        while heap:
+            _, _, report_id = heapq.heappop(heap)
+            if report_id in pending:
+                return report_id
+        return None
+
+    def compact(self, pending):
+        # Drop stale entries once they make up most of the heaps
+        if sum(map(len, self.heaps.values())) > 2 * len(pending) + 64:
+            for guild_id, heap in list(self.heaps.items()):
+                heap = [entry for entry in heap if entry[2] in pending]
+                if heap:
+                    heapq.heapify(heap)
+                    self.heaps[guild_id] = heap
+                else:
+                    del self.heaps[guild_id]
+
+    def record_claim(self, report, now=None):
+        now = time.time() if now is None else now
+        key = (report.guild_id, severity_class(report))
+        wait = now - report.created
+        self.waits.setdefault(key, deque(maxlen=self.wait_samples)).append(wait)
+        self.claimed[key] += 1
+        self.total_wait[key] += wait
+
+    def stats(self, guild_id=None):
+        '''
+        Queue-wait metrics per severity class for one guild: reports claimed, mean wait, and p50/p95/max
+        over the most recent claims.
+        '''
+        stats = {}
+        for (guild, severity), waits in self.waits.items():
+            if guild != guild_id:
+                continue
+            ordered = sorted(waits)
+            stats[severity] = {"claimed": self.claimed[guild, severity],
+                               "mean_wait": self.total_wait[guild, severity] / self.claimed[guild, severity],
+                               "p50_wait": ordered[len(ordered) // 2],
+                               "p95_wait": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                               "max_wait": ordered[-1]}
+        return stats
@@ -0,0 +1,74 @@
+# sharding.py
+# Runs ModBot as several processes, one per Discord shard, so classification and regex work for many
+# guilds is spread over several cores. Discord sends each shard the events of the guilds whose
+# (guild ID >> 22) % shard count is that shard's ID; DMs go to shard 0.
+#
+# The shards share the moderation state through the databases in the working directory: ban rules,
+# the report queue, each guild's mod channel and the guilds each shard serves in moderation.db
+# (ModerationStore), offender counts in userStatistics.db and username verdicts in
+# usernameVerdicts.db. Everything else (verdict cache, raid and rate tracking, open DM reports and
+# reviews) is per shard, which works because a guild's channels and a user's DMs always go to the same
+# shard; links in DM reports to other shards' guilds are fetched over HTTP.
+#
+#   python bot.py --shards 4
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+# Discord lets a bot identify one shard every 5 seconds
+IDENTIFY_INTERVAL = 5.0
+
+
+def shard_of(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+
+def run_shard(config, shard_id, shard_count, metrics_port):
+    '''
+    Run one shard of the bot until it is stopped. The target of each shard process.
+    '''
+    from bot import ModBot, setup_logging
+    log_listener = setup_logging(f'discord.{shard_id}.log')
+    client = ModBot(config, shard_id=shard_id, shard_count=shard_count,
+                    metrics_port=metrics_port + shard_id if metrics_port is not None else None)
+    client.run(config["discord"])
+    log_listener.stop()
+
+
+def run_shards(config, shard_count, metrics_port=9464, max_restarts=5):
+    '''
+    Start a process for each shard, `IDENTIFY_INTERVAL` seconds apart, and wait for them. A shard that
+    crashes is restarted, up to `max_restarts` times each. Returns when every shard has exited.
+    '''
+    context = multiprocessing.get_context("spawn")
+    restarts = [0] * shard_count
+
+    def start(shard_id):
+        process = context.Process(target=run_shard, args=(config, shard_id, shard_count, metrics_port),
+                                  name=f"shard-{shard_id}")
+        process.start()
+        return process
+
+    processes = {}
+    try:
+        for shard_id in range(shard_count):
+            if shard_id:
+                time.sleep(IDENTIFY_INTERVAL)
+            processes[shard_id] = start(shard_id)
+        while processes:
+            wait([process.sentinel for process in processes.values()])
+            for shard_id, process in list(processes.items()):
+                if process.exitcode is None:
+                    continue
+                del processes[shard_id]
+                if process.exitcode != 0 and restarts[shard_id] < max_restarts:
+                    restarts[shard_id] += 1
+                    print(f"Shard {shard_id} exited with code {process.exitcode}; restarting it.")
+                    processes[shard_id] = start(shard_id)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
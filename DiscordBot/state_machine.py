@@ -0,0 +1,144 @@
+# state_machine.py
+import inspect
+from collections import deque
+
+ANY = object() # Transition key matching any input the state has no specific transition for
+
+
+class InvalidFlowError(Exception):
+    pass
+
+
+class Transition:
+    '''
+    Where a flow goes on one input: the `actions` to run, in order, each called with (machine, message,
+    mod_channels); the state to move to; and the replies to send. A reply is either a precomputed string
+    or a function of the machine, for the few replies that include report details.
+    '''
+    __slots__ = ["target", "replies", "actions"]
+
+    def __init__(self, target, replies=(), actions=()):
+        self.target = target
+        self.replies = tuple(replies)
+        self.actions = tuple(actions)
+
+
+class FlowState:
+    '''
+    The transitions out of one state, keyed by what `read(machine, message)` makes of the input (the
+    message text if no reader is given). An `automatic` state is left as soon as it is entered,
+    without waiting for another message, which lets an action's outcome choose the next state.
+    '''
+    __slots__ = ["transitions", "read", "automatic"]
+
+    def __init__(self, transitions, read=None, automatic=False):
+        self.transitions = transitions
+        self.read = read
+        self.automatic = automatic
+
+
+class Flow:
+    '''
+    A conversation flow as a transition table. Each message is dispatched with a dictionary lookup on
+    (state, input): `keywords` are checked first and apply in every state, then the current state's
+    transitions. An input with no transition leaves the state unchanged and gets no reply.
+    '''
+    def __init__(self, name, initial, terminal, states, keywords=None):
+        self.name = name
+        self.initial = initial
+        self.terminal = set(terminal)
+        self.states = states
+        self.keywords = keywords or {}
+
+    async def step(self, machine, message, mod_channels=None):
+        '''
+        Feed one message to `machine` (any object with a `state` attribute) and return the replies.
+        '''
+        transition = self.keywords.get(message.content)
+        if transition is None:
+            spec = self.states.get(machine.state)
+            if spec is None:
+                return []
+            transition = await self._lookup(machine, message, spec)
+            if transition is None:
+                return []
+
+        replies = []
+        while True:
+            for action in transition.actions:
+                result = action(machine, message, mod_channels)
+                if inspect.isawaitable(result):
+                    await result
+            machine.state = transition.target
+            replies.extend(reply if isinstance(reply, str) else reply(machine) for reply in transition.replies)
+
+            spec = self.states.get(machine.state)
+            if spec is None or not spec.automatic:
+                return replies
+            transition = await self._lookup(machine, message, spec)
+            if transition is None:
+                raise InvalidFlowError(f"{self.name}: automatic state {machine.state} has no transition for this input")
+
+    async def _lookup(self, machine, message, spec):
+        key = spec.read(machine, message) if spec.read else message.content
+        if inspect.isawaitable(key):
+            key = await key
+        transition = spec.transitions.get(key)
+        return transition if transition is not None else spec.transitions.get(ANY)
+
+    def _targets(self, state, keywords=True):
+        if state in self.terminal:
+            return []
+        targets = [transition.target for transition in self.states[state].transitions.values()]
+        if keywords:
+            targets += [transition.target for transition in self.keywords.values()]
+        return targets
+
+    def validate(self):
+        '''
+        Check that every transition leads to a known state, that every state is reachable from the
+        initial state, and that a terminal state is reachable from every state without the help of a
+        keyword (a flow that only ends when the user types `cancel` doesn't terminate). Raises
+        InvalidFlowError.
+        '''
+        known = set(self.states) | self.terminal
+        for state, spec in self.states.items():
+            if state in self.terminal:
+                raise InvalidFlowError(f"{self.name}: terminal state {state} has transitions")
+            if spec.automatic and ANY not in spec.transitions and spec.read is None:
+                raise InvalidFlowError(f"{self.name}: automatic state {state} needs a reader or a catch-all transition")
+            for transition in spec.transitions.values():
+                if transition.target not in known:
+                    raise InvalidFlowError(f"{self.name}: {state} leads to unknown state {transition.target}")
+        for transition in self.keywords.values():
+            if transition.target not in known:
+                raise InvalidFlowError(f"{self.name}: keyword leads to unknown state {transition.target}")
+
+        # Reachability from the initial state
+        reached = {self.initial}
+        frontier = deque([self.initial])
+        while frontier:
+            for target in self._targets(frontier.popleft()):
+                if target not in reached:
+                    reached.add(target)
+                    frontier.append(target)
+        unreachable = known - reached
+        if unreachable:
+            raise InvalidFlowError(f"{self.name}: unreachable states {sorted(s.name for s in unreachable)}")
+
+        # Termination: walk the state transitions backwards from the terminal states
+        sources = {}
+        for state in known:
+            for target in self._targets(state, keywords=False):
+                sources.setdefault(target, set()).add(state)
+        terminating = set(self.terminal)
+        frontier = deque(self.terminal)
+        while frontier:
+            for source in sources.get(frontier.popleft(), ()):
+                if source not in terminating:
+                    terminating.add(source)
+                    frontier.append(source)
+        stuck = known - terminating
+        if stuck:
+            raise InvalidFlowError(f"{self.name}: states that can never finish {sorted(s.name for s in stuck)}")
+        return self
@@ -0,0 +1,135 @@
+# user_stats.py
+import abc
+import json
+import os
+import sqlite3
+import threading
+from metrics import span
+
+
+class OffenderStore(abc.ABC):
+    '''
+    Interface for the per-user violation counts that decide when a repeat offender gets banned.
+    '''
+    @abc.abstractmethod
+    def increment(self, user, amount=1):
+        '''
+        Atomically add to a user's violation count and return the new count.
+        '''
+
+    @abc.abstractmethod
+    def get(self, user):
+        pass
+
+    @abc.abstractmethod
+    def import_json(self, path):
+        '''
+        Load counts from the old userStatistics.json format, keeping the larger count for users
+        that are already in the store.
+        '''
+
+    def close(self):
+        pass
+
+
+class SQLiteOffenderStore(OffenderStore):
+    '''
+    Offender counts in a SQLite database in WAL mode. Each increment is a single upsert, so its cost
+    doesn't depend on how many users are stored, and is committed right away: verdicts are rare, and an
+    open transaction would hold the database's write lock and lose the verdict on a crash.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS offenders (user TEXT PRIMARY KEY, violations INTEGER NOT NULL) WITHOUT ROWID")
+        self.conn.commit()
+
+    def increment(self, user, amount=1):
+        with span("offender_store.increment"), self.lock:
+            (violations,) = self.conn.execute(
+                "INSERT INTO offenders (user, violations) VALUES (?, ?) "
+                "ON CONFLICT (user) DO UPDATE SET violations = violations + excluded.violations "
+                "RETURNING violations", (user, amount)).fetchone()
+            self.conn.commit()
+            return violations
+
+    def get(self, user):
+        with span("offender_store.get"), self.lock:
+            row = self.conn.execute("SELECT violations FROM offenders WHERE user = ?", (user,)).fetchone()
+        return row[0] if row else 0
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM offenders").fetchone()[0]
+
+    def import_json(self, path):
+        if not os.path.isfile(path) or os.path.getsize(path) == 0:
+            return 0
+        with open(path) as f:
+            counts = json.load(f)
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO offenders (user, violations) VALUES (?, ?) "
+                "ON CONFLICT (user) DO UPDATE SET violations = max(violations, excluded.violations)",
+                counts.items())
+            self.conn.commit()
+        return len(counts)
+
+    def close(self):
+        self.conn.close()
+
+
+class JSONOffenderStore(OffenderStore):
+    '''
+    The original storage: the whole map in one JSON file, rewritten on every increment. Only suitable
+    for small deployments and tests.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return {}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def increment(self, user, amount=1):
+        with self.lock:
+            counts = self._load()
+            counts[user] = counts.get(user, 0) + amount
+            with open(self.path, 'w') as f:
+                json.dump(counts, f)
+            return counts[user]
+
+    def get(self, user):
+        with self.lock:
+            return self._load().get(user, 0)
+
+    def import_json(self, path):
+        with open(path) as f:
+            imported = json.load(f)
+        with self.lock:
+            counts = self._load()
+            for user, violations in imported.items():
+                counts[user] = max(counts.get(user, 0), violations)
+            with open(self.path, 'w') as f:
+                json.dump(counts, f)
+        return len(imported)
+
+
+def open_offender_store(path, legacy_json=None):
+    '''
+    Open the offender store at `path` (SQLite unless the path ends in .json). A new SQLite store is
+    seeded from `legacy_json`, the old userStatistics.json, if one is given.
+    '''
+    if path.endswith(".json"):
+        return JSONOffenderStore(path)
+    is_new = not os.path.isfile(path)
+    store = SQLiteOffenderStore(path)
+    if is_new and legacy_json:
+        store.import_json(legacy_json)
+    return store
@@ -0,0 +1,115 @@
+# username_cache.py
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class UsernameVerdictCache:
+    '''
+    Verdicts on authors' usernames, keyed by author ID and checked against the current name, so a
+    username is only sent to the classifier once per user and again whenever they rename. The most
+    recently used `max_entries` verdicts are kept in memory; every verdict is also written to a table
+    in a SQLite database, which keeps the `max_rows` most recently checked ones, so
+    verdicts survive restarts.
+    '''
+    def __init__(self, path, max_entries=10000, max_rows=200000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.entries = OrderedDict() # Map from author ID to (name, verdict), oldest use first
+        self.inflight = {} # Map from (author ID, name) to the future of a check that is running right now
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS usernames (
+                author_id INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                issue TEXT,
+                checked REAL NOT NULL
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS usernames_checked ON usernames (checked)")
+        self.conn.commit()
+        self.puts = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.renames = 0 # Lookups that found a verdict for the author's previous name
+
+    def get(self, author_id, name):
+        '''
+        Return the verdict for this author's current name as {"issue": description or None}, or None
+        if the name hasn't been checked.
+        '''
+        with self.lock:
+            entry = self.entries.get(author_id)
+            if entry is None:
+                row = self.conn.execute("SELECT name, issue FROM usernames WHERE author_id = ?", (author_id,)).fetchone()
+                if row is not None:
+                    entry = self._remember(author_id, row[0], {"issue": row[1]})
+            if entry is None or entry[0] != name:
+                self.misses += 1
+                self.renames += entry is not None
+                return None
+            self.entries.move_to_end(author_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, author_id, name, issue):
+        with self.lock:
+            self._remember(author_id, name, {"issue": issue})
+            self.conn.execute("INSERT OR REPLACE INTO usernames (author_id, name, issue, checked) VALUES (?, ?, ?, ?)",
+                              (author_id, name, issue, time.time()))
+            self.puts += 1
+            if self.puts % 1000 == 0:
+                self.conn.execute("DELETE FROM usernames WHERE author_id IN "
+                                  "(SELECT author_id FROM usernames ORDER BY checked DESC LIMIT -1 OFFSET ?)", (self.max_rows,))
+            self.conn.commit()
+
+    def _remember(self, author_id, name, verdict):
+        entry = self.entries[author_id] = (name, verdict)
+        self.entries.move_to_end(author_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    async def get_or_check(self, author_id, name, check):
+        '''
+        Return the issue with this author's username, awaiting `check()` and caching its result if the
+        name hasn't been checked. Concurrent misses for the same author and name share one check.
+        '''
+        verdict = self.get(author_id, name)
+        if verdict is not None:
+            return verdict["issue"]
+
+        key = (author_id, name)
+        pending = self.inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        pending = self.inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            issue = await check()
+            self.put(author_id, name, issue)
+            pending.set_result(issue)
+            return issue
+        except BaseException as e:
+            pending.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting on it
+            pending.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "renames": self.renames}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
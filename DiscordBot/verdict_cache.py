@@ -0,0 +1,136 @@
+# verdict_cache.py
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from report import normalize_text
+
+
+class VerdictCache:
+    '''
+    Bounded cache of classifier verdicts keyed on a hash of the normalized message text, so repeated
+    copies of the same message (spam waves, raids) are only sent to the classifier once. Entries are
+    evicted least-recently-used once `max_entries` is reached, and expire `ttl` seconds after they
+    were stored. Each classifier keeps its own namespace since their verdicts differ. The cache is
+    shared between the event loop and the classifier worker threads, so every access takes a lock.
+    '''
+    def __init__(self, max_entries=50000, ttl=6 * 60 * 60, snapshot_path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        self.entries = OrderedDict() # Map from key to (expiry time, verdict), oldest use first
+        self.lock = threading.Lock()
+        self.inflight = {} # Map from key to the future of a verdict that is being computed right now
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0 # Lookups that waited on an identical text already being classified
+
+    @staticmethod
+    def key(namespace, text):
+        digest = hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).hexdigest()
+        return f"{namespace}:{digest}"
+
+    def get(self, namespace, text):
+        '''
+        Return the cached verdict for this text, or None if there isn't a live one.
+        '''
+        key = self.key(namespace, text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, verdict = entry
+            if expires <= time.time():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return verdict
+
+    def put(self, namespace, text, verdict):
+        '''
+        Store a verdict: a JSON-serialisable dict such as {"toxic": ..., "scores": ..., "reason": ...}.
+        '''
+        key = self.key(namespace, text)
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, verdict)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    async def get_or_classify(self, namespace, text, classify):
+        '''
+        Return the cached verdict for this text, otherwise await `classify(text)` and cache its result.
+        Concurrent misses for the same text share a single classifier call.
+        '''
+        verdict = self.get(namespace, text)
+        if verdict is not None:
+            return verdict
+
+        key = self.key(namespace, text)
+        pending = self.inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        pending = self.inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            verdict = await classify(text)
+            self.put(namespace, text, verdict)
+            pending.set_result(verdict)
+            return verdict
+        except BaseException as e:
+            pending.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting on it
+            pending.exception()
+            raise
+        finally:
+            del self.inflight[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "coalesced": self.coalesced}
+
+    def save(self):
+        '''
+        Write the live entries to the snapshot file, least recently used first.
+        '''
+        if not self.snapshot_path:
+            return
+        now = time.time()
+        with self.lock:
+            entries = [[key, expires, verdict] for key, (expires, verdict) in self.entries.items() if expires > now]
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load(self):
+        '''
+        Warm the cache from the snapshot file, skipping entries that expired while we were down.
+        '''
+        if not self.snapshot_path or not os.path.isfile(self.snapshot_path):
+            return
+        with open(self.snapshot_path) as f:
+            entries = json.load(f)
+        now = time.time()
+        with self.lock:
+            for key, expires, verdict in entries[-self.max_entries:]:
+                if expires > now:
+                    self.entries[key] = (expires, verdict)